@@ -1,8 +1,10 @@
 import queue
 import logging
 import time
+from collections import OrderedDict
 from ..Sources.BaseSource import StatusCode
 from ..Shared.Internal import Statistics
+from .scheduler import PollScheduler
 
 class BaseController():
     """
@@ -12,6 +14,15 @@ class BaseController():
     :param shared: a reference to the shared object
 
     """
+    # sett til True i kontrollere som implementerer handle_write_sources
+    coalesce_writes = False
+    # sett til False for å skrive alle verdiene, ikke bare siste per kilde
+    coalesce_latest_only = True
+    write_batch_size = 1000
+    # korteste venting på innkommende meldinger når polling er forfalt.
+    # hindrer at tråden spinner når jobber har intervall 0
+    min_queue_timeout = 0.01
+
     def __init__(self, name, shared):
         self.name = name
         self.shared = shared
@@ -24,6 +35,12 @@ class BaseController():
             "last_minute": 0,
             "last_minute_time": ((time.time() // 60) * 60),
         }
+        # tidsplan for polling. opprettes første gang loop_outgoing kjøres
+        self.poll_scheduler = None
+        self._poll_jobs_changed = True
+        self._poll_stats_time = time.time()
+        # WRITE_SOURCE som venter på å bli skrevet samlet. nøkkel er kildenavn
+        self._pending_writes = OrderedDict()
 
     def _statistics_update_last_minute(self, increment):
         "Write internal statistics to the Statistics singleton if activated"
@@ -101,6 +118,19 @@ class BaseController():
         """
         if not self.has_source(name):
             self._sources[name] = init_value
+            self._poll_jobs_changed = True
+
+        if Statistics.on:
+            Statistics.set(self.name + ".sources.count", len(self._sources))
+
+    def remove_source(self, name):
+        """
+        Remove a source from the storage dict.
+        Override if something else is needed.
+        """
+        if self.has_source(name):
+            del self._sources[name]
+            self._poll_jobs_changed = True
 
         if Statistics.on:
             Statistics.set(self.name + ".sources.count", len(self._sources))
@@ -146,7 +176,7 @@ class BaseController():
         """
         try:
             if not self.has_interrupt():
-                item = self.incoming.get(block=True, timeout=self.queue_timeout)
+                item = self.incoming.get(block=True, timeout=self.get_queue_timeout())
                 self._statistics_update_last_minute(1)
                 return item
 
@@ -154,16 +184,44 @@ class BaseController():
             self._statistics_update_last_minute(0)
             return None
 
+    def get_queue_timeout(self):
+        """
+        Returns seconds to wait for the next incoming message. Called before
+        every message. Override to stop waiting at a deadline
+        """
+        return self.queue_timeout
+
     def loop_incoming(self):
         """
         Get every message from the queue and dispatch the associated handler function
         """
         try:
             while not self.has_interrupt():
-                messagetype, incoming = self.incoming.get(block=True, timeout=self.queue_timeout)
+                if self._pending_writes and (
+                        self.incoming.empty() or len(self._pending_writes) >= self.write_batch_size):
+                    self.flush_writes()
+
+                messagetype, incoming = self.incoming.get(block=True, timeout=self.get_queue_timeout())
 
                 self._statistics_update_last_minute(1)
 
+                if messagetype == self.messagetypes.WRITE_SOURCE and self.coalesce_writes:
+                    if self.coalesce_latest_only:
+                        # bare siste verdi per kilde blir skrevet
+                        key = incoming[0].key
+                        if key in self._pending_writes:
+                            self._pending_writes.move_to_end(key)
+                    else:
+                        # alle verdiene blir skrevet, i samme rekkefølge
+                        key = len(self._pending_writes)
+                    self._pending_writes[key] = incoming
+                    self.incoming.task_done()
+                    continue
+
+                if self._pending_writes:
+                    # andre meldinger kan avhenge av skrivingene. skriver dem først
+                    self.flush_writes()
+
                 if messagetype == self.messagetypes.READ_ALL:
                     self.handle_readall(incoming)
                 elif messagetype == self.messagetypes.ADD_SOURCE:
@@ -174,6 +232,8 @@ class BaseController():
                     self.handle_write_source(incoming[0], incoming[1], incoming[2])
                 elif messagetype == self.messagetypes.ADD_PARSER:
                     self.handle_add_parser(incoming)
+                elif messagetype == self.messagetypes.REMOVE_SOURCE:
+                    self.handle_remove_source(incoming)
                 elif messagetype == self.messagetypes.TICK:
                     self.handle_tick(incoming)
                 else:
@@ -183,6 +243,17 @@ class BaseController():
         except queue.Empty:
             self._statistics_update_last_minute(0)
 
+        if self._pending_writes:
+            self.flush_writes()
+
+    def flush_writes(self):
+        "Send the pending writes to :meth:`handle_write_sources`"
+        writes = list(self._pending_writes.values())
+        self._pending_writes.clear()
+        if Statistics.on:
+            Statistics.set(self.name + ".write.batch.size", len(writes))
+        self.handle_write_sources(writes)
+
     def handle_tick(self, incoming):
         """
         Answer the tick message
@@ -202,15 +273,130 @@ class BaseController():
     def handle_read_source(self, incoming):
         raise NotImplementedError
 
+    def handle_remove_source(self, incoming):
+        """
+        Remove the source from controller. The source is no longer used
+        by any expressions. Override if the source must be removed from an
+        external system. I.e. a subscription.
+        """
+        self.remove_source(incoming.key)
+
     def handle_write_source(self, incoming, value, source_time):
         raise NotImplementedError
 
+    def handle_write_sources(self, writes):
+        """
+        Write many sources at once. Only used if :attr:`coalesce_writes`
+        is True. WRITE_SOURCE messages are then collected until the queue
+        is empty. Only the latest value of each source is written, unless
+        :attr:`coalesce_latest_only` is False.
+        Override to write the values with as few requests as possible.
+
+        :param list writes: list of (source, value, source_time) tuples
+        """
+        for incoming, value, source_time in writes:
+            self.handle_write_source(incoming, value, source_time)
+
     def loop_outgoing(self):
         """
-        Check every source and call the poll_outgoing_item function
+        Check every poll job and call the poll_job function.
+        Jobs are polled back-to-back unless scan intervals are
+        configured. See :meth:`get_poll_scheduler`
         """
-        for item in self.get_sources().values():
-            self.poll_outgoing_item(item)
+        scheduler = self.get_poll_scheduler()
+        if not scheduler:
+            self.poll_jobs([item for name, interval, item in self.get_poll_jobs()])
+            return
+
+        if self._poll_jobs_changed:
+            self._poll_jobs_changed = False
+            scheduler.set_jobs(self.get_poll_jobs())
+
+        self.poll_jobs(scheduler.pop_due())
+
+        # venter ikke lenger på innkommende meldinger enn til neste poll
+        time_to_next = scheduler.time_to_next()
+        if time_to_next is None:
+            time_to_next = 0.1
+        self.queue_timeout = max(self.min_queue_timeout, min(0.1, time_to_next))
+        self.poll_statistics_update(scheduler)
+
+    def get_poll_scheduler(self):
+        """
+        Returns a :class:`netdef.Controllers.scheduler.PollScheduler` if
+        poll intervals are configured, otherwise None. Config:
+
+        .. code-block:: ini
+
+            [MyController]
+            scan_interval = 1.0
+            scan_jitter = 0.1
+
+            [MyController_scan_intervals]
+            source_key = 10.0
+
+        ``scan_interval`` is the default interval in seconds. 0 is as fast
+        as possible. ``scan_jitter`` adds a random delay of 0 to
+        ``scan_jitter * interval`` seconds to spread the load.
+        The ``[MyController_scan_intervals]`` section overrides the interval
+        of given sources or groups. See :meth:`get_scan_interval`.
+        """
+        if self.poll_scheduler is None:
+            # leses uten å legge til standardverdier. kontrollere uten
+            # tidsplan skal ikke få nye verdier i konfig (og webadmin)
+            config = self.shared.config.config
+            self.scan_interval = config(self.name, "scan_interval", 0.0, False)
+            section = self.name + "_scan_intervals"
+            if self.shared.config.has_section(section):
+                self.scan_intervals = self.shared.config.get_dict(section)
+            else:
+                self.scan_intervals = {}
+            if self.scan_interval or self.scan_intervals:
+                self.poll_scheduler = PollScheduler(config(self.name, "scan_jitter", 0.0, False))
+            else:
+                self.poll_scheduler = False
+        return self.poll_scheduler
+
+    def get_scan_interval(self, *names):
+        """
+        Returns the scan interval of the first name found in the
+        ``[MyController_scan_intervals]`` section, or the default interval.
+        The names can be a source key and the group it belongs to.
+        """
+        for name in names:
+            if str(name) in self.scan_intervals:
+                return float(self.scan_intervals[str(name)])
+        return self.scan_interval
+
+    def get_poll_jobs(self):
+        """
+        Returns an iterable of (name, interval, item) tuples. The item
+        is given to :meth:`poll_job` when due. Default is one job per source.
+        Override to poll groups of sources.
+        """
+        scheduler = self.get_poll_scheduler()
+        for name, item in self.get_sources().items():
+            yield name, self.get_scan_interval(name) if scheduler else 0, item
+
+    def poll_jobs(self, items):
+        "Poll the items of the poll jobs that are due. Override to poll in parallel"
+        for item in items:
+            self.poll_job(item)
+
+    def poll_job(self, item):
+        "Poll the item of a poll job. Default is poll_outgoing_item"
+        self.poll_outgoing_item(item)
+
+    def poll_statistics_update(self, scheduler):
+        "Write scan rate and overruns to Statistics every 10 seconds"
+        now = time.time()
+        if Statistics.on and now - self._poll_stats_time >= 10:
+            ns = self.name + ".poll."
+            Statistics.set(ns + "jobs.count", len(scheduler.jobs))
+            Statistics.set(ns + "rate", round(scheduler.poll_count / (now - self._poll_stats_time), 1))
+            Statistics.set(ns + "overrun.count", scheduler.overrun_count)
+            scheduler.poll_count = 0
+            self._poll_stats_time = now
 
     def poll_outgoing_item(self, item):
         raise NotImplementedError
@@ -223,6 +409,24 @@ class BaseController():
             outgoing
         )
 
+    def send_outgoing_batch(self, outgoing_list):
+        """
+        Send one RUN_EXPRESSION_BATCH message per rule for a list of
+        sources that changed at the same time
+        """
+        by_rule = {}
+        for outgoing in outgoing_list:
+            by_rule.setdefault(outgoing.rule, []).append(outgoing)
+        for rule, items in by_rule.items():
+            if len(items) == 1:
+                self.send_outgoing(items[0])
+            else:
+                self.shared.queues.send_message_to_rule(
+                    self.shared.queues.MessageType.RUN_EXPRESSION_BATCH,
+                    rule,
+                    items
+                )
+
     def statistics_update(self):
         self._statistics_update_last_minute(0)
 
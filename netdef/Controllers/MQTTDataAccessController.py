@@ -1,6 +1,9 @@
 import logging
+import struct
+import threading
 import paho.mqtt.client as mqtt
 from netdef.Controllers import BaseController, Controllers
+from netdef.Controllers.mqtt.topictrie import TopicTrie
 from netdef.Sources.BaseSource import StatusCode
 
 # import my supported sources
@@ -12,7 +15,49 @@ class MQTTDataAccessController(BaseController.BaseController):
     """
     .. danger:: Development Status :: 3 - Alpha
 
+    The paho network loop runs in its own thread. It connects, reconnects
+    and receives messages while the controller thread handles incoming
+    messages. Pending writes are drained from the queue and published
+    together, every value in order.
+
+    Config:
+
+    .. code-block:: ini
+
+        [MQTTDataAccessController]
+        reconnect_timeout = 20
+        publish_batch_size = 1000
+
+    ``reconnect_timeout`` is the max delay in seconds between reconnect
+    attempts. ``publish_batch_size`` is the max number of writes that are
+    published together.
+
+    Use :class:`netdef.Sources.MQTTDataAccessBinarySource.MQTTDataAccessBinarySource`
+    for a compact binary payload instead of json.
+
+    Received messages are routed to the sources by a topic trie
+    (:class:`netdef.Controllers.mqtt.topictrie.TopicTrie`). The topics in
+    ``[MQTTDataAccessController_subscribe_topics]`` can have the wildcards
+    ``+`` and ``#``, so one subscription can feed many sources. A source
+    key can also have wildcards. The source then gets the value of every
+    matching topic.
+
+    .. code-block:: ini
+
+        [MQTTDataAccessController]
+        topic_prefix = DA/
+        auto_subscribe_on = 0
+
+        [MQTTDataAccessController_subscribe_topics]
+        plant1 = plant1/#
+
+    With ``auto_subscribe_on = 1`` the controller subscribes to the topic of
+    every source that is not covered by a subscription in the list.
     """
+    # skrivinger som hoper seg opp publiseres samlet, alle verdiene
+    coalesce_writes = True
+    coalesce_latest_only = False
+
     def __init__(self, name, shared):
         super().__init__(name, shared)
         self.logger = logging.getLogger(self.name)
@@ -24,12 +69,23 @@ class MQTTDataAccessController(BaseController.BaseController):
         self.host = config(self.name, "host", "127.0.0.1")
         self.port = config(self.name, "port", 1883)
         self.keepalive = config(self.name, "keepalive", 60)
+        self.reconnect_timeout = config(self.name, "reconnect_timeout", 20)
+        self.write_batch_size = config(self.name, "publish_batch_size", 1000)
 
         self.subscribe_list = config(self.name, "subscribe_topics", "{}_subscribe_topics".format(self.name))
 
         self.subscribe_topics = [
             topic for topic in self.shared.config.get_dict(self.subscribe_list).values()
         ]
+        self.auto_subscribe_on = config(self.name, "auto_subscribe_on", 0)
+        self.auto_subscribed = set()
+
+        # filtrene det abonneres på, og kildene hver topic skal rutes til
+        self.subscriptions = TopicTrie()
+        for topic in self.subscribe_topics:
+            self.subscriptions.add(self.get_topic(topic), topic)
+        self.routes = TopicTrie()
+        self.routes_lock = threading.Lock()
 
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
@@ -45,63 +101,89 @@ class MQTTDataAccessController(BaseController.BaseController):
         return topic
     
     def mqtt_connect(self):
-        self.client.connect(self.host, self.port, self.keepalive)
+        "Connect in the network thread. Reconnects if the connection is lost"
+        self.client.reconnect_delay_set(min_delay=1, max_delay=self.reconnect_timeout)
+        self.client.connect_async(self.host, self.port, self.keepalive)
     
     def mqtt_safe_disconnect(self):
         self.client.disconnect()
 
     def on_connect(self, client, userdata, flags, rc):
         self.logger.debug("Connected with result code %s", rc)
-        for topic in self.subscribe_topics:
-            client.subscribe(self.get_topic(topic))
-            self.logger.info("subscribe to %s", self.get_topic(topic))
+        topics = [(self.get_topic(topic), 0) for topic in list(self.subscribe_topics)]
+        if topics:
+            # ett SUBSCRIBE for alle topics
+            client.subscribe(topics)
+        for topic, qos in topics:
+            self.logger.info("subscribe to %s", topic)
+
+    def add_source(self, name, init_value):
+        "Add the source and its route"
+        if not self.has_source(name):
+            with self.routes_lock:
+                self.routes.add(self.get_topic(name), init_value)
+        super().add_source(name, init_value)
+
+    def remove_source(self, name):
+        "Remove the source, its route and its automatic subscription"
+        if self.has_source(name):
+            with self.routes_lock:
+                self.routes.remove(self.get_topic(name), self.get_source(name))
+            if name in self.auto_subscribed:
+                self.auto_subscribed.remove(name)
+                self.subscribe_topics.remove(name)
+                self.subscriptions.remove(self.get_topic(name), name)
+                self.client.unsubscribe(self.get_topic(name))
+        super().remove_source(name)
+
+    def auto_subscribe(self, name):
+        "Subscribe to the topic of the source if no subscription covers it"
+        topic = self.get_topic(name)
+        if not self.subscriptions.match(topic):
+            self.auto_subscribed.add(name)
+            self.subscribe_topics.append(name)
+            self.subscriptions.add(topic, name)
+            # er vi ikke tilkoblet blir det abonnert i on_connect
+            self.client.subscribe(topic)
     
     def on_disconnect(self, client, userdata, rc):
         self.logger.debug("Disconnected with result code %s", rc)
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            self.logger.error("Connection lost. Reconnect in max %s sec.", self.reconnect_timeout)
+            self.statistics_update()
 
     def on_message(self, client, userdata, msg):
+        "Called in the network thread. Sends the value to every matching source"
         self.logger.debug("%s %s ", msg.topic, msg.payload)
-        item_key = self.get_key(msg.topic)
-        if self.has_source(item_key):
-            item = self.get_source(item_key)
-            item_key, data = item.parse_message(item_key, msg.payload)
+        with self.routes_lock:
+            items = self.routes.match(msg.topic)
+        topic_key = self.get_key(msg.topic)
+        for item in items:
+            try:
+                item_key, data = item.parse_message(topic_key, msg.payload)
+            except (ValueError, KeyError, IndexError, struct.error) as error:
+                # et ugyldig payload skal ikke stoppe nettverkstråden
+                self.logger.error("%s: invalid payload: %s", msg.topic, error)
+                continue
             if item.can_unpack_value(data):
                 key, stime, value = item.unpack_value(data)
-                assert item_key == key
+                if item_key != key:
+                    self.logger.error("%s: payload is for key %s", msg.topic, key)
+                    continue
                 if self.update_source_instance_value(item, value, stime, True, False):
                     self.send_outgoing(item)
     
-    def loop_mqtt(self):
-        rc = self.client.loop(timeout=1.0)
-        # if rc != mqtt.MQTT_ERR_SUCCESS:
-        if rc == mqtt.MQTT_ERR_CONN_LOST:
-            raise OSError(mqtt.error_string(rc))
-
     def run(self):
         "Main loop. Will exit when receiving interrupt signal"
         self.logger.info("Running")
-        can_reconnect = False
-        reconnect_timeout = 0
+        self.mqtt_connect()
+        self.client.loop_start()
 
         while not self.has_interrupt():
-            self.sleep(reconnect_timeout)
-            reconnect_timeout = self.shared.config.config(self.name, "reconnect_timeout", 20)
-            try:
-                if can_reconnect:
-                    self.mqtt_safe_disconnect()
-
-                self.mqtt_connect()
-                can_reconnect = True
-
-                while not self.has_interrupt():
-                    self.loop_incoming() # dispatch handle_* functions
-                    self.loop_mqtt()
-
-            except OSError as error:
-                self.logger.debug("Exception: %s", error)
-                self.logger.error("Connection error. Reconnect in %s sec.", reconnect_timeout)
-                self.statistics_update()
+            self.loop_incoming() # dispatch handle_* functions
 
+        self.mqtt_safe_disconnect()
+        self.client.loop_stop()
         self.logger.info("Stopped")
 
     def publish_data_item(self, topic, payload):
@@ -110,9 +192,17 @@ class MQTTDataAccessController(BaseController.BaseController):
     def handle_add_source(self, incoming):
         self.logger.debug("'Add source' event for %s", incoming.key)
         self.add_source(incoming.key, incoming)
+        if self.auto_subscribe_on:
+            self.auto_subscribe(incoming.key)
 
     def handle_write_source(self, incoming, value, source_time):
         self.logger.debug("'Write source' event to %s. value: %s at: %s", incoming.key, value, source_time)
         data = incoming.pack_value(value, source_time)
         topic, payload = incoming.make_message(incoming.key, data)
         self.publish_data_item(topic, payload)
+
+    def handle_write_sources(self, writes):
+        "Publish every pending write. The network thread sends them together"
+        self.logger.debug("'Write sources' event. %s values", len(writes))
+        for incoming, value, source_time in writes:
+            self.handle_write_source(incoming, value, source_time)
@@ -1,10 +1,15 @@
 import logging
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pymodbus.client.sync import ModbusTcpClient as ModbusClient
 from pymodbus.exceptions import ModbusIOException, ConnectionException
 
 from . import BaseController, Controllers
+from .modbus.planner import plan_reads, plan_writes, MAX_REGISTERS
+from .modbus.backoff import Backoff
 from ..Sources.BaseSource import StatusCode
+from ..Shared.Internal import Statistics
 
 log = logging.getLogger(__name__)
 log.debug("Loading module")
@@ -14,7 +19,69 @@ class ModbusClientController(BaseController.BaseController):
     """
     .. caution:: Development Status :: 4 - Beta
 
+    Holding registers are read in blocks. Addresses on the same unit
+    that are next to each other are read with one request.
+
+    Config:
+
+    .. code-block:: ini
+
+        [ModbusClientController]
+        host = 0.0.0.0
+        port = 5020
+        block_gap = 0
+        block_max_count = 125
+        scan_interval = 0
+        scan_jitter = 0
+
+        [ModbusClientController_scan_intervals]
+        1 = 1.0
+        1:100 = 10.0
+
+    ``block_gap`` is the number of unused registers that may be read
+    to merge two blocks. ``block_max_count`` is the max number of
+    registers in one request.
+
+    ``scan_interval`` is the default poll interval in seconds. 0 is as fast
+    as possible. In ``[ModbusClientController_scan_intervals]`` the interval
+    can be set for a unit (``1``) or a register (``1:100``).
+    See :meth:`netdef.Controllers.BaseController.BaseController.get_poll_scheduler`
+
+    Units can be polled in parallel. Every device in the devicelist has
+    its own connection. Units that are not in the devicelist share the
+    connection to ``host`` and ``port``. A unit that fails is not polled
+    again until the backoff time has passed, so it does not stall the
+    other units. The sources of the unit are sent to the rules with
+    status invalid. After a connection error the connection is closed, and
+    the next request after the backoff connects again:
+
+    .. code-block:: ini
+
+        [ModbusClientController]
+        timeout = 3
+        max_workers = 4
+        backoff_min = 1
+        backoff_max = 60
+        devicelist = ModbusClientController_devices
+
+        [ModbusClientController_devices]
+        ModbusClientController_device2 = 1
+
+        [ModbusClientController_device2]
+        device_id = 2
+        host = 10.0.0.2
+        port = 502
+        timeout = 0.5
+
+    ``max_workers`` is the max number of connections that are polled at
+    the same time. 1 polls every unit in the controller thread.
+
+    Pending writes are coalesced. Only the latest value of each register
+    is written, and contiguous registers are written with one
+    write_registers request.
     """
+    coalesce_writes = True
+
     def __init__(self, name, shared):
         super().__init__(name, shared)
         self.logger = logging.getLogger(name)
@@ -22,9 +89,47 @@ class ModbusClientController(BaseController.BaseController):
 
         self.oldnew = self.shared.config.config(self.name, "oldnew_comparision", 1)
 
-        host = self.shared.config.config(self.name, "host", '0.0.0.0')
-        port = self.shared.config.config(self.name, "port", 5020)
-        self.client = ModbusClient(host, port=port)
+        config = self.shared.config.config
+        host = config(self.name, "host", '0.0.0.0')
+        port = config(self.name, "port", 5020)
+        timeout = config(self.name, "timeout", 3.0)
+        self.client = ModbusClient(host, port=port, timeout=timeout)
+
+        # en tilkobling per enhet i devicelist. resten deler self.client
+        # låsen hindrer at flere tråder bruker samme tilkobling samtidig
+        self.clients = {"": (self.client, threading.Lock())}
+        self.unit_clients = {}
+        conf_device_list = config(self.name, "devicelist", self.name + "_devices")
+        self.shared.config.add_section(conf_device_list)
+        for deviceconfig, deviceenabled in self.shared.config.get_dict(conf_device_list).items():
+            if int(deviceenabled):
+                device_id = config(deviceconfig, "device_id", 0)
+                device_client = ModbusClient(
+                    config(deviceconfig, "host", host),
+                    port=config(deviceconfig, "port", port),
+                    timeout=config(deviceconfig, "timeout", timeout)
+                )
+                self.clients[deviceconfig] = (device_client, threading.Lock())
+                self.unit_clients[device_id] = deviceconfig
+
+        self.backoff_min = config(self.name, "backoff_min", 1.0)
+        self.backoff_max = config(self.name, "backoff_max", 60.0)
+        self.backoffs = {}
+
+        max_workers = config(self.name, "max_workers", 1)
+        if max_workers > 1:
+            self.executor = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix=self.name
+            )
+        else:
+            self.executor = None
+        self.in_flight = set()
+
+        self.block_gap = self.shared.config.config(self.name, "block_gap", 0)
+        self.block_max_count = self.shared.config.config(self.name, "block_max_count", MAX_REGISTERS)
+        # planen lages på nytt når kilder legges til eller fjernes
+        self.read_plan = None
 
     def run(self):
         "Main loop. Will exit when receiving interrupt signal"
@@ -52,6 +157,8 @@ class ModbusClientController(BaseController.BaseController):
                 self.logger.debug("Exception: %s", error)
                 self.logger.error("Connection error. Reconnect in %s sec.", reconnect_timeout)
 
+        if self.executor:
+            self.executor.shutdown(wait=True)
         self.safe_disconnect()
         self.logger.info("Stopped")
 
@@ -60,16 +167,35 @@ class ModbusClientController(BaseController.BaseController):
         for item in self.get_sources().values():
             item.status_code = StatusCode.NONE
 
-        try:
-            self.client.close()
-        except Exception as error:
-            self.logger.warning("Cannot disconnect client: %s", error)
+        for client, lock in self.clients.values():
+            try:
+                with lock:
+                    client.close()
+            except Exception as error:
+                self.logger.warning("Cannot disconnect client: %s", error)
+
+    def get_client(self, unit):
+        "Returns the (client, lock) tuple of given unit"
+        return self.clients[self.unit_clients.get(unit, "")]
+
+    def get_backoff(self, unit):
+        "Returns the :class:`netdef.Controllers.modbus.backoff.Backoff` of given unit"
+        backoff = self.backoffs.get(unit)
+        if backoff is None:
+            # kalles fra flere tråder. setdefault sørger for bare én instans
+            backoff = self.backoffs.setdefault(unit, Backoff(self.backoff_min, self.backoff_max))
+        return backoff
 
     def handle_readall(self, incoming):
         raise NotImplementedError
 
     def handle_add_source(self, incoming):
         self.add_source(incoming.key, incoming)
+        self.read_plan = None
+
+    def remove_source(self, name):
+        super().remove_source(name)
+        self.read_plan = None
 
     def handle_read_source(self, incoming):
         raise NotImplementedError
@@ -77,9 +203,11 @@ class ModbusClientController(BaseController.BaseController):
     def handle_write_source(self, incoming, value, source_time):
         if hasattr(incoming, "unpack_unit_and_address"):
             slave_unit, register = incoming.unpack_unit_and_address()
+            client, lock = self.get_client(slave_unit)
 
             try:
-                write_result = self.client.write_register(register, value, unit=slave_unit)
+                with lock:
+                    write_result = client.write_register(register, value, unit=slave_unit)
                 if isinstance(write_result, ModbusIOException):
                     raise ModbusIOException
 
@@ -97,17 +225,149 @@ class ModbusClientController(BaseController.BaseController):
                     slave_unit, register, value, source_time
                     )
 
-    def poll_outgoing_item(self, item):
-        if hasattr(item, "unpack_unit_and_address"):
-            slave_unit, register = item.unpack_unit_and_address()
+    def handle_write_sources(self, writes):
+        "Write contiguous registers with one write_registers request"
+        items = []
+        for incoming, value, source_time in writes:
+            if hasattr(incoming, "unpack_unit_and_address"):
+                slave_unit, register = incoming.unpack_unit_and_address()
+                items.append((slave_unit, register, value))
+
+        for slave_unit, register, values in plan_writes(items):
+            client, lock = self.get_client(slave_unit)
             try:
-                read_result = self.client.read_holding_registers(register, 1, unit=slave_unit)
-                if isinstance(read_result, ModbusIOException):
+                with lock:
+                    if len(values) == 1:
+                        write_result = client.write_register(register, values[0], unit=slave_unit)
+                    else:
+                        write_result = client.write_registers(register, values, unit=slave_unit)
+                if isinstance(write_result, ModbusIOException):
                     raise ModbusIOException
-                status_ok = read_result.function_code < 0x80
-                value = read_result.registers[0]
-                stime = datetime.datetime.utcnow()
+
+                status_ok = write_result.function_code < 0x80
+                if not status_ok:
+                    self.logger.error(
+                        "Write error on modbus unit:%s register:%s values:%s",
+                        slave_unit, register, values
+                        )
+
+            except Exception as write_error:
+                self.logger.exception(write_error)
+                self.logger.error(
+                    "Write error on modbus unit:%s register:%s values:%s",
+                    slave_unit, register, values
+                    )
+
+    def get_read_plan(self):
+        """
+        Returns a list of (interval, block) tuples where block is a
+        :class:`netdef.Controllers.modbus.planner.ReadBlock`
+        """
+        if self.read_plan is None:
+            # registre med ulikt intervall kan ikke leses i samme blokk
+            scheduler = self.get_poll_scheduler()
+            by_interval = {}
+            for item in self.get_sources().values():
+                if hasattr(item, "unpack_unit_and_address"):
+                    slave_unit, register = item.unpack_unit_and_address()
+                    interval = self.get_scan_interval(item.key, slave_unit) if scheduler else 0
+                    by_interval.setdefault(interval, []).append((slave_unit, register, item))
+
+            self.read_plan = []
+            for interval, items in sorted(by_interval.items()):
+                for block in plan_reads(items, self.block_gap, self.block_max_count):
+                    self.read_plan.append((interval, block))
+            if Statistics.on:
+                Statistics.set(self.name + ".poll.blocks.count", len(self.read_plan))
+        return self.read_plan
+
+    def get_poll_jobs(self):
+        "Returns one poll job for every block in the read plan"
+        for interval, block in self.get_read_plan():
+            name = (block.unit, block.start, block.count)
+            yield name, interval, block
+
+    def poll_jobs(self, items):
+        """
+        Poll the blocks. If max_workers is more than 1 the blocks are
+        grouped by connection and each connection is polled in parallel.
+        A connection that is still busy with the previous poll is skipped.
+        """
+        if self.executor is None:
+            for block in items:
+                self.poll_block(block)
+            return
+
+        by_client = {}
+        for block in items:
+            by_client.setdefault(self.unit_clients.get(block.unit, ""), []).append(block)
+
+        for client_name, blocks in by_client.items():
+            if client_name in self.in_flight:
+                if Statistics.on:
+                    Statistics.set(self.name + ".poll.skipped." + (client_name or "default"), len(blocks))
+                continue
+            self.in_flight.add(client_name)
+            future = self.executor.submit(self.poll_blocks, blocks)
+            future.add_done_callback(lambda f, name=client_name: self.in_flight.discard(name))
+
+    def poll_blocks(self, blocks):
+        "Read the blocks in sequence. Runs in a worker thread"
+        for block in blocks:
+            if self.has_interrupt():
+                break
+            self.poll_block(block)
+
+    def poll_job(self, item):
+        self.poll_block(item)
+
+    def poll_block(self, block):
+        "Read a block of registers and update the sources"
+        backoff = self.get_backoff(block.unit)
+        if not backoff.is_ready():
+            return
+
+        client, lock = self.get_client(block.unit)
+        try:
+            with lock:
+                read_result = client.read_holding_registers(block.start, block.count, unit=block.unit)
+            if isinstance(read_result, ModbusIOException):
+                raise ModbusIOException
+            backoff.succeeded()
+            status_ok = read_result.function_code < 0x80
+            stime = datetime.datetime.utcnow()
+            if status_ok:
+                values = block.get_values(read_result.registers)
+            else:
+                self.logger.error(
+                    "Read error on modbus unit:%s register:%s count:%s",
+                    block.unit, block.start, block.count
+                    )
+                values = [(item, item.get) for address, item in block.items]
+            for item, value in values:
                 if self.update_source_instance_value(item, value, stime, status_ok, self.oldnew):
                     self.send_outgoing(item)
-            except ModbusIOException as error:
-                self.logger.exception(error)
+        except (ModbusIOException, ConnectionException, ConnectionError, OSError) as error:
+            delay = backoff.failed()
+            self.logger.error(
+                "No response from modbus unit:%s. Retry in %s sec. %s",
+                block.unit, delay, error
+                )
+            if not isinstance(error, ModbusIOException):
+                # tilkoblingen lukkes. neste forespørsel etter backoff kobler til på nytt
+                try:
+                    with lock:
+                        client.close()
+                except Exception as close_error:
+                    self.logger.warning("Cannot disconnect client: %s", close_error)
+            # reglene får beskjed om kilder som blir ugyldige
+            stime = datetime.datetime.utcnow()
+            changed = []
+            for address, item in block.items:
+                prev_status = item.status_code
+                self.update_source_instance_value(item, item.get, stime, False, self.oldnew)
+                if item.status_code != prev_status:
+                    changed.append(item)
+            self.send_outgoing_batch(changed)
+            if Statistics.on:
+                Statistics.set(self.name + ".unit.{}.failures.count".format(block.unit), backoff.failures)
@@ -10,6 +10,7 @@ from pymodbus.datastore import ModbusSlaveContext
 from . import BaseController, Controllers
 from ..Sources.BaseSource import StatusCode
 from ..Sources.HoldingRegisterSource import HoldingRegisterSource
+from .modbus.planner import plan_writes
 from ..Shared.Internal import Statistics
 
 @Controllers.register("ModbusServerController")
@@ -17,7 +18,11 @@ class ModbusServerController(BaseController.BaseController):
     """
     .. tip:: Development Status :: 5 - Production/Stable
 
+    Pending writes are coalesced. Only the latest value of each register
+    is written, and contiguous registers are written with one setValues call.
     """
+    coalesce_writes = True
+
     def __init__(self, name, shared):
         super().__init__(name, shared)
         self.logger = logging.getLogger(name)
@@ -28,6 +33,9 @@ class ModbusServerController(BaseController.BaseController):
         self.send_events_external = config(self.name, "send_events_on_external", 1)
         self.oldnew = config(self.name, "oldnew_comparision", 1)
 
+        # (unit, address) -> kilde. slipper å lage "unit:address" per register
+        self.source_index = {}
+
         self.context = self.get_modbus_server_context()
 
         framer = self.get_framer()
@@ -123,6 +131,15 @@ class ModbusServerController(BaseController.BaseController):
         incoming.get = 0
         incoming.status_code = StatusCode.NONE
         self.add_source(incoming.key, incoming)
+        if isinstance(incoming, HoldingRegisterSource):
+            self.source_index[tuple(incoming.unpack_unit_and_address())] = incoming
+
+    def remove_source(self, name):
+        if self.has_source(name):
+            item = self.get_source(name)
+            if isinstance(item, HoldingRegisterSource):
+                self.source_index.pop(tuple(item.unpack_unit_and_address()), None)
+        super().remove_source(name)
 
     def handle_write_source(self, incoming, value, source_time):
         if isinstance(incoming, HoldingRegisterSource):
@@ -130,18 +147,50 @@ class ModbusServerController(BaseController.BaseController):
             self.context[unit].setValues(self.writefunction, address, [value], True)
         self.logger.debug("'Write source' event to %s. value: %s at %s", incoming.key, value, source_time)
 
+    def handle_write_sources(self, writes):
+        "Write contiguous registers with one setValues call"
+        items = []
+        for incoming, value, source_time in writes:
+            if isinstance(incoming, HoldingRegisterSource):
+                unit, address = incoming.unpack_unit_and_address()
+                items.append((unit, address, value))
+        for unit, address, values in plan_writes(items):
+            self.context[unit].setValues(self.writefunction, address, values, True)
+        self.logger.debug("'Write source' event to %d sources", len(items))
+
     def handle_datachange(self, unit, address, value, is_internal):
-        name = HoldingRegisterSource.pack_unit_and_address(unit, address)
+        "Update the source of given register. See :meth:`handle_datachanges`"
+        self.handle_datachanges(unit, address, [value], is_internal)
 
-        if self.has_source(name):
-            item = self.get_source(name)
-            stime = datetime.datetime.utcnow()
-            status_ok = True
-            if self.update_source_instance_value(item, value, stime, status_ok, self.oldnew):
-                if is_internal and self.send_events_internal:
-                    self.send_outgoing(item)
-                elif not is_internal and self.send_events_external:
-                    self.send_outgoing(item)
+    def handle_datachanges(self, unit, address, values, is_internal):
+        """
+        Update the sources of a range of registers. Called once per
+        write request. Changed sources are sent to the rules in one batch.
+
+        :param int unit: modbus unit
+        :param int address: address of the first register
+        :param list values: register values
+        :param bool is_internal: True if written by the controller itself
+        """
+        if is_internal:
+            send_events = self.send_events_internal
+        else:
+            send_events = self.send_events_external
+
+        source_index = self.source_index
+        stime = None
+        changed = []
+        for i, value in enumerate(values):
+            item = source_index.get((unit, address + i))
+            if item is None:
+                continue
+            if stime is None:
+                stime = datetime.datetime.utcnow()
+            if self.update_source_instance_value(item, value, stime, True, self.oldnew):
+                changed.append(item)
+
+        if send_events and changed:
+            self.send_outgoing_batch(changed)
 
 class MyController(ModbusTcpServer):
     def __init__(self, *args, **kwargs):
@@ -165,10 +214,9 @@ class MyContext(ModbusSlaveContext):
 
     def setValues(self, fx, address, values, is_internal=False):
         super().setValues(fx, address, values)
-        for i, value in enumerate(values):
-            self.controller.handle_datachange(
-                self.device_id,
-                address + i,
-                value,
-                is_internal
-            )
+        self.controller.handle_datachanges(
+            self.device_id,
+            address,
+            values,
+            is_internal
+        )
@@ -1,10 +1,14 @@
 import logging
 import time
+import datetime
 import concurrent.futures
 import opcua
+from opcua import ua
 
 from . import BaseController, Controllers
+from .ua.subscription import create_subscription
 from ..Sources.BaseSource import StatusCode
+from ..Shared.Internal import Statistics
 
 log = logging.getLogger(__name__)
 log.debug("Loading module")
@@ -14,7 +18,30 @@ class OPCUAClientController(BaseController.BaseController):
     """
     .. caution:: Development Status :: 4 - Beta
 
+    Node instances and variant types are cached per source. Pending
+    writes are coalesced and sent with one Write service call per
+    ``max_nodes_per_write`` nodes.
+
+    Monitored items are created in batches of ``subscribe_batch_size``
+    nodes, and spread over several subscriptions with max
+    ``subscription_size`` monitored items each:
+
+    .. code-block:: ini
+
+        [OPCUAClientController]
+        subscription_interval = 100
+        subscription_size = 5000
+        subscribe_batch_size = 1000
+
+    After connect, the values of all sources are read with Read service
+    calls of max ``max_nodes_per_read`` nodes, before the nodes are
+    subscribed. Sources added later by ADD_SOURCE are read the same way
+    before they are subscribed. The time from connect until the values of
+    the first full set of sources are read is written to Statistics as
+    ``[name].full_state.time``.
     """
+    coalesce_writes = True
+
     def __init__(self, name, shared):
         super().__init__(name, shared)
         self.logger = logging.getLogger(name)
@@ -69,6 +96,22 @@ class OPCUAClientController(BaseController.BaseController):
             self.client.load_private_key(private_key)
 
         self.subscription = None
+        # liste med [subscription, antall monitored items]
+        self.subscriptions = []
+        # kildenavn -> (subscription, handle)
+        self.subscription_handles = {}
+        # kildenavn fra ADD_SOURCE som ikke er abonnert på enda
+        self._pending_subscribe = []
+        self.subscription_size = self.config("subscription_size", 5000)
+        self.subscribe_batch_size = self.config("subscribe_batch_size", 1000)
+
+        # node-instansene og datatypen er de samme etter reconnect
+        self.nodes = {}
+        self.variant_types = {}
+        self.max_nodes_per_write = self.config("max_nodes_per_write", 500)
+        self.max_nodes_per_read = self.config("max_nodes_per_read", 1000)
+        # tidspunkt for connect. None når alle verdiene er lest
+        self.connect_time = None
 
     def config(self, key, default):
         return self.shared.config.config(self.name, key, default)
@@ -100,24 +143,27 @@ class OPCUAClientController(BaseController.BaseController):
                 if self.security_string:
                     self.client.set_security_string(self.security_string)
 
+                self.connect_time = time.time()
                 self.client.connect()
-                
-                intervall = self.config("subscription_interval", 100)
-                handler = SubHandler(self)
-                self.subscription = self.client.create_subscription(intervall, handler)
-
-                for source_key in self.get_sources():
-                    node_instance = self.client.get_node(source_key)
-                    try:
-                        self.subscription.subscribe_data_change(node_instance)
-                    except opcua.ua.uaerrors.BadNodeIdUnknown as error:
-                        self.logger.exception(error)
+
+                # leser verdiene før abonnement, slik at notifikasjonene
+                # alltid er nyere enn det som er lest
+                self.read_initial_values(list(self.get_sources()))
+                self.full_state_update()
+
+                self.subscription_handler = SubHandler(self)
+                self.subscriptions = []
+                self.subscription = None
+                self.subscription_handles.clear()
+                self._pending_subscribe = []
+                self.subscribe(list(self.get_sources()))
 
                 reconnect = True
                 last_keepalive = time.time()
                 self.logger.info("Running")
                 while not self.has_interrupt():
                     self.loop_incoming() # dispatch handle_* functions
+                    self.subscribe_pending()
 
                     if time.time() > (last_keepalive + keepalive_timeout):
                         # self.logger.debug("Sending keepalive")
@@ -140,11 +186,13 @@ class OPCUAClientController(BaseController.BaseController):
         self.logger.info("Stopped")
 
     def safe_disconnect(self):
-        try:
-            if self.subscription:
-                self.subscription.delete()
-        except Exception as error:
-            self.logger.warning("Cannot delete subscription: %s", error)
+        for subscription, count in self.subscriptions:
+            try:
+                subscription.delete()
+            except Exception as error:
+                self.logger.warning("Cannot delete subscription: %s", error)
+        self.subscriptions = []
+        self.subscription = None
 
         for item in self.get_sources().values():
             item.status_code = StatusCode.NONE
@@ -155,26 +203,181 @@ class OPCUAClientController(BaseController.BaseController):
             self.logger.warning("Cannot disconnect client: %s", error)
 
     def handle_add_source(self, incoming):
-        try:
-            # key should be of format: "ns=2;s=Channel1.Device1.Tag1"
-            node_instance = self.client.get_node(incoming.key)
-            self.subscription.subscribe_data_change(node_instance)
+        "Add the source. The node is subscribed in batch by :meth:`subscribe_pending`"
+        if not self.has_source(incoming.key):
             self.add_source(incoming.key, incoming)
-        except opcua.ua.uaerrors.BadNodeIdUnknown as error:
-            self.logger.error("%s: %s", incoming.key, error)
-        except opcua.ua.uaerrors.UaStringParsingError as error:
-            self.logger.exception(error)
-        #TODO: kanske lagre nodeid-instansene?
+            self._pending_subscribe.append(incoming.key)
+
+    def subscribe_pending(self):
+        "Subscribe the sources received by ADD_SOURCE since last call"
+        if self._pending_subscribe:
+            pending = self._pending_subscribe
+            self._pending_subscribe = []
+            pending = [key for key in pending if self.has_source(key)]
+            self.read_initial_values(pending)
+            self.subscribe(pending)
+            self.full_state_update()
+
+    def full_state_update(self):
+        """
+        Write the time from connect until every source is read to
+        Statistics. Sources from ADD_SOURCE can arrive after connect, so
+        this is done when no more sources are waiting
+        """
+        if self.connect_time is None or self._pending_subscribe:
+            return
+        if not self.get_sources() or not self.incoming.empty():
+            return
+        if Statistics.on:
+            Statistics.set(self.name + ".full_state.time", round(time.time() - self.connect_time, 3))
+        self.connect_time = None
+
+    def read_initial_values(self, keys):
+        """
+        Read the values of the given source keys with as few Read
+        service calls as possible, and update the sources
+        """
+        nodes = []
+        for key in keys:
+            try:
+                nodes.append((key, self.get_node(key)))
+            except opcua.ua.uaerrors.UaStringParsingError as error:
+                self.logger.error("%s: %s", key, error)
+
+        for i in range(0, len(nodes), self.max_nodes_per_read):
+            batch = nodes[i:i + self.max_nodes_per_read]
+            params = ua.ReadParameters()
+            for key, node in batch:
+                read_value = ua.ReadValueId()
+                read_value.NodeId = node.nodeid
+                read_value.AttributeId = ua.AttributeIds.Value
+                params.NodesToRead.append(read_value)
+            results = self.client.uaclient.read(params)
+
+            now = datetime.datetime.utcnow()
+            changes = []
+            for (key, node), datavalue in zip(batch, results):
+                if self.has_source(key):
+                    changes.append((
+                        self.get_source(key),
+                        datavalue.Value.Value if datavalue.Value else None,
+                        datavalue.SourceTimestamp or datavalue.ServerTimestamp or now,
+                        datavalue.StatusCode.value == 0
+                    ))
+            self.send_datachanges(changes)
+
+    def get_subscription(self):
+        """
+        Returns a [subscription, count] list with free space. A new
+        subscription is created if all existing subscriptions are full.
+        """
+        if not self.subscriptions or self.subscriptions[-1][1] >= self.subscription_size:
+            interval = self.config("subscription_interval", 100)
+            subscription = create_subscription(self.client.uaclient, interval, self.subscription_handler)
+            self.subscriptions.append([subscription, 0])
+            self.subscription = subscription
+        return self.subscriptions[-1]
+
+    def subscribe(self, keys):
+        """
+        Create monitored items for the given source keys. Each
+        CreateMonitoredItems request has max ``subscribe_batch_size`` nodes
+        """
+        nodes = []
+        for key in keys:
+            try:
+                # key should be of format: "ns=2;s=Channel1.Device1.Tag1"
+                nodes.append((key, self.get_node(key)))
+            except opcua.ua.uaerrors.UaStringParsingError as error:
+                self.logger.error("%s: %s", key, error)
+                self.remove_source(key)
+
+        start = 0
+        while start < len(nodes):
+            shard = self.get_subscription()
+            subscription, count = shard
+            size = min(self.subscribe_batch_size, self.subscription_size - count)
+            batch = nodes[start:start + size]
+            start += size
+
+            handles = subscription.subscribe_sources(
+                [node for key, node in batch],
+                [self.get_source(key) for key, node in batch]
+            )
+            for (key, node), handle in zip(batch, handles):
+                if isinstance(handle, ua.StatusCode):
+                    # f.eks BadNodeIdUnknown
+                    self.logger.error("%s: %s", key, handle)
+                else:
+                    self.subscription_handles[key] = (subscription, handle)
+                    shard[1] += 1
+
+        if Statistics.on:
+            Statistics.set(self.name + ".subscriptions.count", len(self.subscriptions))
+            Statistics.set(self.name + ".monitored_items.count", len(self.subscription_handles))
+
+    def get_node(self, key):
+        "Returns a cached node instance of given key"
+        node_instance = self.nodes.get(key)
+        if node_instance is None:
+            # key should be of format: "ns=2;s=Channel1.Device1.Tag1"
+            node_instance = self.client.get_node(key)
+            self.nodes[key] = node_instance
+        return node_instance
+
+    def get_variant_type(self, key):
+        """
+        Returns the variant type of given key. It is read from the server
+        once. Returns None if the datatype is unknown.
+        """
+        if not key in self.variant_types:
+            try:
+                self.variant_types[key] = self.get_node(key).get_data_type_as_variant_type()
+            except (opcua.ua.uaerrors.UaStatusCodeError, ValueError, KeyError) as error:
+                self.logger.warning("%s: cannot read datatype: %s", key, error)
+                self.variant_types[key] = None
+        return self.variant_types[key]
+
+    def handle_remove_source(self, incoming):
+        "Unsubscribe the node and remove the source"
+        subscription, handle = self.subscription_handles.pop(incoming.key, (None, None))
+        if handle is not None:
+            try:
+                subscription.unsubscribe(handle)
+                for shard in self.subscriptions:
+                    if shard[0] is subscription:
+                        shard[1] -= 1
+            except opcua.ua.uaerrors.UaStatusCodeError as error:
+                self.logger.error("%s: %s", incoming.key, error)
+        self.remove_source(incoming.key)
+        self.nodes.pop(incoming.key, None)
+        self.variant_types.pop(incoming.key, None)
 
     def handle_write_source(self, incoming, value, source_time):
-        if self.has_source(incoming.key):
-            node_instance = self.client.get_node(incoming.key)
-            #print(id(node_instance), source_time)
-            #TODO: kanske gjøre internt oppslag på nodeid-instansene, i stedet for å hente ny hver gang?
-            #TODO: hente datatype med v.get_data_type_as_variant_type()
-            node_instance.set_value(value)
-        else:
-            self.logger.error("Write error. Source %s not found", incoming.key)
+        self.handle_write_sources([(incoming, value, source_time)])
+
+    def handle_write_sources(self, writes):
+        "Write the values with as few Write service calls as possible"
+        write_values = []
+        keys = []
+        for incoming, value, source_time in writes:
+            if not self.has_source(incoming.key):
+                self.logger.error("Write error. Source %s not found", incoming.key)
+                continue
+            write_value = ua.WriteValue()
+            write_value.NodeId = self.get_node(incoming.key).nodeid
+            write_value.AttributeId = ua.AttributeIds.Value
+            write_value.Value = ua.DataValue(ua.Variant(value, self.get_variant_type(incoming.key)))
+            write_values.append(write_value)
+            keys.append(incoming.key)
+
+        for i in range(0, len(write_values), self.max_nodes_per_write):
+            params = ua.WriteParameters()
+            params.NodesToWrite = write_values[i:i + self.max_nodes_per_write]
+            results = self.client.uaclient.write(params)
+            for key, result in zip(keys[i:i + self.max_nodes_per_write], results):
+                if not result.is_good():
+                    self.logger.error("Write error. %s: %s", key, result)
 
     def loop_outgoing(self):
         for item in self.get_sources().values():
@@ -186,6 +389,19 @@ class OPCUAClientController(BaseController.BaseController):
             if self.update_source_instance_value(item, value, stime, status_ok, self.oldnew):
                 self.send_outgoing(item)
 
+    def send_datachanges(self, changes):
+        """
+        Update the sources and send one RUN_EXPRESSION_BATCH per rule
+
+        :param list changes: list of (source, value, stime, status_ok) tuples
+        """
+        changed = []
+        for item, value, stime, status_ok in changes:
+            if self.update_source_instance_value(item, value, stime, status_ok, self.oldnew):
+                changed.append(item)
+        if changed:
+            self.send_outgoing_batch(changed)
+
 class SubHandler(object):
     """
     Client to subscription. It will receive events from server
@@ -193,6 +409,22 @@ class SubHandler(object):
     def __init__(self, parent):
         self.parent = parent
 
+    def datachange_notifications(self, subscription, items):
+        "Receive every notification in a publish response"
+        sources = subscription.sources
+        changes = []
+        for item in items:
+            source = sources.get(item.ClientHandle)
+            if source is not None:
+                datavalue = item.Value
+                changes.append((
+                    source,
+                    datavalue.Value.Value,
+                    datavalue.SourceTimestamp,
+                    datavalue.StatusCode.value == 0
+                ))
+        self.parent.send_datachanges(changes)
+
     def datachange_notification(self, node, value, data):
         nodeid = node.nodeid.to_string()
         item = data.monitored_item.Value
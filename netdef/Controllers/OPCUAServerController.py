@@ -1,13 +1,19 @@
 import logging
 import datetime
+import time
 import werkzeug.security
 from opcua import Server, ua
 from opcua.common.callback import CallbackType
 from opcua.common import utils
+from opcua.common import manage_nodes
 from opcua.server.internal_server import InternalServer, InternalSession
 from opcua.server.user_manager import UserManager
 from netdef.Controllers import BaseController, Controllers
+from netdef.Controllers.ua.subscription import create_subscription
 from netdef.Sources.BaseSource import StatusCode
+from netdef.Shared.Internal import Statistics
+
+NO_ECHO = object()
 
 class CustomInternalSession(InternalSession):
     "This custom InternalSession will block anonymous access"
@@ -47,7 +53,28 @@ class OPCUAServerController(BaseController.BaseController):
     When a WRITE_SOURCE message is received the value for the associated
     source will be updated in the server and all connected clients will
     receive a value update
+
+    ADD_SOURCE messages are collected and the variable nodes are added to
+    the address space in bulk. If ``folders_on`` is 1 the identifier of
+    the nodeid is split by ``separator`` and every part but the last
+    becomes a folder. I.e. ``ns=2;s=Area1.Line2.Pump1`` is added as
+    ``Pump1`` in folder ``Area1/Line2``
+
+    Pending WRITE_SOURCE messages are coalesced. Only the latest value of
+    each node is written, with one write call. If ``echo_suppression_on``
+    is 1, the data change that the server sends back for a value written
+    by the controller itself does not trigger a RUN_EXPRESSION message.
+    Other expressions that share the node are then not notified of the
+    write. The echo is expected within ``echo_timeout`` seconds.
+
+    .. code-block:: ini
+
+        [OPCUAServerController]
+        echo_suppression_on = 0
+        echo_timeout = 5
     """
+    coalesce_writes = True
+
     def __init__(self, name, shared):
         super().__init__(name, shared)
         self.logger = logging.getLogger(self.name)
@@ -66,6 +93,9 @@ class OPCUAServerController(BaseController.BaseController):
         uri = config("uri", "http://examples.freeopcua.github.io")
         root_object_name = config("root_object_name", "TEST")
         separator = config("separator", ".")
+        self.folders_on = config("folders_on", 0)
+        self.echo_suppression_on = config("echo_suppression_on", 0)
+        self.echo_timeout = config("echo_timeout", 5.0)
         namespace = config("namespace", 2)
 
         self.oldnew = config("oldnew_comparision", 0)
@@ -149,6 +179,13 @@ class OPCUAServerController(BaseController.BaseController):
         self.sep = separator
         self.ns = namespace
         self.items = []
+        self.subscription_handles = {}
+        # ADD_SOURCE som venter på å bli lagt til i adresserommet
+        self._pending_nodes = []
+        self._pending_nodeids = set()
+        self.folders = {}
+        # verdier skrevet av kontrolleren selv. kildenavn -> (verdi, tid)
+        self._echo_values = {}
 
         if initial_values_is_quality_good:
             self.initial_status_code = ua.StatusCodes.Good
@@ -164,10 +201,14 @@ class OPCUAServerController(BaseController.BaseController):
         self.server.subscribe_server_callback(CallbackType.ItemSubscriptionModified, self.modify_monitored_items)
 
         subhandler = SubHandler(self)
-        self.subscription = self.server.create_subscription(100, subhandler)
+        self.subscription = create_subscription(
+            self.server.iserver.isession, 100, subhandler,
+            lifetime_count=3000, max_keepalive_count=10000, max_notifications=0
+        )
 
         while not self.has_interrupt():
             self.loop_incoming() # dispatch handle_* functions
+            self.add_pending_nodes()
 
         self.server.stop()
         self.logger.info("Stopped")
@@ -180,39 +221,185 @@ class OPCUAServerController(BaseController.BaseController):
 
 
     def handle_add_source(self, incoming):
-        "Add a source to the server"
+        "Add a source to the server. The node is added by :meth:`add_pending_nodes`"
         nodeid = self.get_nodeid(incoming)
         self.logger.debug("'Add source' event for nodeid: %s", nodeid)
-        if self.has_source(nodeid):
+        if self.has_source(nodeid) or nodeid in self._pending_nodeids:
             self.logger.error("source already exists %s", nodeid)
             return
+        self._pending_nodes.append((nodeid, incoming))
+        self._pending_nodeids.add(nodeid)
+
+    def add_pending_nodes(self):
+        """
+        Add the variable nodes of the pending ADD_SOURCE messages to the
+        address space in one call, and create the internal monitored
+        items in one call.
+        """
+        if not self._pending_nodes:
+            return
+        start = time.time()
+        pending = self._pending_nodes
+        self._pending_nodes = []
+        self._pending_nodeids = set()
+
+        added = []
+        for nodeid, incoming in pending:
+            try:
+                added.append((nodeid, incoming, self.create_addnodesitem(nodeid, incoming)))
+            except Exception as error:
+                self.logger.error("%s: cannot add node: %s", nodeid, error)
+
+        results = self.server.iserver.isession.add_nodes([item for nodeid, incoming, item in added])
+
+        varnodes = []
+        sources = []
+        for (nodeid, incoming, item), result in zip(added, results):
+            if not result.StatusCode.is_good():
+                self.logger.error("%s: cannot add node: %s", nodeid, result.StatusCode)
+                continue
+            # verdien må ha riktig statuskode fra start
+            self.server.iserver.aspace.set_attribute_value(
+                result.AddedNodeId,
+                ua.AttributeIds.Value,
+                self.create_datavalue(
+                    item.NodeAttributes.Value.Value,
+                    item.NodeAttributes.Value.VariantType,
+                    self.initial_status_code
+                )
+            )
+            varnode = self.server.get_node(result.AddedNodeId)
+            self.add_source(nodeid, (incoming, varnode))
+            varnodes.append(varnode)
+            sources.append(incoming)
+
+        handles = self.subscription.subscribe_sources(varnodes, sources)
+        for varnode, incoming, handle in zip(varnodes, sources, handles):
+            nodeid = self.get_nodeid(incoming)
+            if isinstance(handle, ua.StatusCode):
+                self.logger.error("%s: cannot subscribe: %s", nodeid, handle)
+            else:
+                self.subscription_handles[nodeid] = handle
 
-        defaultvalue = self.get_default_value(incoming)
-        varianttype = self.get_varianttype(incoming)
-        varnode = self.add_variablenode(self.root, nodeid, defaultvalue, varianttype)
+        if Statistics.on:
+            ns = self.name + ".address_space."
+            Statistics.set(ns + "nodes.count", len(self.get_sources()))
+            Statistics.set(ns + "build.time", round(time.time() - start, 3))
+        self.logger.info("Added %d nodes in %.3f sec", len(varnodes), time.time() - start)
+
+    def create_addnodesitem(self, ref, incoming):
+        "Returns an AddNodesItem for a variable node of given source"
+        nodeid = ua.NodeId.from_string(ref)
+        parent = self.root
+        name = nodeid.Identifier
+        if self.folders_on and isinstance(name, str) and self.sep in name:
+            path = name.split(self.sep)
+            parent = self.get_folder(tuple(path[:-1]))
+            name = path[-1]
+        qname = ua.QualifiedName(str(name), nodeid.NamespaceIndex)
+
+        variant = ua.Variant(self.get_default_value(incoming), self.get_varianttype(incoming))
+        access_level = ua.AccessLevel.CurrentRead.mask
         if self.is_writable(incoming):
-            varnode.set_writable()
+            access_level |= ua.AccessLevel.CurrentWrite.mask
+
+        attrs = ua.VariableAttributes()
+        attrs.Description = ua.LocalizedText(qname.Name)
+        attrs.DisplayName = ua.LocalizedText(qname.Name)
+        # privat funksjon i python-opcua. versjonen er låst i requirements-full.txt
+        attrs.DataType = manage_nodes._guess_datatype(variant)
+        attrs.Value = variant
+        attrs.ValueRank = ua.ValueRank.Scalar
+        attrs.WriteMask = 0
+        attrs.UserWriteMask = 0
+        attrs.Historizing = False
+        attrs.AccessLevel = access_level
+        attrs.UserAccessLevel = access_level
+
+        item = ua.AddNodesItem()
+        item.RequestedNewNodeId = nodeid
+        item.BrowseName = qname
+        item.NodeClass = ua.NodeClass.Variable
+        item.ParentNodeId = parent.nodeid
+        item.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HasComponent)
+        item.TypeDefinition = ua.NodeId(ua.ObjectIds.BaseDataVariableType)
+        item.NodeAttributes = attrs
+        return item
+
+    def get_folder(self, path):
+        "Returns the folder node of given path. Missing folders are created"
+        if not path:
+            return self.root
+        if not path in self.folders:
+            parent = self.get_folder(path[:-1])
+            self.folders[path] = self.add_folder(parent, path[-1])
+        return self.folders[path]
+
+    def handle_remove_source(self, incoming):
+        "Remove the variable node from the server"
+        nodeid = self.get_nodeid(incoming)
+        self.logger.debug("'Remove source' event for nodeid: %s", nodeid)
+        if nodeid in self._pending_nodeids:
+            self.add_pending_nodes()
+        if not self.has_source(nodeid):
+            return
 
-        self.add_source(nodeid, (incoming, varnode))
-        self.subscription.subscribe_data_change(varnode)
+        incoming, varnode = self.get_source(nodeid)
+        handle = self.subscription_handles.pop(nodeid, None)
+        if handle is not None:
+            self.subscription.unsubscribe(handle)
+        self.server.delete_nodes([varnode])
+        self.remove_source(nodeid)
 
 
     def handle_write_source(self, incoming, value, source_time):
         "Receive a value change from an expression and update the server"
-        self.logger.debug("'Write source' event to %s. value: %s at %s", incoming.key, value, source_time)
-        nodeid = self.get_nodeid(incoming)
-        incoming, varnode = self.get_source(nodeid)
-        varianttype = self.get_varianttype(incoming)
-
-        # Check if datatype is compatible with varianttype
-        if isinstance(varianttype, ua.VariantType):
-            if varianttype == ua.VariantType.String and isinstance(value, (str, None)):
-                pass # string can be None or str
-            elif not isinstance(value, type(ua.get_default_value(varianttype))):
-                self.logger.error("%s: Value %s is not compatible with datatype %r", nodeid, incoming.value_as_string, varianttype)
-                varianttype = None
-
-        varnode.set_value(value, varianttype)
+        self.handle_write_sources([(incoming, value, source_time)])
+
+    def handle_write_sources(self, writes):
+        "Receive the latest value changes from expressions and update the server in one call"
+        if any(self.get_nodeid(incoming) in self._pending_nodeids for incoming, value, source_time in writes):
+            self.add_pending_nodes()
+
+        stime = datetime.datetime.utcnow()
+        params = ua.WriteParameters()
+        nodeids = []
+        for incoming, value, source_time in writes:
+            self.logger.debug("'Write source' event to %s. value: %s at %s", incoming.key, value, source_time)
+            nodeid = self.get_nodeid(incoming)
+            if not self.has_source(nodeid):
+                self.logger.error("Write error. Source %s not found", nodeid)
+                continue
+            incoming, varnode = self.get_source(nodeid)
+            varianttype = self.get_varianttype(incoming)
+
+            # Check if datatype is compatible with varianttype
+            if isinstance(varianttype, ua.VariantType):
+                if varianttype == ua.VariantType.String and isinstance(value, (str, type(None))):
+                    pass # string can be None or str
+                elif not isinstance(value, type(ua.get_default_value(varianttype))):
+                    self.logger.error("%s: Value %s is not compatible with datatype %r", nodeid, incoming.value_as_string, varianttype)
+                    varianttype = None
+
+            datavalue = ua.DataValue(ua.Variant(value, varianttype))
+            datavalue.SourceTimestamp = stime
+
+            write_value = ua.WriteValue()
+            write_value.NodeId = varnode.nodeid
+            write_value.AttributeId = ua.AttributeIds.Value
+            write_value.Value = datavalue
+            params.NodesToWrite.append(write_value)
+            nodeids.append(nodeid)
+
+            # uendret verdi gir ingen data change, og derfor ikke noe ekko
+            if self.echo_suppression_on and incoming.get != value:
+                self._echo_values[incoming.key] = (value, time.time())
+
+        if params.NodesToWrite:
+            results = self.server.iserver.isession.write(params)
+            for nodeid, result in zip(nodeids, results):
+                if not result.is_good():
+                    self.logger.error("Write error. %s: %s", nodeid, result)
 
     def add_folder(self, parent, foldername):
         "Add a folder in server"
@@ -289,6 +476,38 @@ class OPCUAServerController(BaseController.BaseController):
                 self.send_outgoing(item)
 
 
+    def send_datachanges(self, changes):
+        """
+        Same as :meth:`send_datachange` for many sources. Sends one
+        RUN_EXPRESSION_BATCH per rule
+
+        :param list changes: list of (source, value, stime, status_ok, ua_status_code) tuples
+        """
+        changed = []
+        now = time.time()
+        for item, value, stime, status_ok, ua_status_code in changes:
+            echo, echo_time = self._echo_values.get(item.key, (NO_ECHO, 0.0))
+            if now - echo_time > self.echo_timeout:
+                # ekkoet kom aldri. dette er en ny verdi
+                self._echo_values.pop(item.key, None)
+                echo = NO_ECHO
+            elif echo == value:
+                self._echo_values.pop(item.key)
+            # andre verdier (f.eks. startverdien) kan komme før ekkoet
+            if not status_ok:
+                if item.status_code == StatusCode.NONE:
+                    if ua_status_code == self.initial_status_code:
+                        # we are actually good
+                        status_ok = True
+
+            if self.update_source_instance_value(item, value, stime, status_ok, self.oldnew):
+                # verdien kommer fra kontrolleren selv. uttrykket vet om den
+                if echo is NO_ECHO or echo != value:
+                    changed.append(item)
+        if changed:
+            self.send_outgoing_batch(changed)
+
+
     def modify_monitored_items(self, event, dispatcher):
         self.logger.info('modify_monitored_items')
 
@@ -311,6 +530,29 @@ class SubHandler():
         self.controller = controller
         self.logger = self.controller.logger
 
+    def datachange_notifications(self, subscription, items):
+        "Receive every notification in a publish response"
+        sources = subscription.sources
+        changes = []
+        for item in items:
+            source = sources.get(item.ClientHandle)
+            if source is None:
+                continue
+            datavalue = item.Value
+            if datavalue.SourceTimestamp is None:
+                datavalue.SourceTimestamp = datetime.datetime.utcnow()
+            if datavalue.ServerTimestamp is None:
+                datavalue.ServerTimestamp = datavalue.SourceTimestamp
+            ua_status_code = datavalue.StatusCode.value
+            changes.append((
+                source,
+                datavalue.Value.Value,
+                datavalue.SourceTimestamp,
+                ua_status_code == 0,
+                ua_status_code
+            ))
+        self.controller.send_datachanges(changes)
+
     def datachange_notification(self, node, val, data):
         nodeid = node.nodeid.to_string()
         item = data.monitored_item.Value
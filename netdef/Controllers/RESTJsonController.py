@@ -6,10 +6,14 @@ import urllib.parse
 import urllib.error
 import http.client
 import json
-#import base64
+import base64
+from concurrent.futures import ThreadPoolExecutor
 
 from netdef.Controllers import BaseController, Controllers
 from netdef.Sources.BaseSource import StatusCode
+from netdef.Shared.Internal import Statistics
+from netdef.Controllers.rest.pool import HTTPConnectionPool
+from netdef.Controllers.rest.stream import iter_json_items, get_backend
 
 log = logging.getLogger(__name__)
 log.debug("Loading module")
@@ -19,6 +23,64 @@ class RESTJsonController(BaseController.BaseController):
     """
     .. tip:: Development Status :: 5 - Production/Stable
 
+    HTTP connections are kept alive and reused for polls, reads and writes.
+
+    Config:
+
+    .. code-block:: ini
+
+        [RESTJsonController]
+        pool_size = 2
+        timeout = 10
+        gzip_on = 0
+
+    Polls are driven by a deadline timer. Incoming messages are handled
+    while waiting for the next poll, so writes are sent at once and polls
+    keep their cadence. The poll request is conditional: if the server
+    answered with an ETag or Last-Modified header, the next poll sends
+    If-None-Match and If-Modified-Since, and a 304 response is not parsed.
+
+    .. code-block:: ini
+
+        [RESTJsonController]
+        poll_interval = 1.0
+        conditional_poll_on = 1
+
+    ``pool_size`` is the max number of idle connections per host.
+    ``timeout`` is the socket timeout in seconds. ``gzip_on = 1`` asks
+    the server for gzip compressed responses. The share of requests that
+    reused a connection is available in Statistics.
+
+    APIs without a poll url can be read one key at a time. Every source key
+    is formatted into ``get_url`` and fetched at each poll, with at most
+    ``max_concurrent_reads`` requests at the same time. WRITE_SOURCE
+    messages that pile up can be posted as one JSON array:
+
+    .. code-block:: ini
+
+        [RESTJsonController]
+        get_url = http://localhost/api/values/{}
+        get_keys_on = 1
+        max_concurrent_reads = 4
+        batch_post_on = 1
+        post_batch_size = 100
+
+    With ``batch_post_on = 1`` every pending value is posted in order,
+    also several values of the same source. A batch of one is posted as a
+    plain JSON document.
+
+    Large poll responses can be parsed while they are read. Each item is
+    given to the parsers as soon as it is decoded, and items for unknown
+    keys are dropped at once, so the whole response is never in memory:
+
+    .. code-block:: ini
+
+        [RESTJsonController]
+        stream_decode_on = 1
+        json_backend = auto
+
+    ``json_backend`` is ``python``, ``ijson`` or ``auto``. ``auto`` uses
+    the faster ijson package if it is installed.
     """
     def __init__(self, name, shared):
         super().__init__(name, shared)
@@ -32,33 +94,47 @@ class RESTJsonController(BaseController.BaseController):
         self.connect_url = self.shared.config.config(self.name, "connect_url", "")
         self.retry = self.shared.config.config(self.name, "retry", 3)
         self.reconnect_timeout = self.shared.config.config(self.name, "reconnect_timeout", 20)
+        self.conditional_poll_on = self.shared.config.config(self.name, "conditional_poll_on", 1)
+        self.stream_decode_on = self.shared.config.config(self.name, "stream_decode_on", 0)
+        self.json_backend = get_backend(self.shared.config.config(self.name, "json_backend", "auto"))
+        self.get_keys_on = self.shared.config.config(self.name, "get_keys_on", 0)
+        self.max_concurrent_reads = self.shared.config.config(self.name, "max_concurrent_reads", 4)
+        self.read_executor = None
+        self.coalesce_writes = bool(self.shared.config.config(self.name, "batch_post_on", 0))
+        self.coalesce_latest_only = False
+        self.write_batch_size = self.shared.config.config(self.name, "post_batch_size", 100)
+        self.next_poll = 0.0
+        self.poll_etag = None
+        self.poll_last_modified = None
         self.urlerrors = 0
-        self.urlopen = urllib.request.urlopen
-        #self.auth_header = None
+        self._http_stats = (time.time(), 0, 0)
 
         self.disable = self.shared.config.config(self.name, "disable", 0)
 
         authorization = self.shared.config.config(self.name, "authorization", "")
+        headers = {}
 
         if authorization == 'basic':
             username = self.shared.config.config(self.name, "username", "")
             password = self.shared.config.config(self.name, "password", "")
+            # sendes med en gang. forbindelsen kan da gjenbrukes uten en 401 først
+            credentials = ('%s:%s' % (username, password))
+            encoded_credentials = base64.b64encode(credentials.encode('utf-8'))
+            headers['Authorization'] = 'Basic %s' % encoded_credentials.decode("ascii")
 
-            auth_handler = urllib.request.HTTPBasicAuthHandler()
-            auth_handler.add_password(
-                realm=None,
-                uri=[self.poll_url, self.connect_url, self.post_url],
-                user=username,
-                passwd=password)
-            self.urlopen = urllib.request.build_opener(auth_handler).open
-            #credentials = ('%s:%s' % (username, password))
-            #encoded_credentials = base64.b64encode(credentials.encode('ascii'))
-            #self.auth_header = ('Authorization', 'Basic %s' % encoded_credentials.decode("ascii"))
+        self.http = HTTPConnectionPool(
+            pool_size=self.shared.config.config(self.name, "pool_size", max(2, self.max_concurrent_reads)),
+            timeout=self.shared.config.config(self.name, "timeout", 10.0),
+            gzip=self.shared.config.config(self.name, "gzip_on", 0),
+            headers=headers
+        )
+        self.urlopen = self.http.urlopen
 
     def run(self):
         "Main loop. Will exit when receiving interrupt signal"
         self.logger.info("Running")
         self.connect()
+        self.next_poll = time.time() + self.poll_interval
         while not self.has_interrupt():
 
             if self.disable:  # to disable: empty queue by calling self.fetch_one_incoming
@@ -66,7 +142,10 @@ class RESTJsonController(BaseController.BaseController):
             else:
                 self.loop_incoming() # dispatch handle_* functions
                 self.loop_outgoing() # dispatch poll_* functions
-            time.sleep(0.1)
+                self.http_statistics_update()
+        if self.read_executor:
+            self.read_executor.shutdown()
+        self.http.close()
         self.logger.info("Stopped")
 
     def handle_readall(self, incoming):
@@ -82,18 +161,53 @@ class RESTJsonController(BaseController.BaseController):
     def handle_read_source(self, incoming):
         raise NotImplementedError
 
-    def handle_write_source(self, incoming, value):
+    def handle_write_source(self, incoming, value, source_time):
         data = incoming.pack_value(value)
         if data:
             self._write(data)
 
+    def handle_write_sources(self, writes):
+        "Post the pending writes as one JSON array. Used if batch_post_on = 1"
+        batch = []
+        for incoming, value, source_time in writes:
+            data = incoming.pack_value(value)
+            if data:
+                batch.append(data)
+        if len(batch) == 1:
+            self._write(batch[0])
+        elif batch:
+            self._write(batch)
+
     def connect(self):
         data = self._connect()
         #TODO: behandle motatt data med StatusCode.INITIAL
 
+    def get_queue_timeout(self):
+        "Wait for incoming messages until next poll, but max queue_timeout"
+        if self.disable:
+            # ingen polling når kontrolleren er deaktivert
+            return self.queue_timeout
+        return max(0.0, min(self.queue_timeout, self.next_poll - time.time()))
+
     def loop_outgoing(self):
-        time.sleep(self.poll_interval)
-        data = self._poll()
+        "Poll if the deadline has passed"
+        now = time.time()
+        if now < self.next_poll:
+            return
+        self.next_poll += self.poll_interval
+        if self.next_poll <= now:
+            # pollingen tok lenger enn intervallet. starter på nytt fra nå
+            self.next_poll = now + self.poll_interval
+        if self.poll_url:
+            if self.stream_decode_on:
+                self._poll_stream()
+            else:
+                self.parse_data(self._poll())
+        if self.get_keys_on and self.get_url:
+            self.read_keys(list(self.get_sources().keys()))
+
+    def parse_data(self, data):
+        "Send every item in the decoded response to parse_item"
         if isinstance(data, dict):
             for tupleitem in data.values():
                 self.parse_item(tupleitem)
@@ -103,6 +217,40 @@ class RESTJsonController(BaseController.BaseController):
         elif data:
             self.parse_item(data)
 
+    def read_keys(self, keys):
+        """
+        Fetch every key from ``get_url``, max_concurrent_reads at a time.
+        The response of each key is given to parse_item in the order
+        of the keys
+        """
+        if self.read_executor is None:
+            self.read_executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrent_reads,
+                thread_name_prefix=self.name + "-read"
+            )
+        errors = 0
+        for key, data, error in self.read_executor.map(self._fetch_key, keys):
+            if error:
+                self.logger.error("%s: %s", key, error)
+                errors += 1
+            elif data:
+                self.parse_item(data)
+        if errors:
+            # urlerrorhandling venter i kontrollertråden, ikke i en arbeidstråd
+            self.urlerrorhandling()
+
+    def _fetch_key(self, key):
+        "Returns a tuple of (key, data, error). Runs in a worker thread"
+        try:
+            with self.urlopen(self.get_url.format(key)) as f:
+                return key, json.loads(f.read().decode('utf-8')), None
+        except (
+                http.client.HTTPException,
+                OSError,
+                ValueError
+                ) as error:
+            return key, None, error
+
     def parse_item(self, item):
         #self.logger.debug(item)
         for parser in self.get_parsers():
@@ -120,12 +268,27 @@ class RESTJsonController(BaseController.BaseController):
             source_instance.status_code = StatusCode.GOOD
             self.send_outgoing(source_instance)
 
+    def http_statistics_update(self):
+        "Write connection reuse to Statistics every 10 seconds"
+        last_time, last_requests, last_reused = self._http_stats
+        now = time.time()
+        if Statistics.on and now - last_time >= 10:
+            requests, reused = self.http.request_count, self.http.reuse_count
+            ns = self.name + ".http."
+            Statistics.set(ns + "requests.count", requests)
+            if requests > last_requests:
+                Statistics.set(
+                    ns + "reuse.rate",
+                    round(100.0 * (reused - last_reused) / (requests - last_requests), 1)
+                )
+            self._http_stats = (now, requests, reused)
+
     def urlerrorhandling(self):
         self.urlerrors += 1
         if self.urlerrors >= self.retry:
             self.urlerrors = 0
             self.logger.error("Timeout error. Reconnect in %s sec.", self.reconnect_timeout)
-            time.sleep(self.reconnect_timeout)
+            self.sleep(self.reconnect_timeout)
 
     def _write(self, dict_data):
         #data = urllib.parse.urlencode(dict_data)
@@ -159,12 +322,49 @@ class RESTJsonController(BaseController.BaseController):
         finally:
             return data
 
+    def get_poll_request(self):
+        "Returns the poll request. Conditional if conditional_poll_on = 1"
+        headers = {}
+        if self.conditional_poll_on:
+            if self.poll_etag:
+                headers['If-None-Match'] = self.poll_etag
+            if self.poll_last_modified:
+                headers['If-Modified-Since'] = self.poll_last_modified
+        return urllib.request.Request(self.poll_url, headers=headers)
+
+    def _poll_stream(self):
+        "Poll and send every item to parse_item while the response is read"
+        try:
+            with self.urlopen(self.get_poll_request()) as f:
+                if f.status != 304:
+                    for item in iter_json_items(f, self.json_backend):
+                        self.parse_item(item)
+                    self.poll_etag = f.getheader('ETag')
+                    self.poll_last_modified = f.getheader('Last-Modified')
+                else:
+                    f.read()
+        except (
+                http.client.HTTPException,
+                OSError
+                ) as rem_err:
+            self.logger.error("%s", rem_err)
+            self.urlerrorhandling()
+        except ValueError as error:
+            self.logger.error("Invalid json: %s", error)
+
     def _poll(self):
         data = None
+        request = self.get_poll_request()
         try:
-            with self.urlopen(self.poll_url) as f:
-                data = f.read().decode('utf-8')
-                data = json.loads(data)
+            with self.urlopen(request) as f:
+                # 304: ingenting er endret siden forrige polling
+                if f.status != 304:
+                    data = f.read().decode('utf-8')
+                    data = json.loads(data)
+                    self.poll_etag = f.getheader('ETag')
+                    self.poll_last_modified = f.getheader('Last-Modified')
+                else:
+                    f.read()
         except (
                 http.client.RemoteDisconnected,
                 urllib.error.URLError
@@ -1,19 +1,80 @@
 import logging
 import datetime
-import socket
+import time
+import threading
 import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
 
 from . import BaseController, Controllers
 from ..Sources.BaseSource import StatusCode
+from ..Shared.Internal import Statistics
 
 # import my supported sources
 from ..Sources.XmlRpcMethodCallSource import XmlRpcMethodCallSource
 
+class TimeoutTransport(xmlrpc.client.Transport):
+    """
+    Transport with a socket timeout that only applies to this transport.
+    The HTTP/1.1 connection is kept alive between calls.
+    """
+    def __init__(self, timeout, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+
+class SafeTimeoutTransport(xmlrpc.client.SafeTransport):
+    "Same as :class:`TimeoutTransport` for https"
+    def __init__(self, timeout, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+
 @Controllers.register("XmlRpcController")
 class XmlRpcController(BaseController.BaseController):
     """
     .. tip:: Development Status :: 5 - Production/Stable
 
+    The connection to the endpoint is kept alive, and ``timeout`` only
+    applies to this controller. Polls can be sent in batches with
+    ``system.multicall`` if the server supports it:
+
+    .. code-block:: ini
+
+        [XmlRpcController]
+        timeout = 5
+        multicall_on = 0
+        multicall_size = 100
+        multicall_writes_on = 0
+
+    With ``multicall_writes_on = 1`` pending writes are also sent with
+    ``system.multicall``, but only the latest call of each source is sent.
+
+    A poll cycle starts every ``poll_interval`` seconds. Method calls can
+    be polled in parallel, with at most ``max_workers`` calls (or multicall
+    batches) in flight. Each worker thread has its own connection, and
+    ``timeout`` applies to each call. The controller thread does not wait
+    for the calls. It keeps handling writes, and parses the responses as
+    they arrive. A new cycle does not start before the previous cycle is
+    done:
+
+    .. code-block:: ini
+
+        [XmlRpcController]
+        poll_interval = 5
+        max_workers = 1
+
+    The time of each poll cycle and the number of cycles that took longer
+    than ``poll_interval`` are available in Statistics.
     """
     def __init__(self, name, shared):
         super().__init__(name, shared)
@@ -24,25 +85,73 @@ class XmlRpcController(BaseController.BaseController):
         self.poll_interval = self.shared.config.config(self.name, "poll_interval", 5)
         self.timeout = self.shared.config.config(self.name, "timeout", 5)
         self.disable = self.shared.config.config(self.name, "disable", 0)
+        self.multicall_on = self.shared.config.config(self.name, "multicall_on", 0)
+        self.multicall_size = self.shared.config.config(self.name, "multicall_size", 100)
+        self.coalesce_writes = bool(self.shared.config.config(self.name, "multicall_writes_on", 0))
+        self.write_batch_size = self.multicall_size
+        self.max_workers = self.shared.config.config(self.name, "max_workers", 1)
+        self.executor = None
+        # hver arbeidstråd har sin egen ServerProxy. en transport kan ikke deles
+        self.thread_local = threading.local()
+        # kall som arbeidstrådene holder på med. future -> kilder
+        self.in_flight = {}
+        self.next_poll = 0.0
+        self.cycle_start = 0.0
+        self.overrun_count = 0
 
         self.endpoint = None
         if self.endpoint_url:
-            socket.setdefaulttimeout(self.timeout)
-            self.endpoint = xmlrpc.client.ServerProxy(self.endpoint_url)
+            self.endpoint = self.get_endpoint()
+
+    def get_endpoint(self):
+        "Returns a ServerProxy with a keep-alive transport and the timeout of this controller"
+        if self.endpoint_url.lower().startswith("https"):
+            transport = SafeTimeoutTransport(self.timeout)
+        else:
+            transport = TimeoutTransport(self.timeout)
+        return xmlrpc.client.ServerProxy(self.endpoint_url, transport=transport)
 
     def run(self):
         "Main loop. Will exit when receiving interrupt signal"
         self.logger.info("Running")
+        self.next_poll = time.time() + self.poll_interval
         while not self.has_interrupt():
             if self.disable:  # disble: tøm køen og loop
                 self.fetch_one_incoming()
                 continue
             self.loop_incoming() # dispatch handle_* functions
-            self.sleep(self.poll_interval)
-            if not self.has_interrupt():
+            self.loop_responses() # parse responses from worker threads
+            if time.time() >= self.next_poll and not self.has_interrupt():
                 self.loop_outgoing() # dispatch poll_* functions
+        if self.executor:
+            self.executor.shutdown()
         self.logger.info("Stopped")
 
+    def get_queue_timeout(self):
+        "Wait for incoming messages until next poll, or shortly while calls are in flight"
+        if self.disable:
+            return self.queue_timeout
+        if self.in_flight:
+            return self.min_queue_timeout
+        return max(0.0, min(self.queue_timeout, self.next_poll - time.time()))
+
+    def get_thread_endpoint(self):
+        "Returns the endpoint of the current thread"
+        if self.max_workers <= 1:
+            return self.endpoint
+        endpoint = getattr(self.thread_local, "endpoint", None)
+        if endpoint is None:
+            endpoint = self.thread_local.endpoint = self.get_endpoint()
+        return endpoint
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix=self.name + "-poll"
+            )
+        return self.executor
+
     def handle_readall(self, incoming):
         raise NotImplementedError
 
@@ -60,37 +169,150 @@ class XmlRpcController(BaseController.BaseController):
         self.logger.info("'Write source' event to %s. value: %s", incoming.key, value)
         if self.endpoint:
             if isinstance(incoming, XmlRpcMethodCallSource):
-                incoming.get = self.rpc_call(incoming, value)
-                incoming.source_time = source_time
-                if self.send_events:
-                    if incoming.status_code == StatusCode.NONE:
-                        incoming.status_code = StatusCode.INITIAL
-                    else:
-                        incoming.status_code = StatusCode.GOOD
-                    self.send_outgoing(incoming)
-                else:
-                    incoming.status_code = StatusCode.GOOD
+                self.handle_write_response(incoming, self.rpc_call(incoming, value), source_time)
             else:
                 self.logger.error("'Write source' class %s not supported", type(incoming))
 
-    def poll_outgoing_item(self, item):
-        if self.endpoint:
-            if isinstance(item, XmlRpcMethodCallSource):
-                request = item.poll_request()
-                response = self.rpc_call(item, request)
+    def handle_write_sources(self, writes):
+        "Send the pending writes with system.multicall. Used if multicall_writes_on = 1"
+        if not self.endpoint:
+            return
+        items = []
+        for incoming, value, source_time in writes:
+            if isinstance(incoming, XmlRpcMethodCallSource):
+                items.append((incoming, value, source_time))
+            else:
+                self.logger.error("'Write source' class %s not supported", type(incoming))
+        responses = self.rpc_multicall(
+            [incoming for incoming, value, source_time in items],
+            [value for incoming, value, source_time in items]
+        )
+        for (incoming, value, source_time), response in zip(items, responses):
+            self.handle_write_response(incoming, response, source_time)
+
+    def handle_write_response(self, incoming, response, source_time):
+        incoming.get = response
+        incoming.source_time = source_time
+        if self.send_events:
+            if incoming.status_code == StatusCode.NONE:
+                incoming.status_code = StatusCode.INITIAL
+            else:
+                incoming.status_code = StatusCode.GOOD
+            self.send_outgoing(incoming)
+        else:
+            incoming.status_code = StatusCode.GOOD
+
+    def loop_outgoing(self):
+        "Start a poll cycle if the previous cycle is done"
+        if self.in_flight:
+            return
+        self.cycle_start = time.time()
+        if not self.next_poll:
+            self.next_poll = self.cycle_start
+        self.next_poll += self.poll_interval
+        super().loop_outgoing()
+        if not self.in_flight:
+            self.poll_cycle_done()
+
+    def loop_responses(self):
+        "Parse the responses of the calls that are done. Does not block"
+        done = [future for future in self.in_flight if future.done()]
+        for future in done:
+            batch = self.in_flight.pop(future)
+            for item, response in zip(batch, future.result()):
+                self.handle_poll_response(item, response)
+        if done and not self.in_flight:
+            self.poll_cycle_done()
+
+    def poll_cycle_done(self):
+        "Write the cycle time and overruns to Statistics"
+        now = time.time()
+        if self.next_poll <= now:
+            # syklusen tok lenger enn poll_interval. neste starter med en gang
+            self.overrun_count += 1
+            self.logger.warning(
+                "Poll cycle took %.1f sec. poll_interval is %s sec.",
+                now - self.cycle_start, self.poll_interval
+            )
+            self.next_poll = now
 
-                for sub_item in self.parse_response(response):
-                    self.parse_item(sub_item)
+        if Statistics.on:
+            Statistics.set(self.name + ".poll.cycle.time", round(now - self.cycle_start, 3))
+            Statistics.set(self.name + ".poll.overrun.count", self.overrun_count)
+
+    def poll_jobs(self, items):
+        """
+        Poll the sources. Uses system.multicall if multicall_on = 1,
+        and worker threads if max_workers > 1. The responses from worker
+        threads are parsed by :meth:`loop_responses`
+        """
+        if not self.endpoint:
+            return
+        items = [item for item in items if isinstance(item, XmlRpcMethodCallSource)]
+        size = self.multicall_size if self.multicall_on else 1
+        batches = [items[i:i + size] for i in range(0, len(items), size)]
+
+        if self.max_workers > 1:
+            executor = self.get_executor()
+            for batch in batches:
+                self.in_flight[executor.submit(self.poll_batch, batch)] = batch
+        else:
+            for batch in batches:
+                for item, response in zip(batch, self.poll_batch(batch)):
+                    self.handle_poll_response(item, response)
+
+    def poll_batch(self, items):
+        "Returns the responses of the items. Runs in a worker thread if max_workers > 1"
+        endpoint = self.get_thread_endpoint()
+        if self.multicall_on:
+            return self.rpc_multicall(items, [item.poll_request() for item in items], endpoint)
+        return [self.rpc_call(item, item.poll_request(), endpoint) for item in items]
+
+    def handle_poll_response(self, item, response):
+        for sub_item in self.parse_response(response):
+            self.parse_item(sub_item)
+
+        item.get = response
+        item.source_time = datetime.datetime.utcnow()
+        item.status_code = StatusCode.GOOD
+        self.send_outgoing(item)
+
+    def rpc_multicall(self, items, values, endpoint=None):
+        """
+        Call the method of every item with one system.multicall request.
+        Returns a list of responses. A response is None if the call failed
+        """
+        multicall = xmlrpc.client.MultiCall(endpoint or self.endpoint)
+        called = []
+        for i, (item, value) in enumerate(zip(items, values)):
+            try:
+                method, arguments = item.make_rpc_request(value)
+                getattr(multicall, method)(*arguments)
+                called.append(i)
+            except Exception as error:
+                self.logger.error("%s: %s", item.get_reference(), error)
+
+        responses = [None] * len(items)
+        if not called:
+            return responses
+        try:
+            results = multicall()
+        except Exception as error:
+            self.logger.error("system.multicall: %s", error)
+            return responses
 
-                item.get = response
-                item.source_time = datetime.datetime.utcnow()
-                item.status_code = StatusCode.GOOD
-                self.send_outgoing(item)
+        for n, i in enumerate(called):
+            try:
+                # en Fault for ett kall gir ikke feil på de andre
+                responses[i] = items[i].parse_rpc_response(results[n])
+            except Exception as error:
+                self.logger.error("%s: %s", items[i].get_reference(), error)
+        return responses
 
-    def rpc_call(self, item, value):
+    def rpc_call(self, item, value, endpoint=None):
         try:
             method, arguments = item.make_rpc_request(value)
-            result = getattr(self.endpoint, method)(*arguments)
+            result = getattr(endpoint or self.endpoint, method)(*arguments)
             return item.parse_rpc_response(result)
 
         except Exception as error:
@@ -2,6 +2,7 @@ import logging
 import datetime
 import zmq
 from netdef.Controllers import BaseController, Controllers
+from netdef.Controllers.zmq import wire
 from netdef.Sources.BaseSource import StatusCode
 
 # this controller is in development, do not use it yet.
@@ -15,7 +16,23 @@ class ZmqDataAccessController(BaseController.BaseController):
     """
     .. danger:: Development Status :: 3 - Alpha
 
+    Values are sent in the binary format of :mod:`netdef.Controllers.zmq.wire`.
+    Pending writes are sent as one multipart message, every value in
+    order. See :mod:`netdef.Shared.codec` for supported value types.
+    Values of other types are logged and skipped. When a node
+    subscribes, a snapshot of every source is sent in chunks, one chunk
+    per loop, so the controller keeps handling messages meanwhile.
+
+    .. code-block:: ini
+
+        [ZmqDataAccessController]
+        write_batch_size = 1000
+        snapshot_chunk_size = 1000
     """
+    # skrivinger som hoper seg opp sendes i én melding
+    coalesce_writes = True
+    coalesce_latest_only = False
+
     def __init__(self, name, shared):
         super().__init__(name, shared)
         self.logger = logging.getLogger(self.name)
@@ -25,6 +42,11 @@ class ZmqDataAccessController(BaseController.BaseController):
 
         self.topic = b"" # config(self.name, "topic", "dist")
         self.publish_url = config(self.name, "publish_url", "tcp://127.0.0.1:5556")
+        self.write_batch_size = config(self.name, "write_batch_size", 1000)
+        self.snapshot_chunk_size = config(self.name, "snapshot_chunk_size", 1000)
+        # kildene som gjenstår å sende i et snapshot
+        self.snapshot = None
+        self.snapshot_pos = 0
         self.subscribe_list = config(self.name, "subscribe_urls", "{}_subscribe_urls".format(self.name))
 
         self.subscribe_urls = [
@@ -55,7 +77,14 @@ class ZmqDataAccessController(BaseController.BaseController):
                 events = dict(self.poller.poll(10))
 
                 if self.sub in events:
-                    vlist = self.sub.recv_pyobj(flags=zmq.NOBLOCK)
+                    frames = self.sub.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+                    try:
+                        message_type, flags, vlist = wire.decode_message(
+                            [frame.buffer for frame in frames]
+                        )
+                    except ValueError as error:
+                        self.logger.error("Invalid message: %s", error)
+                        continue
                     for val in vlist:
                         item_key, value, stime = val
                         self.logger.debug("SUB RECV: %s %s %s", item_key, value, stime)
@@ -69,8 +98,9 @@ class ZmqDataAccessController(BaseController.BaseController):
                     event = self.pub.recv(flags=zmq.NOBLOCK)
                     self.logger.debug("PUB RECV %s", event)
                     if event[0] == 1: # subscribe-event
-                        rep = tuple((item.key, item.value, item.source_time) for item in self.get_sources().values())
-                        self.pub.send_pyobj(rep)
+                        # ny abonnent. sender alle kildene på nytt, i biter
+                        self.snapshot = list(self.get_sources().values())
+                        self.snapshot_pos = 0
 
         except zmq.ZMQError as error:
             if error.errno == 11:
@@ -84,6 +114,7 @@ class ZmqDataAccessController(BaseController.BaseController):
         self.connect()
         while not self.has_interrupt():
             self.loop_incoming() # dispatch handle_* functions
+            self.send_snapshot_chunk()
             self.loop_subscribers() # dispatch poll_* functions
 
         self.logger.info("Stopped")
@@ -94,4 +125,35 @@ class ZmqDataAccessController(BaseController.BaseController):
 
     def handle_write_source(self, incoming, value, source_time):
         self.logger.debug("'Write source' event to %s. value: %s at: %s", incoming.key, value, source_time)
-        self.pub.send_pyobj(((incoming.key, value, source_time), ), flags=zmq.NOBLOCK)
+        self.handle_write_sources([(incoming, value, source_time)])
+
+    def handle_write_sources(self, writes):
+        "Send the pending writes as one multipart message"
+        items = [(incoming.key, value, source_time) for incoming, value, source_time in writes]
+        self.send_message(wire.DATA, items)
+
+    def send_message(self, message_type, items, flags=0):
+        "Send the items. Bytes values are sent without copying"
+        errors = []
+        frames = wire.encode_message(message_type, items, flags, errors)
+        for key, error in errors:
+            self.logger.error("Can not send value of %s: %s", key, error)
+        self.pub.send_multipart(frames, flags=zmq.NOBLOCK, copy=False)
+
+    def get_queue_timeout(self):
+        "Do not wait for incoming messages while a snapshot is sent"
+        if self.snapshot is not None:
+            return 0.0
+        return self.queue_timeout
+
+    def send_snapshot_chunk(self):
+        "Send the next chunk of a pending snapshot"
+        if self.snapshot is None:
+            return
+        chunk = self.snapshot[self.snapshot_pos:self.snapshot_pos + self.snapshot_chunk_size]
+        self.snapshot_pos += len(chunk)
+        last = self.snapshot_pos >= len(self.snapshot)
+        items = [(item.key, item.value, item.source_time) for item in chunk]
+        self.send_message(wire.SNAPSHOT, items, wire.LAST_CHUNK if last else 0)
+        if last:
+            self.snapshot = None
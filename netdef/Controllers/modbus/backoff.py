@@ -0,0 +1,36 @@
+import time
+
+# Hver enhet har sin egen ventetid etter feil. En enhet som ikke svarer
+# spørres sjeldnere og sjeldnere, slik at den ikke stopper pollingen
+# av de andre enhetene.
+
+class Backoff():
+    """
+    Exponential backoff for one modbus unit.
+
+    :param float minimum: seconds to wait after the first failure
+    :param float maximum: max seconds to wait
+    """
+    def __init__(self, minimum=1.0, maximum=60.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.failures = 0
+        self.retry_time = 0.0
+
+    def is_ready(self, now=None):
+        "Returns True if the unit can be polled"
+        now = time.time() if now is None else now
+        return now >= self.retry_time
+
+    def failed(self, now=None):
+        "Register a failure. Returns seconds until next retry"
+        now = time.time() if now is None else now
+        delay = min(self.maximum, self.minimum * (2 ** min(self.failures, 30)))
+        self.failures += 1
+        self.retry_time = now + delay
+        return delay
+
+    def succeeded(self):
+        "Register a successful request"
+        self.failures = 0
+        self.retry_time = 0.0
@@ -0,0 +1,75 @@
+# Planlegger blokklesing av registre. Kilder med samme enhet og adresser
+# som ligger inntil hverandre (eller med et lite hull imellom) leses med
+# ett kall i stedet for ett kall per register.
+
+# Modbus tillater maks 125 registre per read_holding_registers
+MAX_REGISTERS = 125
+# og maks 123 registre per write_registers
+MAX_WRITE_REGISTERS = 123
+
+class ReadBlock():
+    """
+    A block of registers to be read in one request.
+
+    :attr:`items` is a list of (address, item) tuples
+    """
+    __slots__ = ["unit", "start", "count", "items"]
+    def __init__(self, unit, start):
+        self.unit = unit
+        self.start = start
+        self.count = 1
+        self.items = []
+
+    def __repr__(self):
+        return "ReadBlock(unit={}, start={}, count={}, items={})".format(
+            self.unit, self.start, self.count, len(self.items))
+
+    def get_values(self, registers):
+        "Returns a list of (item, value) tuples from the result of the block read"
+        return [(item, registers[address - self.start]) for address, item in self.items]
+
+
+def plan_reads(items, gap=0, max_count=MAX_REGISTERS):
+    """
+    Group the items by unit and merge contiguous addresses into blocks.
+
+    :param items: iterable of (unit, address, item) tuples
+    :param int gap: number of unused registers allowed between two
+        addresses in the same block
+    :param int max_count: max number of registers in a block
+    :returns: list of :class:`ReadBlock` sorted by unit and address
+    """
+    if max_count < 1 or max_count > MAX_REGISTERS:
+        raise ValueError("max_count must be between 1 and {}".format(MAX_REGISTERS))
+
+    by_unit = {}
+    for unit, address, item in items:
+        by_unit.setdefault(unit, []).append((address, item))
+
+    blocks = []
+    for unit in sorted(by_unit):
+        block = None
+        for address, item in sorted(by_unit[unit], key=lambda x: x[0]):
+            end = address - block.start + 1 if block else 0
+            if block and address - (block.start + block.count) <= gap and end <= max_count:
+                block.count = max(block.count, end)
+            else:
+                block = ReadBlock(unit, address)
+                blocks.append(block)
+            block.items.append((address, item))
+    return blocks
+
+
+def plan_writes(items, max_count=MAX_WRITE_REGISTERS):
+    """
+    Group the values by unit and merge contiguous addresses.
+
+    :param items: iterable of (unit, address, value) tuples with unique
+        (unit, address)
+    :param int max_count: max number of registers in one write
+    :returns: list of (unit, start, values) tuples
+    """
+    return [
+        (block.unit, block.start, [value for address, value in block.items])
+        for block in plan_reads(items, 0, max_count)
+    ]
@@ -0,0 +1,83 @@
+# Et søketre over mqtt topic-filtre. Hvert nivå i topic er en node, slik at
+# en topic sjekkes mot alle filtre ved å gå ned i treet ett nivå av gangen.
+# Jokertegnene + (ett nivå) og # (resten av nivåene) er egne noder.
+
+SINGLE_LEVEL = "+"
+MULTI_LEVEL = "#"
+
+class TopicTrie():
+    """
+    A trie of MQTT topic filters and their values. A topic is matched
+    against all filters in O(topic depth). Filters can have the wildcards
+    ``+`` and ``#``. As in MQTT, a wildcard in the first level does not
+    match topics starting with ``$``.
+    """
+    def __init__(self):
+        self.root = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, topic_filter, value):
+        "Add a value to given filter"
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.setdefault(level, {})
+        # None er en gyldig nøkkel fordi alle nivåer er tekst
+        values = node.setdefault(None, [])
+        if not value in values:
+            values.append(value)
+            self.count += 1
+
+    def remove(self, topic_filter, value):
+        "Remove a value from given filter. Returns False if not found"
+        path = []
+        node = self.root
+        for level in topic_filter.split("/"):
+            path.append((node, level))
+            node = node.get(level)
+            if node is None:
+                return False
+        values = node.get(None)
+        if not values or not value in values:
+            return False
+        values.remove(value)
+        self.count -= 1
+        if not values:
+            del node[None]
+        # fjerner tomme noder
+        for parent, level in reversed(path):
+            if parent[level]:
+                break
+            del parent[level]
+        return True
+
+    def match(self, topic):
+        "Returns a list of the values of every filter that match given topic"
+        result = []
+        nodes = [self.root]
+        for i, level in enumerate(topic.split("/")):
+            wildcards = not (i == 0 and level.startswith("$"))
+            next_nodes = []
+            for node in nodes:
+                child = node.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                if wildcards:
+                    child = node.get(SINGLE_LEVEL)
+                    if child is not None:
+                        next_nodes.append(child)
+                    child = node.get(MULTI_LEVEL)
+                    if child is not None:
+                        result.extend(child.get(None, ()))
+            nodes = next_nodes
+            if not nodes:
+                return result
+        for node in nodes:
+            result.extend(node.get(None, ()))
+            # a/# matcher også a
+            child = node.get(MULTI_LEVEL)
+            if child is not None:
+                result.extend(child.get(None, ()))
+        return result
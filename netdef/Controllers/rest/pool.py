@@ -0,0 +1,191 @@
+import io
+import zlib
+import threading
+import http.client
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Gjenbruk av http-forbindelser (keep-alive). Hver vert (scheme, host, port)
+# har en liste med ledige forbindelser. En forbindelse legges tilbake i
+# listen når svaret er lest ferdig, og brukes av neste forespørsel.
+# Slik slipper vi en ny tcp- og tls-handshake for hver polling.
+
+class PooledResponse():
+    """
+    A response from :class:`HTTPConnectionPool`. Can be used as a context
+    manager like the response from :func:`urllib.request.urlopen`.
+    The body is decompressed if the server sent it with gzip.
+    """
+    def __init__(self, pool, pool_key, conn, response):
+        self.pool = pool
+        self.pool_key = pool_key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.decompressor = None
+        if (response.getheader("Content-Encoding") or "").lower() == "gzip":
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        "Returns up to amt bytes of the body, or the rest of the body if amt is None"
+        if amt == 0:
+            return b""
+        if self.decompressor is None:
+            data = self.response.read(amt)
+        elif amt is None:
+            data = self.decompressor.decompress(self.response.read())
+            data += self.decompressor.flush()
+        else:
+            data = b""
+            while not data:
+                raw = self.response.read(amt)
+                if not raw:
+                    data = self.decompressor.flush()
+                    break
+                data = self.decompressor.decompress(raw)
+        if self.response.isclosed():
+            self.release()
+        return data
+
+    def release(self):
+        "Give the connection back to the pool"
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            self.pool.put(self.pool_key, conn)
+
+    def close(self):
+        "Close the response. The connection is only reused if the body is read"
+        if self.conn is not None:
+            if self.response.isclosed():
+                self.release()
+            else:
+                conn, self.conn = self.conn, None
+                conn.close()
+        self.response.close()
+
+
+class HTTPConnectionPool():
+    """
+    Keep-alive connections to one or more hosts.
+
+    :param int pool_size: max number of idle connections per host
+    :param float timeout: socket timeout in seconds
+    :param bool gzip: ask for gzip compressed responses
+    :param dict headers: headers to send with every request
+    :param ssl_context: :class:`ssl.SSLContext` for https urls
+    """
+    def __init__(self, pool_size=2, timeout=10.0, gzip=False, headers=None, ssl_context=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.gzip = gzip
+        self.headers = dict(headers or {})
+        self.ssl_context = ssl_context
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.request_count = 0
+        self.reuse_count = 0
+
+    def get(self, pool_key):
+        "Returns a tuple of (connection, reused) for given (scheme, host, port)"
+        with self.lock:
+            idle = self.idle.get(pool_key)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = pool_key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=self.timeout, context=self.ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return conn, False
+
+    def put(self, pool_key, conn):
+        "Add an idle connection to the pool. Closed if the pool is full"
+        if conn.sock is not None:
+            with self.lock:
+                idle = self.idle.setdefault(pool_key, [])
+                if len(idle) < self.pool_size:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def close(self):
+        "Close all idle connections"
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Send a request and return a :class:`PooledResponse`.
+
+        :raises urllib.error.HTTPError: if the status code is 400 or higher
+        :raises urllib.error.URLError: on connection errors
+        """
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if not scheme in ("http", "https"):
+            raise urllib.error.URLError("unknown url type: {}".format(url))
+        pool_key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        all_headers = dict(self.headers)
+        if self.gzip:
+            all_headers["Accept-Encoding"] = "gzip"
+        if headers:
+            all_headers.update(headers)
+
+        while True:
+            conn, reused = self.get(pool_key)
+            try:
+                conn.request(method, path, body=body, headers=all_headers)
+                response = conn.getresponse()
+                break
+            except ConnectionError as error:
+                conn.close()
+                # serveren kan ha lukket en ledig forbindelse. prøver igjen
+                if not reused:
+                    raise urllib.error.URLError(error)
+            except (OSError, http.client.HTTPException) as error:
+                conn.close()
+                raise urllib.error.URLError(error)
+
+        with self.lock:
+            self.request_count += 1
+            if reused:
+                self.reuse_count += 1
+
+        pooled = PooledResponse(self, pool_key, conn, response)
+        if pooled.status >= 400:
+            with pooled:
+                body = pooled.read()
+            raise urllib.error.HTTPError(
+                url, pooled.status, pooled.reason, pooled.headers, io.BytesIO(body)
+            )
+        return pooled
+
+    def urlopen(self, url, data=None):
+        """
+        Drop-in replacement for :func:`urllib.request.urlopen`. Accepts
+        a url or a :class:`urllib.request.Request`
+        """
+        if isinstance(url, urllib.request.Request):
+            return self.request(url.get_method(), url.full_url, url.data, dict(url.header_items()))
+        return self.request("GET" if data is None else "POST", url, data)
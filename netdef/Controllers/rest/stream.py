@@ -0,0 +1,171 @@
+import json
+import codecs
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Inkrementell parsing av store json-svar. I stedet for å lese hele svaret
+# og bygge ett stort objekt, leses svaret i biter og hvert element i
+# toppnivået sendes videre så snart det er ferdig parset. Minnebruken er
+# da omtrent størrelsen på det største elementet.
+
+CHUNK_SIZE = 65536
+WHITESPACE = " \t\n\r"
+
+def get_backend(name="auto"):
+    """
+    Returns the name of the json backend to use.
+
+    :param str name: ``auto``, ``python`` or ``ijson``. ``auto`` selects
+        ijson if it is installed
+    """
+    if name == "auto":
+        return "ijson" if ijson else "python"
+    if name == "ijson" and not ijson:
+        raise ImportError("ijson is not installed")
+    if not name in ("python", "ijson"):
+        raise ValueError("Unknown json backend: {}".format(name))
+    return name
+
+def iter_json_items(f, backend="python", chunk_size=CHUNK_SIZE):
+    """
+    Yields the items of a utf-8 encoded json document as they are read
+    from the binary file object ``f``. The items are the values of a top
+    level object, the elements of a top level array, or else the document
+    itself.
+
+    :raises ValueError: if the document is not valid json
+    """
+    if backend == "ijson":
+        return _iter_ijson(f, chunk_size)
+    return _iter_python(f, chunk_size)
+
+
+class _TextReader():
+    "A buffer of decoded text that is filled from a binary file object"
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        "Read the next chunk. Returns False if end of file is reached"
+        if self.eof:
+            return False
+        data = self.f.read(self.chunk_size)
+        if data:
+            text = self.decoder.decode(data)
+        else:
+            self.eof = True
+            text = self.decoder.decode(b"", final=True)
+        # forkaster teksten som allerede er parset
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        "Skip whitespace and return next char, or an empty string at end of file"
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars):
+        "Consume and return next char. Raise if it is not one of chars"
+        char = self.peek()
+        if not char or not char in chars:
+            raise json.JSONDecodeError(
+                "Expecting one of {!r}".format(chars), self.buf, self.pos
+            )
+        self.pos += 1
+        return char
+
+    def decode_value(self, decoder):
+        "Decode the next complete value. Reads more text until it is complete"
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+                # et tall kan fortsette i neste bit. må se tegnet etter verdien
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def _iter_python(f, chunk_size):
+    reader = _TextReader(f, chunk_size)
+    decoder = json.JSONDecoder()
+    first = reader.peek()
+    if first == "[":
+        reader.pos += 1
+        if reader.peek() == "]":
+            return
+        while True:
+            yield reader.decode_value(decoder)
+            if reader.expect(",]") == "]":
+                return
+    elif first == "{":
+        reader.pos += 1
+        if reader.peek() == "}":
+            return
+        while True:
+            if reader.peek() != '"':
+                reader.expect('"')
+            reader.decode_value(decoder)
+            reader.expect(":")
+            yield reader.decode_value(decoder)
+            if reader.expect(",}") == "}":
+                return
+    elif first:
+        yield reader.decode_value(decoder)
+
+
+class _PrefixedReader():
+    "A binary file object that returns prefix before the rest of f"
+    def __init__(self, prefix, f):
+        self.prefix = prefix
+        self.f = f
+
+    def read(self, size=-1):
+        if size == 0:
+            return b""
+        if self.prefix:
+            data, self.prefix = self.prefix, b""
+            return data
+        return self.f.read(size)
+
+
+def _iter_ijson(f, chunk_size):
+    # ijson trenger å vite om toppnivået er en liste eller et objekt
+    prefix = b""
+    first = b""
+    while not first:
+        data = f.read(chunk_size)
+        if not data:
+            return
+        prefix += data
+        stripped = prefix.lstrip(WHITESPACE.encode("ascii"))
+        first = stripped[:1]
+    reader = _PrefixedReader(prefix, f)
+    try:
+        if first == b"[":
+            yield from ijson.items(reader, "item", use_float=True, buf_size=chunk_size)
+        elif first == b"{":
+            for key, value in ijson.kvitems(reader, "", use_float=True, buf_size=chunk_size):
+                yield value
+        else:
+            yield from ijson.items(reader, "", use_float=True, buf_size=chunk_size)
+    except ijson.JSONError as error:
+        raise ValueError(str(error))
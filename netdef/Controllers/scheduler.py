@@ -0,0 +1,94 @@
+import heapq
+import random
+import time
+
+# Tidsplan for polling. Hver jobb har et intervall og ligger i en heap
+# sortert på neste tidspunkt den skal kjøres. Grunntiden økes med
+# nøyaktig ett intervall hver gang, slik at jitter ikke gir drift.
+
+class PollJob():
+    __slots__ = ["name", "interval", "item", "base", "due"]
+    def __init__(self, name, interval, item, base):
+        self.name = name
+        self.interval = interval
+        self.item = item
+        self.base = base
+        self.due = base
+
+    def __lt__(self, other):
+        return self.due < other.due
+
+
+class PollScheduler():
+    """
+    Orders poll jobs by next due time.
+
+    :param float jitter: a random delay of 0 to ``jitter * interval`` is
+        added to every due time. Used to spread the load when many jobs
+        have the same interval.
+    """
+    def __init__(self, jitter=0.0):
+        self.jitter = jitter
+        self.jobs = {}
+        self.heap = []
+        self.poll_count = 0
+        self.overrun_count = 0
+
+    def _schedule(self, job):
+        job.due = job.base
+        if self.jitter and job.interval:
+            job.due += random.uniform(0, self.jitter * job.interval)
+        heapq.heappush(self.heap, job)
+
+    def set_jobs(self, jobs, now=None):
+        """
+        Replace the jobs. Jobs with the same name and interval keep their
+        due time.
+
+        :param jobs: iterable of (name, interval, item) tuples
+        """
+        now = time.time() if now is None else now
+        old_jobs = self.jobs
+        self.jobs = {}
+        self.heap = []
+        for name, interval, item in jobs:
+            old_job = old_jobs.get(name)
+            if old_job and old_job.interval == interval:
+                job = PollJob(name, interval, item, old_job.base)
+                job.due = old_job.due
+                heapq.heappush(self.heap, job)
+            else:
+                job = PollJob(name, interval, item, now)
+                self._schedule(job)
+            self.jobs[name] = job
+
+    def pop_due(self, now=None):
+        """
+        Returns a list of the items that are due, and schedule
+        them again
+        """
+        now = time.time() if now is None else now
+        due_jobs = []
+        while self.heap and self.heap[0].due <= now:
+            due_jobs.append(heapq.heappop(self.heap))
+
+        items = []
+        for job in due_jobs:
+            items.append(job.item)
+            job.base += job.interval
+            if job.base <= now:
+                # en hel periode er tapt. starter på nytt fra nå
+                if job.interval:
+                    self.overrun_count += 1
+                job.base = now + job.interval if job.interval else now
+            self._schedule(job)
+
+        self.poll_count += len(items)
+        return items
+
+    def time_to_next(self, now=None):
+        "Returns seconds until next job is due, or None if there is no jobs"
+        if not self.heap:
+            return None
+        now = time.time() if now is None else now
+        return max(0.0, self.heap[0].due - now)
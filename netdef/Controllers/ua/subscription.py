@@ -0,0 +1,81 @@
+from opcua import ua
+from opcua.common.subscription import Subscription
+
+# Subscription som kjenner kilden til hvert monitored item. Notifikasjoner
+# slås opp direkte på client handle, i stedet for å lage en nodeid-streng
+# og slå opp på den. Alle notifikasjoner i en publish-respons sendes
+# samlet til handler.datachange_notifications
+#
+# Bruker private deler av python-opcua (_call_datachange og at
+# subscribe_data_change kaller create_monitored_items). Versjonen er derfor
+# låst i requirements-full.txt
+
+def create_subscription(server, period, handler, lifetime_count=10000,
+                        max_keepalive_count=3000, max_notifications=10000):
+    """
+    Returns a :class:`BatchSubscription`. Same parameters as
+    ``opcua.Client.create_subscription``.
+
+    :param server: ``client.uaclient`` or ``server.iserver.isession``
+    """
+    params = ua.CreateSubscriptionParameters()
+    params.RequestedPublishingInterval = period
+    params.RequestedLifetimeCount = lifetime_count
+    params.RequestedMaxKeepAliveCount = max_keepalive_count
+    params.MaxNotificationsPerPublish = max_notifications
+    params.PublishingEnabled = True
+    params.Priority = 0
+    return BatchSubscription(server, params, handler)
+
+
+class BatchSubscription(Subscription):
+    """
+    A subscription that maps client handles to sources.
+
+    If the handler has a ``datachange_notifications(subscription, items)``
+    function it receives every MonitoredItemNotification of a publish
+    response at once. Look up the source with :attr:`sources`
+    and ``item.ClientHandle``.
+    """
+    def __init__(self, server, params, handler):
+        super().__init__(server, params, handler)
+        self.sources = {}
+        self._client_handles = {}
+        self._last_client_handles = []
+
+    def create_monitored_items(self, monitored_items):
+        self._last_client_handles = [
+            item.RequestedParameters.ClientHandle for item in monitored_items
+        ]
+        return super().create_monitored_items(monitored_items)
+
+    def subscribe_sources(self, nodes, sources):
+        """
+        Subscribe to data change of the nodes in one request.
+        Returns a list of handles. A failed node gets a ua.StatusCode
+        instead of a handle.
+
+        :param list nodes: list of node instances
+        :param list sources: the source of each node
+        """
+        handles = self.subscribe_data_change(list(nodes))
+        for client_handle, handle, source in zip(self._last_client_handles, handles, sources):
+            if not isinstance(handle, ua.StatusCode):
+                self.sources[client_handle] = source
+                self._client_handles[handle] = client_handle
+        return handles
+
+    def unsubscribe(self, handle):
+        for server_handle in (handle if isinstance(handle, list) else [handle]):
+            client_handle = self._client_handles.pop(server_handle, None)
+            self.sources.pop(client_handle, None)
+        return super().unsubscribe(handle)
+
+    def _call_datachange(self, datachange):
+        if hasattr(self._handler, "datachange_notifications"):
+            try:
+                self._handler.datachange_notifications(self, datachange.MonitoredItems)
+            except Exception:
+                self.logger.exception("Exception calling data change handler")
+        else:
+            super()._call_datachange(datachange)
@@ -0,0 +1,99 @@
+import math
+import struct
+import datetime
+from ...Shared import codec
+
+# Meldingsformat mellom ZmqDataAccessController-noder. En melding er
+# flere zmq-rammer:
+#
+#   ramme 0: header (versjon, meldingstype, flagg, antall verdier)
+#   ramme 1: indeks. for hver verdi: nøkkellengde, typekode, tid og nøkkel
+#   ramme 2..: en ramme per verdi. bytes sendes som de er, uten kopiering
+#
+# Versjonen økes hvis formatet endres. Meldinger med ukjent versjon avvises.
+
+VERSION = 1
+
+DATA = 1
+SNAPSHOT = 2
+
+# satt i siste del av et snapshot
+LAST_CHUNK = 1
+
+HEADER = struct.Struct("<BBBI")
+INDEX_ENTRY = struct.Struct("<HBd")
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def encode_time(source_time):
+    "Seconds since epoch. Naive datetimes are UTC. NaN if None"
+    if source_time is None:
+        return math.nan
+    if source_time.tzinfo is None:
+        return (source_time - EPOCH).total_seconds()
+    return source_time.timestamp()
+
+def decode_time(seconds):
+    "Returns a naive UTC datetime, or None if NaN"
+    if math.isnan(seconds):
+        return None
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+def encode_message(message_type, items, flags=0, errors=None):
+    """
+    Returns a list of frames for :meth:`zmq.Socket.send_multipart`.
+    See :mod:`netdef.Shared.codec` for supported value types.
+
+    :param int message_type: :data:`DATA` or :data:`SNAPSHOT`
+    :param items: list of (key, value, source_time) tuples
+    :param int flags: :data:`LAST_CHUNK` or 0
+    :param list errors: if given, items that can not be encoded are skipped
+        and (key, exception) is appended to this list
+    :raises TypeError: if a value can not be encoded and errors is None
+    """
+    index = bytearray()
+    values = []
+    for key, value, source_time in items:
+        try:
+            code, data = codec.encode_value(value)
+        except (TypeError, ValueError) as error:
+            if errors is None:
+                raise
+            errors.append((key, error))
+            continue
+        key = key.encode("utf-8")
+        index += INDEX_ENTRY.pack(len(key), code, encode_time(source_time))
+        index += key
+        values.append(data)
+    header = HEADER.pack(VERSION, message_type, flags, len(values))
+    return [header, bytes(index)] + values
+
+def decode_message(frames):
+    """
+    Returns a tuple of (message type, flags, items) where items is a list of
+    (key, value, source_time) tuples.
+
+    :param frames: list of bytes-like objects
+    :raises ValueError: if the message is invalid or has another version
+    """
+    if len(frames) < 2 or len(frames[0]) != HEADER.size:
+        raise ValueError("Invalid message header")
+    version, message_type, flags, count = HEADER.unpack(frames[0])
+    if version != VERSION:
+        raise ValueError("Unknown message version: {}".format(version))
+    if len(frames) != count + 2:
+        raise ValueError("Expected {} value frames, got {}".format(count, len(frames) - 2))
+
+    index = memoryview(frames[1])
+    offset = 0
+    items = []
+    try:
+        for data in frames[2:]:
+            key_len, code, seconds = INDEX_ENTRY.unpack_from(index, offset)
+            offset += INDEX_ENTRY.size
+            key = str(index[offset:offset + key_len], "utf-8")
+            offset += key_len
+            items.append((key, codec.decode_value(code, data), decode_time(seconds)))
+    except struct.error as error:
+        raise ValueError("Invalid message index: {}".format(error))
+    return message_type, flags, items
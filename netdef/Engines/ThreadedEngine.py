@@ -1,11 +1,12 @@
 import threading
 from threading import Thread, Event
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
 import os
 import logging
 from . import BaseEngine
 from ..Shared.Internal import Statistics
+from ..Rules.snapshot import RuleSnapshot
 
 log = logging.getLogger("ThreadedEngine")
 log.info("Enter ThreadedEngine")
@@ -29,18 +30,78 @@ class ThreadedEngine(BaseEngine.BaseEngine):
 
     def start(self):
         time.sleep(0.1)
+        time_begin = time.time()
+        config = self.shared.config.config
 
-        log.info("Setup rules")
-        for name, obj in self._rules.instances.items():
-            obj.setup()
+        # kontrollere startes før regler er ferdig parset. da kan de koble
+        # til mens regelfilene parses, og ADD_SOURCE behandles fortløpende
+        pipelined_start = config("ThreadedEngine", "pipelined_start", 1)
+        parallel_setup = config("ThreadedEngine", "parallel_rule_setup", 1)
 
-        log.info("start rules")
-        for name, obj in self._rules.instances.items():
-            obj.add_interrupt(self._interrupt)
-            thr = Thread(target=obj.run, name=name)
-            thr.start()
-            self._rule_pool[name] = thr
+        if RuleSnapshot.compile_only:
+            pipelined_start = 0
+
+        if pipelined_start:
+            self.start_expression_executor()
+            self.start_controllers()
+
+        try:
+            log.info("Setup rules")
+            rule_setup_begin = time.time()
+            if parallel_setup:
+                max_workers = max(1, len(self._rules.instances))
+                with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="RuleSetup") as pool:
+                    futures = {
+                        pool.submit(self.setup_rule, name, obj): name
+                        for name, obj in self._rules.instances.items()
+                    }
+                    # reglene startes så snart de er ferdig parset
+                    for future in as_completed(futures):
+                        name = futures[future]
+                        future.result()
+                        if not RuleSnapshot.compile_only:
+                            self.start_rule(name, self._rules.instances[name])
+            else:
+                for name, obj in self._rules.instances.items():
+                    self.setup_rule(name, obj)
+                if not RuleSnapshot.compile_only:
+                    for name, obj in self._rules.instances.items():
+                        self.start_rule(name, obj)
+        except BaseException:
+            # kontrollere kan allerede kjøre. de må stoppes, ellers henger prosessen
+            self.stop()
+            raise
+
+        if Statistics.on:
+            Statistics.set("ThreadedEngine.startup.rules.time", round(time.time() - rule_setup_begin, 3))
+
+        if RuleSnapshot.compile_only:
+            log.info("Rule snapshots compiled")
+            raise SystemExit(0)
+
+        if not pipelined_start:
+            self.start_expression_executor()
+            self.start_controllers()
+
+        if Statistics.on:
+            Statistics.set("ThreadedEngine.startup.total.time", round(time.time() - time_begin, 3))
+
+    def setup_rule(self, name, obj):
+        "Run setup on given rule and time it"
+        time_begin = time.time()
+        obj.setup()
+        if Statistics.on:
+            Statistics.set(name + ".setup.time", round(time.time() - time_begin, 3))
+
+    def start_rule(self, name, obj):
+        "Start given rule in its own thread"
+        log.info("start rule %s", name)
+        obj.add_interrupt(self._interrupt)
+        thr = Thread(target=obj.run, name=name)
+        thr.start()
+        self._rule_pool[name] = thr
 
+    def start_expression_executor(self):
         log.info("Start expression executor")
         self._expression_executor = ExpressionExecutor("ExpressionExecutor", self.shared)
         self._expression_executor.add_interrupt(self._interrupt)
@@ -50,6 +111,7 @@ class ThreadedEngine(BaseEngine.BaseEngine):
         )
         self._expression_executor_thread.start()
 
+    def start_controllers(self):
         log.info("Start controllers")
         for name, obj in self._controllers.instances.items():
             obj.add_interrupt(self._interrupt)
@@ -1,13 +1,18 @@
-from collections import Iterable
+from collections.abc import Iterable
 from types import ModuleType
 import queue
+import time
 import logging
+import threading
+import pathlib
 from ..Engines.expression.Expression import Expression
 from ..Shared.Internal import Statistics
 from ..Interfaces.internal.tick import Tick
 from ..Sources.BaseSource import BaseSource
 from ..Controllers.BaseController import BaseController
 from .utils import get_module_from_string
+from .snapshot import RuleSnapshot
+from .keyindex import KeyIndex, is_pattern
 
 
 # Det er en blanding av norsk og engelsk her.
@@ -49,6 +54,28 @@ class BaseRule():
 
         self._expressions_setup_functions = []
 
+        # opptak av alt som legges til i setup. kan lagres som snapshot
+        self.snapshot = RuleSnapshot(name, shared)
+
+        # uttrykk som er i bruk, per regelfil. brukes av hot reload
+        # for å finne forskjellen mellom endret regelfil og det som kjører
+        self._live_expressions = {}
+        # (modulfil, sjekksum, setup) som har kjørt. setup kjøres bare på
+        # nytt ved hot reload hvis modulen er endret
+        self._setup_keys = set()
+        self._reloading = False
+        self.reload_on = self.shared.config.config("hot_reload", "on", 0)
+        self.reload_interval = self.shared.config.config("hot_reload", "interval", 5.0)
+        self._next_reload = time.time() + self.reload_interval
+
+        # antall arbeidertråder som kjører handle_run_expression.
+        self.workers = self.shared.config.config("rule_workers", self.name, 1)
+        self._worker_queues = []
+
+        # søketre med kjente nøkler per kontroller, og ferdig utvidede mønstre
+        self.key_indexes = {}
+        self._pattern_cache = {}
+
     def add_interrupt(self, interrupt):
         "Setup the interrupt signal"
         self._interrupt = interrupt
@@ -80,12 +107,76 @@ class BaseRule():
                     Statistics.set(self.name + ".incoming.count", self.incoming.qsize())
                 messagetype, incoming = self.incoming.get(block=True, timeout=0.1)
                 if messagetype == self.messagetypes.RUN_EXPRESSION:
-                    self.handle_run_expression(incoming)
+                    if self.workers > 1:
+                        self.dispatch_to_worker(incoming)
+                    else:
+                        self.handle_run_expression(incoming)
+                elif messagetype == self.messagetypes.RUN_EXPRESSION_BATCH:
+                    # flere kilder endret i samme forespørsel
+                    for item in incoming:
+                        if self.workers > 1:
+                            self.dispatch_to_worker(item)
+                        else:
+                            self.handle_run_expression(item)
                 else:
                     raise NotImplementedError
         except queue.Empty:
             pass
 
+    def start_workers(self):
+        """
+        Start the worker threads. Activate in config:
+
+        .. code-block:: ini
+
+            [rule_workers]
+            CSVRule = 4
+
+        Each worker have its own queue and calls :meth:`handle_run_expression`.
+        """
+        for index in range(self.workers):
+            worker_queue = queue.Queue()
+            self._worker_queues.append(worker_queue)
+            thr = threading.Thread(
+                target=self.loop_worker,
+                args=(index, worker_queue),
+                name="{}-worker{}".format(self.name, index)
+            )
+            thr.start()
+
+    def dispatch_to_worker(self, incoming):
+        """
+        Send the message to a worker. Messages from the same source is
+        always sent to the same worker, so the order of messages from
+        each source is preserved.
+        """
+        if not self._worker_queues:
+            self.start_workers()
+        index = hash(incoming.get_reference()) % self.workers
+        self._worker_queues[index].put_nowait(incoming)
+
+    def loop_worker(self, index, worker_queue):
+        "Main loop of a worker thread. Will exit when receiving interrupt signal"
+        ns = "{}.worker{}.".format(self.name, index)
+        count = 0
+        count_time = time.time()
+
+        while not self.has_interrupt():
+            try:
+                incoming = worker_queue.get(block=True, timeout=0.1)
+                self.handle_run_expression(incoming)
+                count += 1
+            except queue.Empty:
+                pass
+
+            if Statistics.on:
+                now = time.time()
+                if now - count_time >= 10:
+                    Statistics.set(ns + "incoming.count", worker_queue.qsize())
+                    Statistics.set(ns + "incoming.rate", round(count / (now - count_time), 1))
+                    count = 0
+                    count_time = now
+
     def setup(self):
         """
         Implement the following:
@@ -301,7 +392,11 @@ class BaseRule():
         #     "parser". Så i denne konteksten er parser og kildeklasse egentlig det
         #     samme.
         # """
-        self.add_class_to_controller(source_name, controller_name)
+        if not controller_name:
+            controller_name = self.source_and_controller_from_key(source_name)[1]
+        self.snapshot.add_parser(source_name, controller_name)
+        if not self._reloading:
+            self.add_class_to_controller(source_name, controller_name)
 
     @staticmethod
     def get_module_from_string(mod_str, package=None, abs_root=None, location_name=None, mod_name=None):
@@ -323,43 +418,331 @@ class BaseRule():
         if not isinstance(expr_info, ExpressionInfo):
             raise TypeError("Expected ExpressionInfo, got %s" % type(expr_info))
 
-        source_count = 0
-        expr = expr_info.module
-       
+        expanded = self.expand_expression(expr_info)
+        if expanded is not None:
+            return sum(self.add_new_expression(item) for item in expanded)
+
+        arguments = []
         for sourceinfo in expr_info.arguments:
             if not isinstance(sourceinfo, SourceInfo):
                 raise TypeError("Expected SourceInfo, got %s" % type(sourceinfo))
 
             source_name, controller_name = self.source_and_controller_from_key(
                 sourceinfo.typename, sourceinfo.controller)
-            
+
             rule_name = self.rule_name_from_key(sourceinfo.typename, self.name)
             defaultvalue = sourceinfo.defaultvalue
+            arguments.append((sourceinfo.key, source_name, controller_name, rule_name, defaultvalue))
+
+        record = self.snapshot.add_expression(expr_info, arguments)
+        if self._reloading:
+            # hot reload: bare opptak. forskjellen legges til senere
+            return len(arguments)
+
+        source_count = self.link_expression(expr_info.module, expr_info.setup, arguments)
+        if record:
+            self.add_live_expression(self.snapshot.get_current().name, record, expr_info.module)
+        return source_count
+
+    def get_key_index(self, controller_name):
+        """
+        Returns the :class:`netdef.Rules.keyindex.KeyIndex` of given
+        controller. The keys are read from a file declared in config:
+
+        .. code-block:: ini
+
+            [key_index]
+            OPCUAClientController = keys/opcua.txt
+
+        The file has one key per line. Path is relative to project folder.
+
+        :raises ValueError: if no key file is declared for the controller
+        """
+        if not controller_name in self.key_indexes:
+            rel_filename = self.shared.config.config("key_index", controller_name, "", False)
+            if not rel_filename:
+                raise ValueError("Key index missing for controller: {}".format(controller_name))
+            abs_root = self.shared.config.config("proj", "path")
+            filename = str(pathlib.Path(abs_root).joinpath(rel_filename.strip('"')))
+            self.key_indexes[controller_name] = (filename, KeyIndex.from_file(filename))
+            if Statistics.on:
+                Statistics.set(
+                    "{}.key_index.{}.count".format(self.name, controller_name),
+                    len(self.key_indexes[controller_name][1])
+                )
+        return self.key_indexes[controller_name]
+
+    def expand_pattern(self, pattern, controller_name):
+        """
+        Returns a tuple of the keys of given controller that match the
+        pattern. The result is cached. See
+        :func:`netdef.Rules.keyindex.compile_pattern` for the syntax.
+        """
+        filename, index = self.get_key_index(controller_name)
+        # regelfilen må parses på nytt hvis nøkkelfilen endres
+        self.snapshot.add_file(filename)
+
+        cache_key = (controller_name, pattern)
+        if not cache_key in self._pattern_cache:
+            self._pattern_cache[cache_key] = tuple(index.match(pattern))
+        return self._pattern_cache[cache_key]
+
+    def expand_expression(self, expr_info):
+        """
+        If one of the arguments has a pattern as key, then one
+        :class:`ExpressionInfo` is returned for each matching key.
+        Returns None if there is no pattern.
+
+        :raises ValueError: if more than one argument has a pattern
+        """
+        patterns = [i for i, arg in enumerate(expr_info.arguments) if is_pattern(arg.key)]
+        if not patterns:
+            return None
+        if len(patterns) > 1:
+            raise ValueError("Only one pattern allowed in expression: {}".format(
+                ", ".join(expr_info.arguments[i].key for i in patterns)))
+
+        pos = patterns[0]
+        sourceinfo = expr_info.arguments[pos]
+        source_name, controller_name = self.source_and_controller_from_key(
+            sourceinfo.typename, sourceinfo.controller)
+        keys = self.expand_pattern(sourceinfo.key, controller_name)
+        if not keys:
+            self.logger.warning("%s: no keys match %s", self.name, sourceinfo.key)
+
+        expanded = []
+        for key in keys:
+            arguments = list(expr_info.arguments)
+            arguments[pos] = SourceInfo(
+                sourceinfo.typename, key, sourceinfo.controller, sourceinfo.defaultvalue)
+            if expr_info.pymodule:
+                item = ExpressionInfo(expr_info.pymodule, arguments, expr_info.func, expr_info.setup_name)
+            else:
+                expr = Expression(expr_info.module.expression, expr_info.module.filename)
+                item = ExpressionInfo(expr, arguments, expr_info.func, None)
+            expanded.append(item)
+        return expanded
+
+    def add_live_expression(self, entry_name, record, expr):
+        "Keep track of the running expressions for given sub rule"
+        key = self.snapshot.get_expression_key(record)
+        self._live_expressions.setdefault(entry_name, []).append((key, expr))
+        self._setup_keys.add(self.get_setup_key(key))
+
+    @staticmethod
+    def get_setup_key(key):
+        "Returns (module file, module digest, setup name) of an expression key"
+        filename, digest, func, setup_name, arguments = key
+        return filename, digest, setup_name
+
+    def link_expression(self, expr, setup, arguments):
+        """
+        Create source instances from already resolved arguments and
+        link them to the expression. Used by :meth:`add_new_expression`
+        and when loading a snapshot.
+
+        :param netdef.Engines.expression.Expression.Expression expr: the expression
+        :param callable setup: setup function from the expression module or None
+        :param list arguments: list of
+            (key, source_name, controller_name, rule_name, defaultvalue) tuples
+        :returns: number of sources linked to the expression
+        """
+        source_count = 0
 
-            arg = self.convert_to_instance(sourceinfo.key, source_name, controller_name, rule_name, defaultvalue)
-            # 1.
-            already_present = self.has_existing_instance(arg)
-            if already_present:
-                arg = self.get_existing_instance(arg) # erstatt arg med eksisterende instanse
+        with self.shared.expressions.lock:
+            for key, source_name, controller_name, rule_name, defaultvalue in arguments:
+                arg = self.convert_to_instance(key, source_name, controller_name, rule_name, defaultvalue)
+                # 1.
+                already_present = self.has_existing_instance(arg)
+                if already_present:
+                    arg = self.get_existing_instance(arg) # erstatt arg med eksisterende instanse
 
-            self.maintain_searches(arg, expr)
-            # 2.
-            expr.add_arg(arg)
-            source_count += 1
+                self.maintain_searches(arg, expr)
+                # 2.
+                expr.add_arg(arg)
+                source_count += 1
 
-            if not already_present:
-                arg.register_set_callback(self.shared.queues.write_value_to_controller)
-                # 3.
-                self.add_instance_to_controller(arg)
+                if not already_present:
+                    arg.register_set_callback(self.shared.queues.write_value_to_controller)
+                    # 3.
+                    self.add_instance_to_controller(arg)
 
-        if expr_info.setup and not expr_info.setup in self._expressions_setup_functions:
-            self._expressions_setup_functions.append(expr_info.setup)
-            expr_info.setup(self.shared)
+        if setup and not setup in self._expressions_setup_functions:
+            self._expressions_setup_functions.append(setup)
+            setup(self.shared)
 
-        self.shared.expressions.instances.add_expression(expr)
+        with self.shared.expressions.lock:
+            self.shared.expressions.instances.add_expression(expr)
 
         return source_count
 
+    def setup_from_snapshot(self):
+        """
+        Load parsers and expressions from the snapshot file instead of
+        parsing the rule files. Returns False if snapshot is not activated
+        in config or if config or any of the rule files have changed.
+        See :class:`netdef.Rules.snapshot.RuleSnapshot`
+        """
+        if not self.snapshot.on or RuleSnapshot.compile_only:
+            return False
+
+        if not self.snapshot.load():
+            return False
+
+        for entry in self.snapshot.entries.values():
+            for source_name, controller_name in entry.parsers:
+                self.add_class_to_controller(source_name, controller_name)
+
+            expression_count = 0
+            source_count = 0
+            for module_index, func, setup_name, arguments in entry.expressions:
+                pymodule = self.snapshot.get_module(module_index)
+                expr = Expression(getattr(pymodule, func), pymodule.__file__)
+                setup = getattr(pymodule, setup_name) if setup_name else None
+                expression_count += 1
+                source_count += self.link_expression(expr, setup, arguments)
+                self.add_live_expression(entry.name, (module_index, func, setup_name, arguments), expr)
+
+            self.update_statistics(self.name + "." + entry.name, 0, expression_count, source_count)
+        return True
+
+    def save_snapshot(self):
+        "Save parsed rule files to snapshot file if activated in config"
+        if self.snapshot.on or RuleSnapshot.compile_only:
+            self.snapshot.save()
+
+    def remove_expression(self, expr):
+        """
+        Remove the expression from shared.expressions.instances.
+        Sources that no longer are associated with any expressions is
+        removed from shared.sources.instances and a REMOVE_SOURCE message
+        is sent to the controller.
+        """
+        with self.shared.expressions.lock:
+            unused_refs = self.shared.expressions.instances.remove_expression(expr)
+            for arg in expr.args:
+                ref = arg.get_reference()
+                if ref in unused_refs and self.shared.sources.instances.has_item_ref(ref):
+                    unused_refs.remove(ref)
+                    self.remove_instance_from_controller(arg)
+
+    def remove_instance_from_controller(self, item_instance):
+        """ Send REMOVE_SOURCE to controller of given source.
+
+            :param netdef.Sources.BaseSource item_instance: source instance
+
+        """
+        self.shared.sources.instances.remove_item(item_instance)
+        self.shared.queues.send_message_to_controller(
+            self.shared.queues.MessageType.REMOVE_SOURCE,
+            item_instance.controller,
+            item_instance
+        )
+
+    def parse_entry(self, name):
+        """
+        Parse the sub rule with given name. Implement this in rule to
+        support hot reload. Example::
+
+            def parse_entry(self, name):
+                self.setup_csv_rule(name)
+
+        """
+        raise NotImplementedError
+
+    def loop_reload(self):
+        """
+        Check the rule files for changes and apply the difference if
+        hot reload is activated in config:
+
+        .. code-block:: ini
+
+            [hot_reload]
+            on = 1
+            interval = 5.0
+
+        Should be called periodically from :meth:`run`
+        """
+        if not self.reload_on or time.time() < self._next_reload:
+            return
+        self._next_reload = time.time() + self.reload_interval
+
+        for name in self.snapshot.changed_entries():
+            self.reload_entry(name)
+
+    def reload_entry(self, name):
+        """
+        Parse the sub rule again and compare the result with the running
+        expressions. Only the added and removed expressions are applied.
+        Returns True on success.
+        """
+        self.logger.info("%s: reload %s", self.name, name)
+        old_entry = self.snapshot.entries[name]
+        self.key_indexes.clear()
+        self._pattern_cache.clear()
+
+        self._reloading = True
+        try:
+            self.parse_entry(name)
+        except Exception as error:
+            self.logger.error("%s: cannot reload %s: %s", self.name, name, error)
+            self.snapshot.entries[name] = old_entry
+            # modulen fra den mislykkede parsingen er ikke i bruk
+            self.snapshot.prune_modules()
+            return False
+        finally:
+            self._reloading = False
+
+        new_entry = self.snapshot.entries[name]
+
+        for source_name, controller_name in new_entry.parsers:
+            if not (source_name, controller_name) in old_entry.parsers:
+                self.add_class_to_controller(source_name, controller_name)
+
+        unchanged = {}
+        for key, expr in self._live_expressions.get(name, []):
+            unchanged.setdefault(key, []).append(expr)
+
+        live_expressions = []
+        added = 0
+        for record in new_entry.expressions:
+            key = self.snapshot.get_expression_key(record)
+            if unchanged.get(key, None):
+                live_expressions.append((key, unchanged[key].pop()))
+            else:
+                module_index, func, setup_name, arguments = record
+                pymodule = self.snapshot.get_module(module_index)
+                expr = Expression(getattr(pymodule, func), pymodule.__file__)
+                setup = getattr(pymodule, setup_name) if setup_name else None
+                setup_key = self.get_setup_key(key)
+                if setup_key in self._setup_keys:
+                    # modulen er ikke endret. setup er allerede kjørt
+                    setup = None
+                self._setup_keys.add(setup_key)
+                self.link_expression(expr, setup, arguments)
+                live_expressions.append((key, expr))
+                added += 1
+
+        # fjerner til slutt, slik at kilder som fortsatt er i bruk blir værende
+        removed = 0
+        for expressions in unchanged.values():
+            for expr in expressions:
+                self.remove_expression(expr)
+                removed += 1
+
+        self._live_expressions[name] = live_expressions
+        self._expressions_setup_functions.clear()
+        self.snapshot.prune_modules()
+
+        if Statistics.on:
+            ns = self.name + "." + name + "."
+            Statistics.set(ns + "reload.added.count", added)
+            Statistics.set(ns + "reload.removed.count", removed)
+        self.logger.info("%s: %s reloaded. %d expressions added, %d removed", self.name, name, added, removed)
+
+        self.save_snapshot()
+        return True
+
     def maintain_searches(self, source_instance, expression):
         """ Keeps shared.expressions.instances updated
         """
@@ -453,7 +836,7 @@ class ExpressionInfo():
     """
     # Dette er en dataklasse som *beskriver* et uttrykk. Regelmotoren
     # skal opprette et uttrykk basert på denne infoen her.
-    __slots__ = ["module", "func", "arguments", "setup"]
+    __slots__ = ["module", "pymodule", "func", "arguments", "setup", "setup_name"]
     def __init__(self, module, arguments, func="expression", setup="setup"):
 
         if not isinstance(func, str):
@@ -469,11 +852,15 @@ class ExpressionInfo():
             raise TypeError("module: wrong datatype")
 
         self.module = _expr
+        self.pymodule = _pymod
+        self.func = func
 
         if setup and hasattr(_pymod, setup):
             self.setup = getattr(_pymod, setup)
+            self.setup_name = setup
         else:
             self.setup = None
+            self.setup_name = None
 
         self.arguments = []
         if not arguments:
@@ -26,12 +26,20 @@ class CSVRule(BaseRule.BaseRule):
     def setup(self):
         "Parse config files"
         log.info("Running setup")
-        for name, active in self.shared.config.get_dict(NAME).items():
-            if int(active):
-                self.setup_csv_rule(name)
-        log.info("Done parsing")
+        if self.setup_from_snapshot():
+            log.info("Done loading snapshot")
+        else:
+            for name, active in self.shared.config.get_dict(NAME).items():
+                if int(active):
+                    self.setup_csv_rule(name)
+            log.info("Done parsing")
+            self.save_snapshot()
         self.setup_done()
 
+    def parse_entry(self, name):
+        "Parse given csv-rule again. Used by hot reload"
+        self.setup_csv_rule(name)
+
     def setup_csv_rule(self, name):
         log.info("loading %s", name)
         abs_root = self.shared.config("proj", "path")
@@ -52,6 +60,7 @@ class CSVRule(BaseRule.BaseRule):
         # lett tilgjengelig i Rules-klassen
 
         abs_csvfile = str(pathlib.Path(abs_root).joinpath(rel_csvfile))
+        self.snapshot.begin(name, abs_csvfile)
 
         start_of_csv = 0
 
@@ -88,6 +97,7 @@ class CSVRule(BaseRule.BaseRule):
         log.info("Running")
         while not self.has_interrupt():
             self.loop_incoming() # dispatch handle_* functions
+            self.loop_reload() # apply changes in rule files
         log.info("Stopped")
 
     def handle_run_expression(self, incoming):
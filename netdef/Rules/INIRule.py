@@ -27,12 +27,20 @@ class INIRule(BaseRule.BaseRule):
     def setup(self):
         "Parse config files"
         self.logger.info("Running setup")
-        for name, rel_ini_file in self.shared.config.get_dict(NAME).items():
-            if rel_ini_file:
-                self.setup_ini_rule(name, rel_ini_file)
-        self.logger.info("Done parsing")
+        if self.setup_from_snapshot():
+            self.logger.info("Done loading snapshot")
+        else:
+            for name, rel_ini_file in self.shared.config.get_dict(NAME).items():
+                if rel_ini_file:
+                    self.setup_ini_rule(name, rel_ini_file)
+            self.logger.info("Done parsing")
+            self.save_snapshot()
         self.setup_done()
 
+    def parse_entry(self, name):
+        "Parse given ini-file again. Used by hot reload"
+        self.setup_ini_rule(name, self.shared.config.get_dict(NAME)[name])
+
     def setup_ini_rule(self, name, rel_inifile):
         "parse given ini-file"
         self.logger.info("loading %s", name)
@@ -42,6 +50,7 @@ class INIRule(BaseRule.BaseRule):
         # parse ini
         abs_inifile = str(pathlib.Path(abs_root).joinpath(rel_inifile))
         encoding = None # TODO: parse from config
+        self.snapshot.begin(name, abs_inifile)
 
         ini_object = configparser.ConfigParser()
         ini_object.read(abs_inifile)
@@ -102,6 +111,7 @@ class INIRule(BaseRule.BaseRule):
         self.logger.info("Running")
         while not self.has_interrupt():
             self.loop_incoming() # dispatch handle_* functions
+            self.loop_reload() # apply changes in rule files
         self.logger.info("Stopped")
 
     def handle_run_expression(self, incoming):
@@ -22,12 +22,20 @@ class YAMLRule(BaseRule.BaseRule):
     def setup(self):
         "Parse config files"
         self.logger.info("Running setup")
-        for name, rel_yaml_file in self.shared.config.get_dict(NAME).items():
-            if rel_yaml_file:
-                self.setup_yaml_rule(name, rel_yaml_file)
-        self.logger.info("Done parsing")
+        if self.setup_from_snapshot():
+            self.logger.info("Done loading snapshot")
+        else:
+            for name, rel_yaml_file in self.shared.config.get_dict(NAME).items():
+                if rel_yaml_file:
+                    self.setup_yaml_rule(name, rel_yaml_file)
+            self.logger.info("Done parsing")
+            self.save_snapshot()
         self.setup_done()
 
+    def parse_entry(self, name):
+        "Parse given yaml-file again. Used by hot reload"
+        self.setup_yaml_rule(name, self.shared.config.get_dict(NAME)[name])
+
     def setup_yaml_rule(self, name, rel_yamlfile):
         "parse given yaml-file"
         self.logger.info("loading %s", name)
@@ -38,6 +46,7 @@ class YAMLRule(BaseRule.BaseRule):
         # parse yaml
         abs_yamlfile = str(pathlib.Path(abs_root).joinpath(rel_yamlfile))
         encoding = None # TODO: parse from config
+        self.snapshot.begin(name, abs_yamlfile)
 
         with open(abs_yamlfile, encoding=encoding) as yamlfile:
 
@@ -74,6 +83,7 @@ class YAMLRule(BaseRule.BaseRule):
         self.logger.info("Running")
         while not self.has_interrupt():
             self.loop_incoming() # dispatch handle_* functions
+            self.loop_reload() # apply changes in rule files
         self.logger.info("Stopped")
 
     def handle_run_expression(self, incoming):
@@ -0,0 +1,113 @@
+import re
+import fnmatch
+
+# Et søketre (prefix trie) over alle kjente nøkler til en kontroller.
+# Mønstre i SourceInfo.key utvides til konkrete nøkler ved å gå ned i
+# treet til den faste delen av mønsteret, og deretter teste resten.
+# Slik trenger vi bare å teste nøklene som har riktig prefiks.
+
+GLOB_PREFIX = "glob:"
+REGEX_PREFIX = "re:"
+
+_GLOB_SPECIAL = "*?["
+_REGEX_SPECIAL = ".^$*+?{}[]\\|()"
+
+def is_pattern(key):
+    "Returns True if the key is a glob- or regex-pattern"
+    return isinstance(key, str) and (key.startswith(GLOB_PREFIX) or key.startswith(REGEX_PREFIX))
+
+def _literal_prefix(text, special):
+    for i, char in enumerate(text):
+        if char in special:
+            return text[:i]
+    return text
+
+def compile_pattern(pattern):
+    """
+    Returns a tuple of (literal prefix, compiled regex) for given pattern.
+
+    * ``glob:ns=2;s=Pump*.Speed`` is a shell-style pattern (see :mod:`fnmatch`)
+    * ``re:ns=2;s=Pump\\d+\\.Speed`` is a regular expression
+
+    :raises ValueError: if the pattern has an unknown prefix
+    """
+    if pattern.startswith(GLOB_PREFIX):
+        glob = pattern[len(GLOB_PREFIX):]
+        return _literal_prefix(glob, _GLOB_SPECIAL), re.compile(fnmatch.translate(glob))
+    elif pattern.startswith(REGEX_PREFIX):
+        regex = pattern[len(REGEX_PREFIX):]
+        if "|" in regex:
+            # alternativer kan ha ulike prefiks
+            prefix = ""
+        else:
+            prefix = _literal_prefix(regex, _REGEX_SPECIAL)
+        # et kvantor etter siste tegn gjelder det tegnet, f.eks "ab?"
+        if prefix and regex[len(prefix):len(prefix) + 1] in ("*", "?", "{"):
+            prefix = prefix[:-1]
+        return prefix, re.compile(regex)
+    raise ValueError("Not a pattern: {}".format(pattern))
+
+
+class KeyIndex():
+    """
+    A prefix trie of source keys. Used to expand glob- and regex-patterns
+    into the keys that are known to a controller.
+    """
+    def __init__(self, keys=()):
+        self.root = {}
+        self.count = 0
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key):
+        "Add a key to the index"
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        # None er en gyldig nøkkel i treet fordi alle andre nøkler er tegn
+        if not None in node:
+            node[None] = key
+            self.count += 1
+
+    def keys_with_prefix(self, prefix):
+        "Returns a list of all keys that starts with given prefix"
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        keys = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char is None:
+                    keys.append(child)
+                else:
+                    stack.append(child)
+        return keys
+
+    def match(self, pattern):
+        """
+        Returns a sorted list of the keys that match given pattern.
+        See :func:`compile_pattern` for the syntax.
+        """
+        prefix, regex = compile_pattern(pattern)
+        return sorted(key for key in self.keys_with_prefix(prefix) if regex.fullmatch(key))
+
+    @staticmethod
+    def from_file(filename, encoding=None):
+        """
+        Create an index from a text file with one key per line.
+        Empty lines and lines starting with # are ignored.
+        """
+        index = KeyIndex()
+        with open(str(filename), encoding=encoding) as f:
+            for line in f:
+                key = line.strip()
+                if key and not key.startswith("#"):
+                    index.add(key)
+        return index
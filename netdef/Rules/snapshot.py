@@ -0,0 +1,360 @@
+import os
+import sys
+import pickle
+import hashlib
+import pathlib
+import logging
+import importlib
+from collections import OrderedDict
+from .utils import import_file
+from .. import __version__
+
+# Et snapshot er en ferdig parset utgave av grafen som regelmotoren bygger
+# opp i setup: parsere, uttrykk og kildene som er knyttet til uttrykkene.
+# Snapshotet lagres til fil og er merket med en sjekksum av konfigfilene og
+# alle regelfilene som ble lest. Ved oppstart brukes snapshotet dersom
+# sjekksummene er like, slik at csv/yaml/ini-filene ikke trenger å parses.
+
+SNAPSHOT_VERSION = 1
+
+def file_digest(filename):
+    """
+    Returns the sha256 hexdigest of given file.
+    Returns an empty string if the file cannot be read.
+    """
+    try:
+        with open(str(filename), "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return ""
+
+def config_digest(config):
+    """
+    Returns a sha256 hexdigest of the default config string and every
+    configfile that was parsed at startup
+
+    :param netdef.Shared.SharedConfig.Config config: the config instance
+    """
+    digest = hashlib.sha256()
+    digest.update(__version__.encode("utf-8"))
+    digest.update(str(config.default_config_string).encode("utf-8"))
+    for filename in config.get_read_files():
+        digest.update(filename.encode("utf-8"))
+        digest.update(file_digest(filename).encode("ascii"))
+    return digest.hexdigest()
+
+
+class SnapshotEntry():
+    """
+    The parsed result of one sub rule (a csv-, yaml- or ini-file).
+
+    :attr:`files` is a dict of filename and its sha256 hexdigest.
+    :attr:`parsers` is a list of (source_name, controller_name) tuples.
+    :attr:`expressions` is a list of (module_index, func, setup, arguments)
+    tuples where arguments is a list of
+    (key, source_name, controller_name, rule_name, defaultvalue) tuples
+    """
+    __slots__ = ["name", "files", "parsers", "expressions"]
+    def __init__(self, name):
+        self.name = name
+        self.files = OrderedDict()
+        self.parsers = []
+        self.expressions = []
+
+    def is_valid(self):
+        "Returns True if none of the files have changed"
+        for filename, digest in self.files.items():
+            if file_digest(filename) != digest:
+                return False
+        return True
+
+
+class RuleSnapshot():
+    """
+    Records everything a rule adds to the shared expression graph during
+    setup, and can save or load the result to and from a file.
+
+    Config entries:
+
+    .. code-block:: ini
+
+        [snapshot]
+        on = 0
+        path = cache
+
+    The snapshot is saved as ``[path]/[rule name].snapshot``. Path is
+    relative to project folder.
+
+    :param str name: name of the rule
+    :param netdef.Shared.Shared shared: a reference to the shared object
+    """
+    # settes av kommandolinjevalget --compile-rules. Regelfilene parses
+    # alltid og snapshot lagres uavhengig av snapshot_on
+    compile_only = False
+
+    def __init__(self, name, shared):
+        self.name = name
+        self.shared = shared
+        self.logger = logging.getLogger(name)
+        config = self.shared.config.config
+        # kan ikke bruke seksjonen til regelen. den inneholder regelfilene
+        self.on = config("snapshot", "on", 0)
+        self.filename = pathlib.Path(config("proj", "path")).joinpath(
+            config("snapshot", "path", "cache"),
+            "{}.snapshot".format(name)
+        )
+        self.clear()
+
+    def clear(self):
+        "Reset the recorded graph"
+        self.entries = OrderedDict()
+        self.modules = []
+        self._module_index = {}
+        self._loaded_modules = {}
+        self._module_digest = {}
+        self._file_stat = {}
+        self._current = None
+        # uttrykk laget uten python-modul kan ikke gjenskapes fra fil
+        self.complete = True
+
+    def begin(self, name, *filenames):
+        """
+        Start recording a sub rule. Everything recorded until next
+        call to begin is associated with given name.
+
+        :param str name: name of the sub rule
+        :param filenames: rule files that are parsed by the sub rule
+        """
+        self._current = SnapshotEntry(name)
+        self.entries[name] = self._current
+        for filename in filenames:
+            self.add_file(filename)
+
+    def get_current(self):
+        if self._current is None:
+            self.begin("")
+        return self._current
+
+    def add_file(self, filename):
+        "Add a file to the checksum of current sub rule"
+        filename = str(filename)
+        self.get_current().files[filename] = file_digest(filename)
+        try:
+            stat = os.stat(filename)
+            self._file_stat[filename] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            self._file_stat[filename] = None
+
+    def add_parser(self, source_name, controller_name):
+        "Record an ADD_PARSER"
+        parser = (source_name, controller_name)
+        current = self.get_current()
+        if not parser in current.parsers:
+            current.parsers.append(parser)
+
+    def add_expression(self, expr_info, arguments):
+        """
+        Record an expression and its resolved arguments
+
+        :param netdef.Rules.BaseRule.ExpressionInfo expr_info: the expression
+        :param list arguments: list of
+            (key, source_name, controller_name, rule_name, defaultvalue) tuples
+
+        Returns the recorded tuple, or None if the expression cannot be
+        recorded.
+        """
+        module_index = self.add_module(expr_info.pymodule)
+        if module_index is None:
+            self.complete = False
+            return None
+        record = (module_index, expr_info.func, expr_info.setup_name, tuple(arguments))
+        self.get_current().expressions.append(record)
+        return record
+
+    def get_expression_key(self, record):
+        """
+        Returns a key that identifies a recorded expression. Two records
+        with equal keys describe the same expression with the same
+        sources, even if they are parsed at different times.
+        """
+        module_index, func, setup_name, arguments = record
+        if not module_index in self._module_digest:
+            filename = self.modules[module_index][-1]
+            self._module_digest[module_index] = file_digest(filename) if filename else ""
+        return (
+            self.modules[module_index][-1],
+            self._module_digest[module_index],
+            func,
+            setup_name,
+            tuple(argument[:4] for argument in arguments)
+        )
+
+    def changed_entries(self):
+        """
+        Returns a list of names of the sub rules where any of the files
+        have changed since last call.
+        """
+        # en fil kan høre til flere regelfiler, f.eks en nøkkelfil.
+        # stat oppdateres derfor først når alle er sjekket
+        new_stat = {}
+        changed = []
+        for name, entry in self.entries.items():
+            for filename, digest in entry.files.items():
+                if not filename in new_stat:
+                    try:
+                        stat = os.stat(filename)
+                        new_stat[filename] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        new_stat[filename] = None
+                if self._file_stat.get(filename, None) == new_stat[filename]:
+                    continue
+                if file_digest(filename) != digest:
+                    changed.append(name)
+                    break
+        self._file_stat.update(new_stat)
+        return changed
+
+    def add_module(self, pymodule):
+        """
+        Returns an index into :attr:`modules` that can be used to import
+        the given module again. Returns None if not possible.
+        """
+        if pymodule is None:
+            return None
+
+        if id(pymodule) in self._module_index:
+            index = self._module_index[id(pymodule)]
+            # flere regelfiler kan bruke samme modul. alle må lastes på nytt
+            # når modulen endres
+            filename = self.modules[index][-1]
+            if filename and not filename in self.get_current().files:
+                self.add_file(filename)
+            return index
+
+        name = pymodule.__name__
+        filename = getattr(pymodule, "__file__", None)
+
+        if sys.modules.get(name) is pymodule:
+            module_ref = ("module", name, filename)
+        elif filename and "." in name:
+            # importert med utils.import_file(filename, location_name, mod_name)
+            location_name, mod_name = name.split(".", 1)
+            module_ref = ("file", location_name, mod_name, filename)
+        else:
+            return None
+
+        if filename:
+            self.add_file(filename)
+
+        self.modules.append(module_ref)
+        index = len(self.modules) - 1
+        self._module_index[id(pymodule)] = index
+        self._loaded_modules[index] = pymodule
+        return index
+
+    def prune_modules(self):
+        """
+        Remove the modules that no recorded expression uses. The module
+        indexes of the expressions are updated. Called after hot reload,
+        where every reload imports the module again.
+        """
+        used = sorted(set(
+            record[0] for entry in self.entries.values() for record in entry.expressions
+        ))
+        if len(used) == len(self.modules):
+            return
+        new_index = {old: new for new, old in enumerate(used)}
+        for entry in self.entries.values():
+            entry.expressions = [
+                (new_index[module_index], func, setup_name, arguments)
+                for module_index, func, setup_name, arguments in entry.expressions
+            ]
+        self.modules = [self.modules[old] for old in used]
+        self._loaded_modules = {
+            new_index[old]: pymodule for old, pymodule in self._loaded_modules.items()
+            if old in new_index
+        }
+        self._module_index = {
+            id(pymodule): index for index, pymodule in self._loaded_modules.items()
+        }
+        self._module_digest = {
+            new_index[old]: digest for old, digest in self._module_digest.items()
+            if old in new_index
+        }
+
+    def get_module(self, index):
+        "Returns the module at given index. Imports it if needed"
+        if not index in self._loaded_modules:
+            module_ref = self.modules[index]
+            if module_ref[0] == "module":
+                pymodule = importlib.import_module(module_ref[1])
+            else:
+                _, location_name, mod_name, filename = module_ref
+                pymodule = import_file(filename, location_name, mod_name)
+            self._loaded_modules[index] = pymodule
+            self._module_index[id(pymodule)] = index
+        return self._loaded_modules[index]
+
+    def save(self):
+        "Write the recorded graph to :attr:`filename`"
+        if not self.complete:
+            self.logger.warning("Snapshot not saved: rule contains expressions without module")
+            return False
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "config": config_digest(self.shared.config),
+            "modules": self.modules,
+            "entries": [
+                (entry.name, entry.files, entry.parsers, entry.expressions)
+                for entry in self.entries.values()
+            ]
+        }
+        try:
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+            tmp_filename = self.filename.with_suffix(".tmp")
+            with open(str(tmp_filename), "wb") as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            tmp_filename.replace(self.filename)
+        except (OSError, pickle.PicklingError, AttributeError, TypeError) as error:
+            self.logger.warning("Cannot save snapshot %s: %s", self.filename, error)
+            return False
+        self.logger.info("Snapshot saved to %s", self.filename)
+        return True
+
+    def load(self):
+        """
+        Read the graph from :attr:`filename`.
+        Returns True if the snapshot is found and all checksums match
+        """
+        self.clear()
+        try:
+            with open(str(self.filename), "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as error:
+            self.logger.warning("Cannot load snapshot %s: %s", self.filename, error)
+            return False
+
+        if data.get("version") != SNAPSHOT_VERSION:
+            self.logger.info("Snapshot version changed. Parsing rule files")
+            return False
+
+        if data.get("config") != config_digest(self.shared.config):
+            self.logger.info("Config changed. Parsing rule files")
+            return False
+
+        for name, files, parsers, expressions in data["entries"]:
+            entry = SnapshotEntry(name)
+            entry.files = files
+            entry.parsers = parsers
+            entry.expressions = expressions
+            if not entry.is_valid():
+                self.logger.info("%s changed. Parsing rule files", name)
+                self.clear()
+                return False
+            self.entries[name] = entry
+
+        self.modules = data["modules"]
+        self.logger.info("Snapshot loaded from %s", self.filename)
+        return True
@@ -2,6 +2,7 @@ import os
 import sys
 import logging
 import pathlib
+import threading
 from collections import OrderedDict
 from configparser import ConfigParser, ExtendedInterpolation, InterpolationMissingOptionError
 
@@ -10,6 +11,7 @@ log = logging.getLogger(__name__)
 class Config():
     """
     A *wrapper* class for the configparser module in standard python library.
+    Thread safe. Rules and controllers can read config at the same time.
 
     :param str identifier: a unique identifier for this app.
     :param str install_path: Full filepath to application package location
@@ -21,6 +23,10 @@ class Config():
 
         self.IDENTIFIER = identifier
 
+        # config() legger til manglende verdier. regler settes opp i
+        # parallell og kontrollere startes samtidig, så alt går via låsen
+        self._lock = threading.RLock()
+
         if not install_path:
             install_path = os.path.dirname(__file__)
             #install_path = os.path.expanduser(install_path)
@@ -36,6 +42,12 @@ class Config():
         _config.optionxform = str
 
         self._config = _config
+        self.default_config_string = default_config_string
+
+        # liste over konfigfiler som faktisk er lest. brukes av
+        # regel-snapshot for å avgjøre om konfig er endret
+        self._read_files = []
+
         _config.add_section("install")
         _config.set("install", "path", install_path)
         _config.add_section("proj")
@@ -56,15 +68,14 @@ class Config():
 
         if "config" in self._config:
             for ident, path in self.get_dict("config").items():
-                self._config.read(path, encoding=self.conf_encoding)
+                self.read(path)
 
         # denne filen skal ikke være redigerbare fra web eller filsystem
         # brukes til å låse bestemte konfiger. må derfor leses sist.
-        self._config.read(
+        self.read(
             "{config_path}/default.lock".format(
                 config_path=config_path
-                ),
-                encoding=self.conf_encoding
+                )
             )
 
         # liste over konfiger som ikke skal være synlig i webadmin
@@ -74,42 +85,59 @@ class Config():
     def read_default(self, config_path):
         log.info("Read config from %s", config_path)
 
-        self._config.read(
+        self.read(
             "{config_path}/default.conf".format(
                 config_path=config_path
-                ),
-                encoding=self.conf_encoding
+                )
             )
-        self._config.read(
+        self.read(
             "{config_path}/default.{os_name}.conf".format(
                 config_path=config_path,
                 os_name=os.name
-                ),
-                encoding=self.conf_encoding
+                )
             )
 
+    def read(self, filename):
+        "Parse given configfile. Missing files are silently ignored."
+        with self._lock:
+            self._read_files.extend(
+                self._config.read(filename, encoding=self.conf_encoding)
+            )
+
+    def get_read_files(self):
+        "Returns a list of the configfiles that was successfully parsed"
+        with self._lock:
+            return list(self._read_files)
+
     def __call__(self, section, key, defaultvalue=None, add_if_not_exists=True):
         return self.config(section, key, defaultvalue)
 
     def config(self, section, key, defaultvalue=None, add_if_not_exists=True):
-        try:
-            if defaultvalue is None:
-                return self._config[section][key]
-            else:
-                # typecast basert på defaultvalue
-                return type(defaultvalue)(self._config[section][key])
-        except (KeyError, InterpolationMissingOptionError):
-            if add_if_not_exists:
-                self.set_config(section, key, str(defaultvalue))
-            return defaultvalue
+        with self._lock:
+            try:
+                if defaultvalue is None:
+                    return self._config[section][key]
+                else:
+                    # typecast basert på defaultvalue
+                    return type(defaultvalue)(self._config[section][key])
+            except (KeyError, InterpolationMissingOptionError):
+                if add_if_not_exists:
+                    self.set_config(section, key, str(defaultvalue))
+                return defaultvalue
 
     def set_config(self, section, key, value):
-        self.add_section(section)
-        self._config.set(section, key, value)
+        with self._lock:
+            self.add_section(section)
+            self._config.set(section, key, value)
 
     def add_section(self, section):
-        if not self._config.has_section(section):
-            self._config.add_section(section)
+        with self._lock:
+            if not self._config.has_section(section):
+                self._config.add_section(section)
+
+    def has_section(self, section):
+        with self._lock:
+            return self._config.has_section(section)
 
     def set_hidden_value(self, section, key):
         if not section in self._hidden:
@@ -123,7 +151,8 @@ class Config():
         return (key in self._hidden[section])
         
     def get_dict(self, section):
-        return OrderedDict(self._config[section])
+        with self._lock:
+            return OrderedDict(self._config[section])
 
     def get_full_list(self):
         def walker():
@@ -137,7 +166,8 @@ class Config():
                 except InterpolationMissingOptionError as error:
                     yield section, "ERROR", repr(error)
 
-        return walker()
+        with self._lock:
+            return iter(list(walker()))
 
     def verify(self, proj_path, config_path):
         proj_path = pathlib.Path(proj_path)
@@ -1,3 +1,5 @@
+import threading
+
 class ExpressionInstances():
     def __init__(self):
         self.items = []
@@ -21,5 +23,33 @@ class ExpressionInstances():
     def has_expression_in_source_ref(self, ref, expression):
         return expression in self.items_by_reference[ref]
 
+    def remove_expression(self, item):
+        """
+        Remove the expression and all references to it.
+        Returns a list of source references that no longer have
+        any expressions associated.
+        """
+        if item in self.items:
+            self.items.remove(item)
+
+        unused_refs = []
+        for arg in item.args:
+            ref = arg.get_reference()
+            expressions = self.items_by_reference.get(ref, None)
+            if expressions and item in expressions:
+                expressions.remove(item)
+                if not expressions:
+                    del self.items_by_reference[ref]
+                    unused_refs.append(ref)
+        return unused_refs
+
 class SharedExpressions():
+    """
+    :attr:`instances` contains all expressions created by the rules.
+
+    :attr:`lock` must be acquired by rules that changes :attr:`instances`
+    or the source instances in :class:`netdef.Shared.SharedSources.SharedSources`.
+    Rules can be set up in parallel.
+    """
     instances = ExpressionInstances()
+    lock = threading.RLock()
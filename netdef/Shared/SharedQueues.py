@@ -3,7 +3,8 @@ from enum import Enum
 import logging
 
 # mesage types
-# only ADD_SOURCE, ADD_PARSER, WRITE_SOURCE, RUN_EXPRESSION er implementert
+# only ADD_SOURCE, ADD_PARSER, WRITE_SOURCE, RUN_EXPRESSION, RUN_EXPRESSION_BATCH,
+# REMOVE_SOURCE er implementert
 
 class MessageType(Enum):
     READ_ALL = 1  # not implementet yet
@@ -12,8 +13,9 @@ class MessageType(Enum):
     WRITE_SOURCE = 4
     RUN_EXPRESSION = 5
     ADD_PARSER = 6
-    REMOVE_SOURCE = 7  # not implementet yet
+    REMOVE_SOURCE = 7
     TICK = 8
+    RUN_EXPRESSION_BATCH = 9 # same as RUN_EXPRESSION with a list of sources
 
 class SharedQueues():
     """
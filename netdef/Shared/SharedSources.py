@@ -23,6 +23,12 @@ class SourceInstances():
         self.items_by_reference[item.get_reference()]=  item
         self.items.append(item)
 
+    def remove_item(self, item):
+        ref = item.get_reference()
+        if ref in self.items_by_reference:
+            item = self.items_by_reference.pop(ref)
+            self.items.remove(item)
+
     def get_item_by_ref(self, ref):
         return self.items_by_reference[ref]
 
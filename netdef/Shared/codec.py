@@ -0,0 +1,109 @@
+import json
+import struct
+import decimal
+import datetime
+
+# Kompakt binærformat for verdier som sendes mellom noder. Hver verdi har
+# en typekode på én byte og data. Tall pakkes med struct, tekst som utf-8
+# og bytes sendes uendret. Andre typer (lister, dict osv.) sendes som json.
+#
+# Støttede typer: None, bool, int, float, str, bytes, datetime, Decimal og
+# det json kan kode. Merk at json gjør tupler om til lister og tall-nøkler i
+# dict om til tekst. Andre typer gir TypeError.
+
+NONE = 0
+FALSE = 1
+TRUE = 2
+INT = 3
+FLOAT = 4
+STR = 5
+BYTES = 6
+JSON = 7
+BIGINT = 8
+DATETIME = 9
+DECIMAL = 10
+
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+# mikrosekunder siden epoch, utc offset i sekunder og om tiden har tidssone
+_DATETIME = struct.Struct("<qi?")
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def encode_value(value):
+    """
+    Returns a tuple of (type code, data). Bytes-like values are returned
+    as is, without copying.
+
+    :raises TypeError: if the type of value is not supported
+    """
+    if value is None:
+        return NONE, b""
+    elif value is True:
+        return TRUE, b""
+    elif value is False:
+        return FALSE, b""
+    elif isinstance(value, int):
+        if -2**63 <= value < 2**63:
+            return INT, _INT.pack(value)
+        return BIGINT, str(value).encode("ascii")
+    elif isinstance(value, float):
+        return FLOAT, _FLOAT.pack(value)
+    elif isinstance(value, str):
+        return STR, value.encode("utf-8")
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return BYTES, value
+    elif isinstance(value, datetime.datetime):
+        offset = value.utcoffset()
+        delta = value.replace(tzinfo=None) - EPOCH
+        return DATETIME, _DATETIME.pack(
+            delta // datetime.timedelta(microseconds=1),
+            int(offset.total_seconds()) if offset is not None else 0,
+            offset is not None
+        )
+    elif isinstance(value, decimal.Decimal):
+        return DECIMAL, str(value).encode("ascii")
+    return JSON, json.dumps(value).encode("utf-8")
+
+def decode_value(code, data):
+    """
+    Returns the value of given type code and data.
+
+    :raises ValueError: if the type code is unknown
+    """
+    if code == NONE:
+        return None
+    elif code == TRUE:
+        return True
+    elif code == FALSE:
+        return False
+    elif code == INT:
+        return _INT.unpack(data)[0]
+    elif code == FLOAT:
+        return _FLOAT.unpack(data)[0]
+    elif code == STR:
+        return str(data, "utf-8")
+    elif code == BYTES:
+        return bytes(data)
+    elif code == JSON:
+        return json.loads(str(data, "utf-8"))
+    elif code == BIGINT:
+        return int(str(data, "ascii"))
+    elif code == DATETIME:
+        micros, offset, aware = _DATETIME.unpack(data)
+        value = EPOCH + datetime.timedelta(microseconds=micros)
+        if aware:
+            value = value.replace(tzinfo=datetime.timezone(datetime.timedelta(seconds=offset)))
+        return value
+    elif code == DECIMAL:
+        return decimal.Decimal(str(data, "ascii"))
+    raise ValueError("Unknown type code: {}".format(code))
+
+def encode(value):
+    "Returns the value as bytes: one byte type code followed by data"
+    code, data = encode_value(value)
+    return bytes((code,)) + bytes(data)
+
+def decode(data, offset=0):
+    "Returns the value encoded by :func:`encode` at given offset"
+    return decode_value(data[offset], memoryview(data)[offset + 1:])
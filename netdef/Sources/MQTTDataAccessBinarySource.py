@@ -0,0 +1,38 @@
+import logging
+import struct
+from netdef.Sources import Sources
+from netdef.Sources.MQTTDataAccessSource import MQTTDataAccessSource
+from netdef.Shared import codec
+
+log = logging.getLogger(__name__)
+
+log.debug("Loading module")
+
+# versjon og tidsstempel. deretter verdien med typekode, se netdef.Shared.codec
+PAYLOAD_VERSION = 1
+PAYLOAD_HEADER = struct.Struct("<Bd")
+
+@Sources.register("MQTTDataAccessBinarySource")
+class MQTTDataAccessBinarySource(MQTTDataAccessSource):
+    """
+    Same as :class:`netdef.Sources.MQTTDataAccessSource.MQTTDataAccessSource`
+    but with a compact binary payload. The payload is a version byte, the
+    source time as a double, a type code byte and the value. The key is
+    given by the topic.
+    """
+    @staticmethod
+    def make_message(topic, payload):
+        header = PAYLOAD_HEADER.pack(PAYLOAD_VERSION, payload["source_time"])
+        return topic, header + codec.encode(payload["value"])
+
+    @staticmethod
+    def parse_message(topic, payload):
+        version, source_time = PAYLOAD_HEADER.unpack_from(payload)
+        if version != PAYLOAD_VERSION:
+            raise ValueError("Unknown payload version: {}".format(version))
+        payload = {
+            "value": codec.decode(payload, PAYLOAD_HEADER.size),
+            "source_time": source_time,
+            "key": topic
+        }
+        return topic, payload
@@ -44,6 +44,7 @@ def entrypoint(run_callback, template_config_callback):
     global_parser.add_argument('-ga', '--generate-auth', action='store_true', help='generate webadmin authentication')
     global_parser.add_argument('-gc', '--generate-certificate', action='store_true', help='generate ssl certificate')
     global_parser.add_argument('-r', '--run', action='store_true', help='start application')
+    global_parser.add_argument('-cr', '--compile-rules', action='store_true', help='parse rule files and save snapshot')
     args = global_parser.parse_args()
 
     proj_path = args.proj_path.expanduser().absolute()
@@ -57,10 +58,24 @@ def entrypoint(run_callback, template_config_callback):
         generate_certificate()
     elif args.run:
         run_callback()
+    elif args.compile_rules:
+        compile_rules(run_callback)
     else:
         print("Proj path: {}".format(proj_path))
         print("use argument -r, --run to start application")
 
+def compile_rules(run_callback):
+    """
+    Start application in compile mode. The rules will parse their
+    rule files and save a snapshot. The application exits when all
+    rules have been set up. See :class:`netdef.Rules.snapshot.RuleSnapshot`
+
+    :param run_callback: a function that will start your application
+    """
+    from .Rules.snapshot import RuleSnapshot
+    RuleSnapshot.compile_only = True
+    run_callback()
+
 def create_project(proj_path, template_config_callback):
     """
     Create project structure in given folder. Add content from
@@ -3,6 +3,7 @@ import queue
 import datetime
 from unittest.mock import Mock
 from netdef.Controllers import BaseController
+from netdef.Shared.SharedConfig import Config
 from netdef.Shared.SharedQueues import MessageType
 from netdef.Sources.BaseSource import BaseSource, StatusCode
 
@@ -125,3 +126,123 @@ def test_loop_incoming():
     assert hdl_add_source[1].value == 234
     assert hdl_write_source[1][0].value == 345
     assert hdl_add_parser[1].value == 456
+
+def test_remove_source():
+    incoming = Mock()
+    incoming.get.side_effect = [
+        (MessageType.ADD_SOURCE, BaseSource("src1")),
+        (MessageType.REMOVE_SOURCE, BaseSource("src1")),
+        queue.Empty()
+    ]
+    shared = Mock()
+    shared.queues.get_messages_to_controller.return_value = incoming
+    shared.queues.MessageType = MessageType
+
+    interrupt = Mock()
+    interrupt.is_set.return_value = False
+
+    class Ctr(BaseController.BaseController):
+        def handle_add_source(self, incoming):
+            self.add_source(incoming.key, incoming)
+            assert self.has_source("src1")
+
+    ctr = Ctr("Ctrl", shared)
+    ctr.add_interrupt(interrupt)
+    ctr.loop_incoming()
+
+    assert not ctr.has_source("src1")
+
+def test_scheduled_loop_outgoing():
+    shared = Mock()
+    shared.queues.MessageType = MessageType
+    shared.config.config.side_effect = lambda section, key, default=None, *args: {
+        "scan_interval": 60.0
+    }.get(key, default)
+    shared.config.get_dict.return_value = {"src2": "0"}
+
+    ctr = BaseController.BaseController("test", shared)
+    ctr.add_source("src1", BaseSource(key="src1"))
+    ctr.add_source("src2", BaseSource(key="src2"))
+    polled = []
+    ctr.poll_outgoing_item = lambda item: polled.append(item.key)
+
+    ctr.loop_outgoing()
+    assert sorted(polled) == ["src1", "src2"]
+    # src1 is polled every minute, src2 as fast as possible
+    ctr.loop_outgoing()
+    assert sorted(polled) == ["src1", "src2", "src2"]
+    # src2 is due at once, but the controller thread does not spin
+    assert ctr.queue_timeout == ctr.min_queue_timeout > 0
+
+def test_send_outgoing_batch():
+    shared = Mock()
+    shared.queues.MessageType = MessageType
+    ctr = BaseController.BaseController("test", shared)
+
+    ctr.send_outgoing_batch([
+        BaseSource(key="src1", rule="r1"),
+        BaseSource(key="src2", rule="r2"),
+        BaseSource(key="src3", rule="r1"),
+    ])
+    calls = [c[0] for c in shared.queues.send_message_to_rule.call_args_list]
+    assert len(calls) == 2
+    msg_t, rule, items = calls[0]
+    assert msg_t == MessageType.RUN_EXPRESSION_BATCH
+    assert rule == "r1"
+    assert [item.key for item in items] == ["src1", "src3"]
+    msg_t, rule, item = calls[1]
+    assert msg_t == MessageType.RUN_EXPRESSION
+    assert item.key == "src2"
+
+def test_coalesce_writes():
+    shared = Mock()
+    shared.queues.MessageType = MessageType
+    incoming = queue.Queue()
+    shared.queues.get_messages_to_controller.return_value = incoming
+
+    interrupt = Mock()
+    interrupt.is_set.return_value = False
+
+    class WriteController(BaseController.BaseController):
+        coalesce_writes = True
+        def handle_write_sources(self, writes):
+            batches.append([(item.key, value) for item, value, source_time in writes])
+        def handle_add_source(self, incoming):
+            batches.append(incoming.key)
+
+    batches = []
+    ctr = WriteController("test", shared)
+    ctr.add_interrupt(interrupt)
+    src1, src2, src3 = BaseSource(key="src1"), BaseSource(key="src2"), BaseSource(key="src3")
+
+    incoming.put((MessageType.WRITE_SOURCE, (src1, 1, None)))
+    incoming.put((MessageType.WRITE_SOURCE, (src2, 2, None)))
+    incoming.put((MessageType.WRITE_SOURCE, (src1, 3, None)))
+    incoming.put((MessageType.ADD_SOURCE, src3))
+    incoming.put((MessageType.WRITE_SOURCE, (src3, 4, None)))
+    ctr.loop_incoming()
+
+    assert batches == [[("src2", 2), ("src1", 3)], "src3", [("src3", 4)]]
+
+    # every value is written if coalesce_latest_only is False
+    batches = []
+    ctr.coalesce_latest_only = False
+    incoming.put((MessageType.WRITE_SOURCE, (src1, 1, None)))
+    incoming.put((MessageType.WRITE_SOURCE, (src2, 2, None)))
+    incoming.put((MessageType.WRITE_SOURCE, (src1, 3, None)))
+    ctr.loop_incoming()
+
+    assert batches == [[("src1", 1), ("src2", 2), ("src1", 3)]]
+
+def test_poll_scheduler_does_not_change_config():
+    shared = Mock()
+    shared.queues.MessageType = MessageType
+    shared.config = Config("test", "..", "./tests/shared/sharedconfig", """
+    [general]
+    identifier = test
+    version = 1
+    """)
+    ctr = BaseController.BaseController("test", shared)
+    assert not ctr.get_poll_scheduler()
+    assert not shared.config.has_section("test")
+    assert not shared.config.has_section("test_scan_intervals")
@@ -0,0 +1,18 @@
+from netdef.Controllers.modbus.backoff import Backoff
+
+def test_backoff():
+    backoff = Backoff(minimum=1.0, maximum=5.0)
+    assert backoff.is_ready(now=0.0)
+
+    assert backoff.failed(now=0.0) == 1.0
+    assert not backoff.is_ready(now=0.5)
+    assert backoff.is_ready(now=1.0)
+
+    assert backoff.failed(now=1.0) == 2.0
+    assert backoff.failed(now=3.0) == 4.0
+    assert backoff.failed(now=7.0) == 5.0
+    assert not backoff.is_ready(now=11.0)
+
+    backoff.succeeded()
+    assert backoff.is_ready(now=11.0)
+    assert backoff.failed(now=11.0) == 1.0
@@ -0,0 +1,27 @@
+from netdef.Controllers.modbus.planner import plan_reads, plan_writes, MAX_REGISTERS
+
+def test_contiguous_blocks():
+    items = [(1, address, "a{}".format(address)) for address in (5, 3, 4, 10)]
+    items.append((2, 3, "b3"))
+    blocks = plan_reads(items)
+    assert [(b.unit, b.start, b.count) for b in blocks] == [(1, 3, 3), (1, 10, 1), (2, 3, 1)]
+    registers = [30, 40, 50]
+    assert blocks[0].get_values(registers) == [("a3", 30), ("a4", 40), ("a5", 50)]
+
+def test_gap_tolerance():
+    items = [(1, 0, "a0"), (1, 4, "a4"), (1, 10, "a10")]
+    blocks = plan_reads(items, gap=3)
+    assert [(b.start, b.count) for b in blocks] == [(0, 5), (10, 1)]
+    blocks = plan_reads(items, gap=5)
+    assert [(b.start, b.count) for b in blocks] == [(0, 11)]
+    assert blocks[0].get_values(list(range(11))) == [("a0", 0), ("a4", 4), ("a10", 10)]
+
+def test_max_registers():
+    items = [(1, address, address) for address in range(300)]
+    blocks = plan_reads(items)
+    assert [(b.start, b.count) for b in blocks] == [(0, 125), (125, 125), (250, 50)]
+    assert all(b.count <= MAX_REGISTERS for b in plan_reads(items, gap=10, max_count=100))
+
+def test_plan_writes():
+    items = [(1, 11, "b"), (1, 10, "a"), (1, 13, "d"), (2, 12, "c")]
+    assert plan_writes(items) == [(1, 10, ["a", "b"]), (1, 13, ["d"]), (2, 12, ["c"])]
@@ -0,0 +1,38 @@
+from netdef.Controllers.mqtt.topictrie import TopicTrie
+
+def test_match():
+    trie = TopicTrie()
+    trie.add("DA/a/b", 1)
+    trie.add("DA/+/b", 2)
+    trie.add("DA/#", 3)
+    trie.add("DA/a/#", 4)
+    trie.add("#", 5)
+    trie.add("+/+", 6)
+    assert len(trie) == 6
+
+    assert sorted(trie.match("DA/a/b")) == [1, 2, 3, 4, 5]
+    assert sorted(trie.match("DA/c/b")) == [2, 3, 5]
+    assert sorted(trie.match("DA/a")) == [3, 4, 5, 6]
+    assert sorted(trie.match("DA")) == [3, 5]
+    assert trie.match("$SYS/a") == []
+
+def test_remove():
+    trie = TopicTrie()
+    trie.add("a/b", 1)
+    trie.add("a/b", 2)
+    trie.add("a/+", 3)
+    assert trie.remove("a/b", 1)
+    assert not trie.remove("a/b", 1)
+    assert not trie.remove("a/c", 2)
+    assert sorted(trie.match("a/b")) == [2, 3]
+    trie.remove("a/b", 2)
+    trie.remove("a/+", 3)
+    assert trie.root == {}
+    assert len(trie) == 0
+
+def test_many_sources():
+    trie = TopicTrie()
+    for i in range(10000):
+        trie.add("DA/plant/{}/temp".format(i), i)
+    assert trie.match("DA/plant/1234/temp") == [1234]
+    assert trie.match("DA/plant/1234") == []
@@ -0,0 +1,135 @@
+import time
+import socket
+from unittest.mock import Mock
+import pytest
+
+opcua = pytest.importorskip("opcua")
+
+from netdef.Shared.SharedConfig import Config
+from netdef.Shared.SharedQueues import MessageType
+from netdef.Shared.Internal import Statistics
+from netdef.Sources.BaseSource import StatusCode
+from netdef.Sources.OpcUaVariantSource import OpcUaVariantSource
+from netdef.Controllers.OPCUAClientController import OPCUAClientController, SubHandler
+
+PROJ = "./tests/shared/sharedconfig"
+KEYS = ["ns=2;s=v{}".format(i) for i in range(5)]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture(scope="module")
+def server():
+    server = opcua.Server()
+    endpoint = "opc.tcp://127.0.0.1:{}/".format(free_port())
+    server.set_endpoint(endpoint)
+    objects = server.get_objects_node()
+    for i, key in enumerate(KEYS):
+        var = objects.add_variable(key, "v{}".format(i), i * 10)
+        var.set_writable()
+    server.start()
+    yield server, endpoint
+    server.stop()
+
+@pytest.fixture
+def controller(server):
+    server, endpoint = server
+    for i, key in enumerate(KEYS):
+        server.get_node(key).set_value(i * 10)
+    shared = Mock()
+    shared.queues.MessageType = MessageType
+    shared.config = Config("test", "..", PROJ, """
+    [general]
+    identifier = test
+    version = 1
+
+    [OPCUAClientController]
+    endpoint = {}
+    max_nodes_per_read = 2
+    max_nodes_per_write = 2
+    subscription_size = 3
+    subscribe_batch_size = 2
+    subscription_interval = 20
+    """.format(endpoint))
+    ctr = OPCUAClientController("OPCUAClientController", shared)
+    ctr.client.connect()
+    ctr.connect_time = time.time()
+    ctr.subscription_handler = SubHandler(ctr)
+    yield ctr
+    ctr.safe_disconnect()
+
+def add_sources(ctr, keys):
+    for key in keys:
+        ctr.handle_add_source(OpcUaVariantSource(key=key, rule="R"))
+
+def test_read_added_sources(controller):
+    # sources arrive by ADD_SOURCE after connect
+    Statistics.set("OPCUAClientController.full_state.time", None)
+    read = Mock(wraps=controller.client.uaclient.read)
+    controller.client.uaclient.read = read
+    add_sources(controller, KEYS)
+    controller.subscribe_pending()
+
+    # 5 nodes are read with max 2 nodes per Read call
+    assert read.call_count == 3
+    assert [controller.get_source(key).get for key in KEYS] == [0, 10, 20, 30, 40]
+    assert all(controller.get_source(key).status_code == StatusCode.INITIAL for key in KEYS)
+    assert Statistics.get("OPCUAClientController.full_state.time") is not None
+    assert controller.connect_time is None
+
+def test_batched_writes(controller, server):
+    server, endpoint = server
+    add_sources(controller, KEYS)
+    write = Mock(wraps=controller.client.uaclient.write)
+    controller.client.uaclient.write = write
+    controller.handle_write_sources([
+        (controller.get_source(key), i + 100, None) for i, key in enumerate(KEYS)
+    ])
+    # 5 nodes are written with max 2 nodes per Write call
+    assert [len(call[0][0].NodesToWrite) for call in write.call_args_list] == [2, 2, 1]
+    assert [server.get_node(key).get_value() for key in KEYS] == [100, 101, 102, 103, 104]
+
+    # nodes and variant types are cached
+    node = controller.get_node(KEYS[0])
+    controller.handle_write_sources([(controller.get_source(KEYS[0]), 5, None)])
+    assert controller.get_node(KEYS[0]) is node
+    assert controller.variant_types[KEYS[0]] == opcua.ua.VariantType.Int64
+    assert server.get_node(KEYS[0]).get_value() == 5
+
+def test_sharded_subscriptions(controller, server):
+    server, endpoint = server
+    create = Mock(wraps=controller.client.uaclient.create_monitored_items)
+    controller.client.uaclient.create_monitored_items = create
+    add_sources(controller, KEYS)
+    controller.subscribe_pending()
+
+    # max 3 monitored items per subscription and max 2 per request
+    assert [len(call[0][0].ItemsToCreate) for call in create.call_args_list] == [2, 1, 2]
+    assert [count for subscription, count in controller.subscriptions] == [3, 2]
+    assert len(controller.subscription_handles) == 5
+
+    # data changes are routed to the sources
+    server.get_node(KEYS[4]).set_value(44)
+    end = time.time() + 5
+    while controller.get_source(KEYS[4]).get != 44 and time.time() < end:
+        time.sleep(0.01)
+    assert controller.get_source(KEYS[4]).get == 44
+
+    # a removed source frees a place in its subscription
+    controller.handle_remove_source(controller.get_source(KEYS[0]))
+    assert [count for subscription, count in controller.subscriptions] == [2, 2]
+    assert not controller.has_source(KEYS[0])
+
+def test_read_initial_values(controller):
+    keys = KEYS[:3] + ["ns=2;s=unknown"]
+    for key in keys:
+        controller.add_source(key, OpcUaVariantSource(key=key, rule="R"))
+    controller.read_initial_values(keys)
+
+    assert [controller.get_source(key).get for key in KEYS[:3]] == [0, 10, 20]
+    assert controller.get_source("ns=2;s=unknown").status_code != StatusCode.GOOD
+    sent = controller.shared.queues.send_message_to_rule.call_args_list
+    # one RUN_EXPRESSION_BATCH per Read call of max 2 nodes
+    assert [call[0][0] for call in sent] == [MessageType.RUN_EXPRESSION_BATCH, MessageType.RUN_EXPRESSION]
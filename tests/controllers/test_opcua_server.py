@@ -0,0 +1,142 @@
+import time
+import socket
+from unittest.mock import Mock
+import pytest
+
+opcua = pytest.importorskip("opcua")
+
+from netdef.Shared.SharedConfig import Config
+from netdef.Shared.SharedQueues import MessageType
+from netdef.Sources.OpcUaVariantSource import OpcUaVariantSource
+from netdef.Controllers.OPCUAServerController import OPCUAServerController, SubHandler
+from netdef.Controllers.ua.subscription import create_subscription
+
+PROJ = "./tests/shared/sharedconfig"
+KEYS = ["ns=2;s=Area1.Line{}.Pump{}".format(i % 2, i) for i in range(4)]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def controller():
+    shared = Mock()
+    shared.queues.MessageType = MessageType
+    shared.config = Config("test", "..", PROJ, """
+    [general]
+    identifier = test
+    version = 1
+
+    [OPCUAServerController]
+    endpoint = opc.tcp://127.0.0.1:{}/
+    anonymous_on = 1
+    username_on = 0
+    folders_on = 1
+    echo_suppression_on = 1
+    echo_timeout = 5
+    """.format(free_port()))
+    ctr = OPCUAServerController("OPCUAServerController", shared)
+    ctr.server.start()
+    # same internal subscription as run()
+    ctr.subscription = create_subscription(
+        ctr.server.iserver.isession, 100, SubHandler(ctr),
+        lifetime_count=3000, max_keepalive_count=10000, max_notifications=0
+    )
+    yield ctr
+    ctr.server.stop()
+
+def add_sources(ctr, keys):
+    sources = []
+    for key in keys:
+        source = OpcUaVariantSource(key=key, rule="R")
+        source.value = 0
+        ctr.handle_add_source(source)
+        sources.append(source)
+    return sources
+
+def test_add_pending_nodes(controller):
+    add_nodes = Mock(wraps=controller.server.iserver.isession.add_nodes)
+    controller.server.iserver.isession.add_nodes = add_nodes
+    add_sources(controller, KEYS)
+
+    # nothing is added before the pending nodes are flushed
+    assert not controller.has_source(KEYS[0])
+    controller.add_pending_nodes()
+
+    # every variable node is added with one call, folders one by one
+    sizes = sorted(len(call[0][0]) for call in add_nodes.call_args_list)
+    assert sizes == [1, 1, 1, len(KEYS)]
+    assert all(controller.has_source(key) for key in KEYS)
+    assert len(controller.subscription_handles) == len(KEYS)
+
+    # the identifier is split into folders
+    assert set(controller.folders) == {("Area1",), ("Area1", "Line0"), ("Area1", "Line1")}
+    folder = controller.folders[("Area1", "Line1")]
+    names = sorted(node.get_browse_name().Name for node in folder.get_children())
+    assert names == ["Pump1", "Pump3"]
+
+def test_add_pending_nodes_twice(controller):
+    add_sources(controller, KEYS[:2])
+    controller.add_pending_nodes()
+    add_sources(controller, KEYS)
+    controller.add_pending_nodes()
+
+    # existing sources and folders are reused
+    assert all(controller.has_source(key) for key in KEYS)
+    assert len(controller.get_sources()) == len(KEYS)
+    assert len(controller.folders) == 3
+
+def wait_for(check, timeout=5):
+    end = time.time() + timeout
+    while not check() and time.time() < end:
+        time.sleep(0.05)
+    return check()
+
+def test_echo_suppression(controller):
+    source, = add_sources(controller, KEYS[:1])
+    controller.add_pending_nodes()
+    controller.send_outgoing_batch = Mock()
+    # the initial value of the new node is not an echo
+    assert wait_for(lambda: controller.send_outgoing_batch.called)
+    controller.send_outgoing_batch.reset_mock()
+
+    # the data change from the server is the echo of our own write
+    controller.handle_write_sources([(source, 5, None)])
+    assert source.key in controller._echo_values
+    assert wait_for(lambda: source.key not in controller._echo_values)
+    assert source.get == 5
+    controller.send_outgoing_batch.assert_not_called()
+
+    # a value written by a client is not an echo
+    controller.send_datachanges([(source, 7, None, True, 0)])
+    controller.send_outgoing_batch.assert_called_once_with([source])
+
+def test_echo_after_older_value(controller):
+    source, = add_sources(controller, KEYS[:1])
+    controller.add_pending_nodes()
+    controller.send_outgoing_batch = Mock()
+
+    # a data change queued before the write must not consume the echo
+    controller._echo_values[source.key] = (5, time.time())
+    controller.send_datachanges([(source, 0, None, True, 0), (source, 5, None, True, 0)])
+    controller.send_outgoing_batch.assert_called_once_with([source])
+    assert source.get == 5
+    assert source.key not in controller._echo_values
+
+def test_echo_expiry(controller):
+    source, = add_sources(controller, KEYS[:1])
+    controller.add_pending_nodes()
+    controller.send_outgoing_batch = Mock()
+
+    # the echo never arrived within echo_timeout. same value is a new value
+    controller._echo_values[source.key] = (5, time.time() - controller.echo_timeout - 1)
+    controller.send_datachanges([(source, 5, None, True, 0)])
+    controller.send_outgoing_batch.assert_called_once_with([source])
+    assert source.key not in controller._echo_values
+
+    # within echo_timeout the same value is suppressed
+    controller.send_outgoing_batch.reset_mock()
+    controller._echo_values[source.key] = (6, time.time())
+    controller.send_datachanges([(source, 6, None, True, 0)])
+    controller.send_outgoing_batch.assert_not_called()
@@ -0,0 +1,145 @@
+import json
+import time
+import queue
+import threading
+from unittest.mock import Mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from netdef.Shared.SharedConfig import Config
+from netdef.Shared.SharedQueues import MessageType
+from netdef.Sources.BaseSource import BaseSource
+from netdef.Controllers.RESTJsonController import RESTJsonController
+
+PROJ = "./tests/shared/sharedconfig"
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    etag = '"1"'
+    posted = []
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        Handler.posted.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+        self.reply(b"{}")
+
+    def do_GET(self):
+        if self.path.startswith("/values/"):
+            key = self.path[len("/values/"):]
+            self.reply(json.dumps({"key": key, "value": len(key)}).encode("utf-8"))
+            return
+        if self.headers.get("If-None-Match") == Handler.etag:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"key": "a", "value": Handler.etag}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("ETag", Handler.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def controller():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    shared = Mock()
+    shared.queues.MessageType = MessageType
+    shared.config = Config("test", "..", PROJ, """
+    [general]
+    identifier = test
+    version = 1
+
+    [RESTJsonController]
+    poll_url = http://127.0.0.1:{0}/poll
+    get_url = http://127.0.0.1:{0}/values/{{}}
+    post_url = http://127.0.0.1:{0}/post
+    poll_interval = 10
+    max_concurrent_reads = 3
+    batch_post_on = 1
+    """.format(httpd.server_address[1]))
+    yield RESTJsonController("RESTJsonController", shared)
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_conditional_poll(controller):
+    Handler.etag = '"1"'
+    assert controller._poll() == {"key": "a", "value": '"1"'}
+    assert controller.poll_etag == '"1"'
+    assert controller._poll() is None
+    Handler.etag = '"2"'
+    assert controller._poll() == {"key": "a", "value": '"2"'}
+    assert controller.http.reuse_count == 2
+
+def test_poll_deadline(controller):
+    controller._poll = Mock(return_value=None)
+    controller.next_poll = time.time() + 10
+    assert controller.get_queue_timeout() == controller.queue_timeout
+    controller.loop_outgoing()
+    assert controller._poll.call_count == 0
+
+    controller.next_poll = time.time() - 1
+    assert controller.get_queue_timeout() == 0.0
+    controller.loop_outgoing()
+    assert controller._poll.call_count == 1
+    # next poll is one interval after the previous deadline
+    assert time.time() + 8 < controller.next_poll < time.time() + 9.5
+
+class Parser(BaseSource):
+    @staticmethod
+    def can_unpack_value(value):
+        return isinstance(value, dict) and "key" in value
+
+    @staticmethod
+    def unpack_value(value):
+        return value["key"], None, value["value"]
+
+    def pack_value(self, value):
+        return {"key": self.key, "value": value}
+
+def test_read_keys(controller):
+    controller.add_parser(Parser)
+    keys = ["k{}".format("x" * i) for i in range(10)]
+    for key in keys:
+        controller.add_source(key, Parser(key=key, rule="R"))
+    controller.read_keys(keys)
+    sent = controller.shared.queues.send_message_to_rule.call_args_list
+    assert [call[0][2].key for call in sent] == keys
+    assert [call[0][2].get for call in sent] == [len(key) for key in keys]
+    controller.read_executor.shutdown()
+
+def test_batch_post(controller):
+    Handler.posted = []
+    assert controller.coalesce_writes
+    src1, src2 = Parser(key="a"), Parser(key="b")
+    controller.handle_write_sources([(src1, 1, None), (src2, 2, None)])
+    controller.handle_write_sources([(src1, 3, None)])
+    assert Handler.posted == [
+        [{"key": "a", "value": 1}, {"key": "b", "value": 2}],
+        {"key": "a", "value": 3}
+    ]
+
+def test_disabled_queue_timeout(controller):
+    controller.disable = 1
+    controller.next_poll = time.time() - 1
+    assert controller.get_queue_timeout() == controller.queue_timeout
+
+def test_batch_post_keeps_every_value(controller):
+    Handler.posted = []
+    controller.incoming = queue.Queue()
+    controller.add_interrupt(threading.Event())
+    src1, src2 = Parser(key="a"), Parser(key="b")
+    for item in [(src1, 1, None), (src2, 2, None), (src1, 3, None)]:
+        controller.incoming.put((MessageType.WRITE_SOURCE, item))
+    controller.loop_incoming()
+    assert Handler.posted == [
+        [{"key": "a", "value": 1}, {"key": "b", "value": 2}, {"key": "a", "value": 3}]
+    ]
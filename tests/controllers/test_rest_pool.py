@@ -0,0 +1,90 @@
+import gzip
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from netdef.Controllers.rest.pool import HTTPConnectionPool
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        Handler.connections += 1
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body):
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/missing":
+            self.send_error(404)
+        else:
+            self.reply(json.dumps({"path": self.path}).encode("utf-8"))
+
+    def do_POST(self):
+        self.reply(self.rfile.read(int(self.headers["Content-Length"])))
+
+@pytest.fixture
+def server():
+    Handler.connections = 0
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_reuse(server):
+    pool = HTTPConnectionPool()
+    for i in range(5):
+        with pool.urlopen(server + "/poll?i={}".format(i)) as f:
+            assert json.loads(f.read().decode("utf-8")) == {"path": "/poll?i={}".format(i)}
+
+    request = urllib.request.Request(
+        server + "/post", data=b'{"a": 1}', headers={"Content-Type": "application/json"}
+    )
+    with pool.urlopen(request) as f:
+        assert f.read() == b'{"a": 1}'
+
+    assert pool.request_count == 6
+    assert pool.reuse_count == 5
+    assert Handler.connections == 1
+
+    with pytest.raises(urllib.error.HTTPError):
+        pool.urlopen(server + "/missing")
+    pool.close()
+
+def test_gzip(server):
+    pool = HTTPConnectionPool(gzip=True)
+    with pool.urlopen(server + "/a") as f:
+        assert f.getheader("Content-Encoding") == "gzip"
+        assert f.read() == b'{"path": "/a"}'
+    with pool.urlopen(server + "/b") as f:
+        data = b"".join(iter(lambda: f.read(4), b""))
+        assert data == b'{"path": "/b"}'
+    assert pool.reuse_count == 1
+    pool.close()
+
+def test_unread_response_is_not_reused(server):
+    pool = HTTPConnectionPool()
+    with pool.urlopen(server + "/a") as f:
+        pass
+    with pool.urlopen(server + "/b") as f:
+        f.read()
+    assert pool.reuse_count == 0
+    assert Handler.connections == 2
+    pool.close()
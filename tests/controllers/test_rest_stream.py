@@ -0,0 +1,46 @@
+import io
+import json
+import pytest
+from netdef.Controllers.rest import stream
+from netdef.Controllers.rest.stream import iter_json_items, get_backend
+
+DOCS = [
+    [{"key": "a", "value": 1.5}, {"key": "b", "value": [1, 2]}, 12345, "ø", None],
+    {"a": {"key": "a", "value": "x"}, "b": 100000, "c": {"nested": {"k": True}}},
+    [],
+    {},
+    {"key": "a", "value": 1},
+    12345,
+]
+
+def items(doc):
+    if isinstance(doc, dict):
+        return list(doc.values())
+    elif isinstance(doc, list):
+        return doc
+    return [doc]
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 65536])
+def test_python_backend(chunk_size):
+    for doc in DOCS:
+        data = json.dumps(doc, indent=1, ensure_ascii=False).encode("utf-8")
+        assert list(iter_json_items(io.BytesIO(data), "python", chunk_size)) == items(doc)
+
+def test_empty_and_invalid():
+    assert list(iter_json_items(io.BytesIO(b"  "), "python")) == []
+    with pytest.raises(ValueError):
+        list(iter_json_items(io.BytesIO(b'[1, 2 3]'), "python", 2))
+    with pytest.raises(ValueError):
+        list(iter_json_items(io.BytesIO(b'{"a": 1'), "python", 2))
+
+def test_items_are_yielded_while_reading():
+    f = io.BytesIO(b'[{"key": "a"}, {"key": "b"}, ' + b" " * 100000 + b"1]")
+    it = iter_json_items(f, "python", 64)
+    assert next(it) == {"key": "a"}
+    assert f.tell() < 100
+
+def test_get_backend():
+    assert get_backend("python") == "python"
+    assert get_backend("auto") == ("ijson" if stream.ijson else "python")
+    with pytest.raises(ValueError):
+        get_backend("simplejson")
@@ -0,0 +1,37 @@
+from netdef.Controllers.scheduler import PollScheduler
+
+def test_intervals():
+    scheduler = PollScheduler()
+    scheduler.set_jobs([("fast", 1.0, "a"), ("slow", 5.0, "b")], now=100.0)
+
+    assert scheduler.pop_due(now=100.0) == ["a", "b"]
+    assert scheduler.pop_due(now=100.5) == []
+    assert scheduler.time_to_next(now=100.5) == 0.5
+
+    polled = []
+    for i in range(1, 11):
+        polled.extend(scheduler.pop_due(now=100.0 + i))
+    assert polled.count("a") == 10
+    assert polled.count("b") == 2
+    assert scheduler.overrun_count == 0
+
+def test_overrun():
+    scheduler = PollScheduler()
+    scheduler.set_jobs([("a", 1.0, "a")], now=0.0)
+    assert scheduler.pop_due(now=0.0) == ["a"]
+    # a whole period is lost
+    assert scheduler.pop_due(now=3.5) == ["a"]
+    assert scheduler.overrun_count == 1
+    assert scheduler.pop_due(now=4.0) == []
+    assert scheduler.pop_due(now=4.5) == ["a"]
+
+def test_jitter_and_set_jobs():
+    scheduler = PollScheduler(jitter=0.5)
+    scheduler.set_jobs([("a", 2.0, "a")], now=0.0)
+    due = scheduler.jobs["a"].due
+    assert 0.0 <= due <= 1.0
+
+    # existing jobs keep their due time
+    scheduler.set_jobs([("a", 2.0, "a"), ("b", 2.0, "b")], now=0.5)
+    assert scheduler.jobs["a"].due == due
+    assert 0.5 <= scheduler.jobs["b"].due <= 1.5
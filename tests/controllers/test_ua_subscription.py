@@ -0,0 +1,63 @@
+import time
+import socket
+import pytest
+
+opcua = pytest.importorskip("opcua")
+
+from netdef.Controllers.ua.subscription import create_subscription
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class Handler():
+    def __init__(self):
+        self.changes = []
+
+    def datachange_notifications(self, subscription, items):
+        for item in items:
+            self.changes.append((subscription.sources[item.ClientHandle], item.Value.Value.Value))
+
+def wait_for(handler, count):
+    end = time.time() + 5
+    while len(handler.changes) < count and time.time() < end:
+        time.sleep(0.01)
+
+def test_batch_subscription():
+    server = opcua.Server()
+    endpoint = "opc.tcp://127.0.0.1:{}/".format(free_port())
+    server.set_endpoint(endpoint)
+    objects = server.get_objects_node()
+    variables = [objects.add_variable("ns=2;s=s{}".format(i), "s{}".format(i), i) for i in range(3)]
+    server.start()
+    client = opcua.Client(endpoint)
+    client.connect()
+    try:
+        handler = Handler()
+        subscription = create_subscription(client.uaclient, 20, handler)
+        nodes = [client.get_node(var.nodeid) for var in variables]
+        nodes.append(client.get_node("ns=2;s=unknown"))
+        handles = subscription.subscribe_sources(nodes, ["src0", "src1", "src2", "src3"])
+
+        # the unknown node gets a status code, the others a handle
+        assert isinstance(handles[3], opcua.ua.StatusCode)
+        assert sorted(subscription.sources.values()) == ["src0", "src1", "src2"]
+
+        # initial values
+        wait_for(handler, 3)
+        assert sorted(handler.changes) == [("src0", 0), ("src1", 1), ("src2", 2)]
+
+        # data changes are routed to the source of the node
+        handler.changes = []
+        variables[2].set_value(20)
+        variables[0].set_value(30)
+        wait_for(handler, 2)
+        assert sorted(handler.changes) == [("src0", 30), ("src2", 20)]
+
+        subscription.unsubscribe(handles[0])
+        assert sorted(subscription.sources.values()) == ["src1", "src2"]
+        subscription.delete()
+    finally:
+        client.disconnect()
+        server.stop()
@@ -0,0 +1,124 @@
+import time
+import threading
+from socketserver import ThreadingMixIn
+from unittest.mock import Mock
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+import pytest
+from netdef.Shared.SharedConfig import Config
+from netdef.Shared.SharedQueues import MessageType
+from netdef.Sources.XmlRpcMethodCallSource import XmlRpcMethodCallSource
+from netdef.Controllers.XmlRpcController import XmlRpcController
+
+PROJ = "./tests/shared/sharedconfig"
+
+class Handler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    requests = 0
+
+    def setup(self):
+        Handler.connections += 1
+        super().setup()
+
+    def do_POST(self):
+        Handler.requests += 1
+        super().do_POST()
+
+class Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+def fail():
+    raise ValueError("failed")
+
+def slow(key):
+    time.sleep(0.3)
+    return key
+
+@pytest.fixture
+def server():
+    Handler.connections = 0
+    Handler.requests = 0
+    server = Server(("127.0.0.1", 0), Handler, logRequests=False)
+    server.register_function(lambda *args: "".join(args), "join")
+    server.register_function(fail, "fail")
+    server.register_function(slow, "slow")
+    server.register_multicall_functions()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def get_controller(url, multicall_on, max_workers=1):
+    shared = Mock()
+    shared.queues.MessageType = MessageType
+    shared.config = Config("test", "..", PROJ, """
+    [general]
+    identifier = test
+    version = 1
+
+    [XmlRpcController]
+    endpoint_url = {}
+    timeout = 2
+    multicall_on = {}
+    multicall_size = 2
+    max_workers = {}
+    poll_interval = 1
+    """.format(url, multicall_on, max_workers))
+    controller = XmlRpcController("XmlRpcController", shared)
+    for key in ["join;a;b", "fail", "join;c"]:
+        controller.add_source(key, XmlRpcMethodCallSource(key=key, rule="R"))
+    return controller
+
+@pytest.mark.parametrize("multicall_on, requests", [(0, 3), (1, 2)])
+def test_poll(server, multicall_on, requests):
+    controller = get_controller(server, multicall_on)
+    controller.loop_outgoing()
+    sources = controller.get_sources()
+    assert sources["join;a;b"].get == "ab"
+    assert sources["fail"].get is None
+    assert sources["join;c"].get == "c"
+    assert controller.shared.queues.send_message_to_rule.call_count == 3
+    assert Handler.requests == requests
+    assert Handler.connections == 1
+
+def test_multicall_writes(server):
+    controller = get_controller(server, 1)
+    item = controller.get_source("join;a;b")
+    controller.handle_write_sources([
+        (item, ["join", "x", "y"], None),
+        (controller.get_source("fail"), ["fail"], None),
+    ])
+    assert item.get == "xy"
+    assert Handler.requests == 1
+
+def test_parallel_poll(server):
+    controller = get_controller(server, 0, max_workers=10)
+    for i in range(10):
+        key = "slow;{}".format(i)
+        controller.add_source(key, XmlRpcMethodCallSource(key=key, rule="R"))
+
+    start = time.time()
+    controller.loop_outgoing()
+    # the calls run in worker threads. the controller thread is free
+    assert controller.in_flight
+    assert controller.get_queue_timeout() == controller.min_queue_timeout
+    item = controller.get_source("join;a;b")
+    controller.handle_write_source(item, ["join", "x", "y"], None)
+    assert item.get == "xy"
+    assert time.time() - start < 0.3
+
+    # a new cycle does not start while calls are in flight
+    controller.loop_outgoing()
+    while controller.in_flight:
+        controller.loop_responses()
+        time.sleep(0.01)
+    assert time.time() - start < 1.0
+    assert controller.get_source("slow;3").get == "3"
+    assert controller.get_source("join;a;b").get == "ab"
+    assert controller.overrun_count == 0
+
+    # the sequential cycle takes 3 seconds. poll_interval is 1
+    controller.max_workers = 1
+    controller.loop_outgoing()
+    assert controller.overrun_count == 1
+    controller.executor.shutdown()
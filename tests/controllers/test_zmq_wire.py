@@ -0,0 +1,44 @@
+import datetime
+import pytest
+from netdef.Controllers.zmq import wire
+
+def test_encode_decode():
+    stime = datetime.datetime(2019, 7, 1, 12, 30, 15, 250000)
+    blob = b"\x00" * 100000
+    items = [("a", 1, stime), ("b", "tekst", None), ("c", blob, stime), ("ø", [1.5, None], stime)]
+    frames = wire.encode_message(wire.DATA, items)
+    assert len(frames) == 6
+    # bytes values are sent in their own frame without a copy
+    assert frames[4] is blob
+
+    message_type, flags, decoded = wire.decode_message(frames)
+    assert message_type == wire.DATA
+    assert flags == 0
+    assert decoded == items
+
+def test_snapshot_flags():
+    frames = wire.encode_message(wire.SNAPSHOT, [], wire.LAST_CHUNK)
+    assert wire.decode_message(frames) == (wire.SNAPSHOT, wire.LAST_CHUNK, [])
+
+def test_invalid_messages():
+    frames = wire.encode_message(wire.DATA, [("a", 1, None)])
+    with pytest.raises(ValueError):
+        wire.decode_message(frames[:2])
+    with pytest.raises(ValueError):
+        wire.decode_message([b"\x02" + frames[0][1:]] + frames[1:])
+    with pytest.raises(ValueError):
+        wire.decode_message([frames[0], frames[1][:3], frames[2]])
+    with pytest.raises(ValueError):
+        wire.decode_message([b"pickle"])
+
+def test_aware_time():
+    stime = datetime.datetime(2019, 7, 1, 14, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    assert wire.decode_time(wire.encode_time(stime)) == datetime.datetime(2019, 7, 1, 12, 0)
+
+def test_skip_unsupported_values():
+    with pytest.raises(TypeError):
+        wire.encode_message(wire.DATA, [("a", {1}, None)])
+    errors = []
+    frames = wire.encode_message(wire.DATA, [("a", {1}, None), ("b", 2, None)], errors=errors)
+    assert [key for key, error in errors] == ["a"]
+    assert wire.decode_message(frames)[2] == [("b", 2, None)]
@@ -0,0 +1,20 @@
+from unittest.mock import Mock
+import pytest
+from netdef.Engines.ThreadedEngine import ThreadedEngine
+
+def test_rule_setup_error_stops_engine():
+    shared = Mock()
+    shared.config.config.side_effect = lambda section, key, default=None, *args: default
+    rule = Mock()
+    rule.setup.side_effect = ValueError("broken rule file")
+
+    engine = ThreadedEngine(shared)
+    engine.add_controller_classes(Mock(instances={}))
+    engine.add_rule_classes(Mock(instances={"Rule": rule}))
+    engine.start_expression_executor = Mock()
+
+    with pytest.raises(ValueError):
+        engine.start()
+    # controllers are started before rules are set up and must be stopped
+    assert engine.start_expression_executor.called
+    assert engine._interrupt.is_set()
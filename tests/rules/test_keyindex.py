@@ -0,0 +1,91 @@
+from netdef.Shared import Shared
+from netdef.Shared.SharedQueues import MessageType
+from netdef.Controllers import Controllers
+from netdef.Sources import Sources
+from netdef.Rules import Rules
+from netdef.Rules.keyindex import KeyIndex
+
+CONFIG = """
+[general]
+identifier = test
+version = 1
+
+[controllers]
+InternalController = 1
+
+[sources]
+InternalSource = 1
+
+[InternalSource]
+controller = InternalController
+
+[controller_aliases]
+[source_aliases]
+
+[rules]
+CSVRule = 1
+
+[CSVRule]
+pattern_test = 1
+
+[pattern_test]
+csv = config/pattern_test.csv
+py = config/pattern_test.py
+
+[key_index]
+InternalController = config/keys.txt
+
+[hot_reload]
+on = 1
+interval = 0
+"""
+
+KEYS = ["Pump1.Speed", "Pump2.Speed", "Pump10.Speed", "Pump1.Status", "Valve1.Speed"]
+
+def test_match():
+    index = KeyIndex(KEYS)
+    assert len(index) == 5
+    assert index.keys_with_prefix("Valve") == ["Valve1.Speed"]
+    assert index.match("glob:Pump*.Speed") == ["Pump1.Speed", "Pump10.Speed", "Pump2.Speed"]
+    assert index.match("re:Pump\\d\\.Speed") == ["Pump1.Speed", "Pump2.Speed"]
+    assert index.match("re:Pump1\\..*|Valve.*") == ["Pump1.Speed", "Pump1.Status", "Valve1.Speed"]
+    assert index.match("glob:Motor*") == []
+
+def get_added(shared):
+    incoming = shared.queues.get_messages_to_controller("InternalController")
+    keys = []
+    while not incoming.empty():
+        messagetype, item = incoming.get_nowait()
+        if messagetype == MessageType.ADD_SOURCE:
+            keys.append(item.key)
+    return keys
+
+def test_expand_expression(tmp_path):
+    config_path = tmp_path.joinpath("config")
+    config_path.mkdir()
+    config_path.joinpath("default.conf").write_text(CONFIG)
+    config_path.joinpath("pattern_test.py").write_text("def expression(a, b):\n    pass\n")
+    config_path.joinpath("pattern_test.csv").write_text(
+        "InternalSource;InternalSource\nglob:Pump*.Speed;speed_alarm\n")
+    keys_file = config_path.joinpath("keys.txt")
+    keys_file.write_text("# keys\n" + "\n".join(KEYS) + "\n")
+
+    shared = Shared.Shared("test", "", str(tmp_path), "")
+    Controllers.Controllers(shared).load("netdef")
+    sources = Sources.Sources(shared)
+    sources.load("netdef")
+    rules = Rules.Rules(shared)
+    rules.load("netdef")
+    sources.init()
+    rules.init()
+    rule = rules.instances["CSVRule"]
+    rule.setup()
+
+    assert get_added(shared) == ["Pump1.Speed", "speed_alarm", "Pump10.Speed", "Pump2.Speed"]
+    assert len(rule._live_expressions["pattern_test"]) == 3
+
+    # a new key is added to the key file
+    keys_file.write_text("\n".join(KEYS + ["Pump3.Speed"]) + "\n")
+    rule.loop_reload()
+    assert get_added(shared) == ["Pump3.Speed"]
+    assert len(rule._live_expressions["pattern_test"]) == 4
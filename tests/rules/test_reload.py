@@ -0,0 +1,164 @@
+from netdef.Shared import Shared
+from netdef.Shared.SharedQueues import MessageType
+from netdef.Controllers import Controllers
+from netdef.Sources import Sources
+from netdef.Rules import Rules
+
+CONFIG = """
+[general]
+identifier = test
+version = 1
+
+[controllers]
+InternalController = 1
+
+[sources]
+InternalSource = 1
+
+[InternalSource]
+controller = InternalController
+
+[controller_aliases]
+[source_aliases]
+
+[rules]
+CSVRule = 1
+
+[CSVRule]
+reload_test = 1
+
+[reload_test]
+csv = config/reload_test.csv
+py = config/reload_test.py
+
+[hot_reload]
+on = 1
+interval = 0
+"""
+
+def setup_project(tmp_path):
+    config_path = tmp_path.joinpath("config")
+    config_path.mkdir()
+    config_path.joinpath("default.conf").write_text(CONFIG)
+    config_path.joinpath("reload_test.py").write_text("def expression(a, b):\n    pass\n")
+    csv_file = config_path.joinpath("reload_test.csv")
+    csv_file.write_text("InternalSource;InternalSource\nreload_a;reload_b\nreload_a;reload_c\n")
+
+    shared = Shared.Shared("test", "", str(tmp_path), "")
+    controllers = Controllers.Controllers(shared)
+    controllers.load("netdef")
+    sources = Sources.Sources(shared)
+    sources.load("netdef")
+    rules = Rules.Rules(shared)
+    rules.load("netdef")
+    sources.init()
+    rules.init()
+    return shared, rules.instances["CSVRule"], csv_file
+
+def get_messages(shared):
+    incoming = shared.queues.get_messages_to_controller("InternalController")
+    messages = []
+    while not incoming.empty():
+        messagetype, item = incoming.get_nowait()
+        if messagetype in (MessageType.ADD_SOURCE, MessageType.REMOVE_SOURCE):
+            messages.append((messagetype, item.key))
+    return messages
+
+def test_reload_entry(tmp_path):
+    shared, rule, csv_file = setup_project(tmp_path)
+    rule.setup()
+
+    assert get_messages(shared) == [
+        (MessageType.ADD_SOURCE, "reload_a"),
+        (MessageType.ADD_SOURCE, "reload_b"),
+        (MessageType.ADD_SOURCE, "reload_c"),
+    ]
+    assert len(rule._live_expressions["reload_test"]) == 2
+
+    # nothing changed
+    rule.loop_reload()
+    assert get_messages(shared) == []
+
+    # remove reload_c and add reload_d
+    csv_file.write_text("InternalSource;InternalSource\nreload_a;reload_b\nreload_a;reload_d\n")
+    rule.loop_reload()
+
+    assert get_messages(shared) == [
+        (MessageType.ADD_SOURCE, "reload_d"),
+        (MessageType.REMOVE_SOURCE, "reload_c"),
+    ]
+    live = [expr for key, expr in rule._live_expressions["reload_test"]]
+    assert len(live) == 2
+    assert [arg.key for arg in live[1].args] == ["reload_a", "reload_d"]
+
+    expressions = shared.expressions.instances
+    assert all(expr in expressions.items for expr in live)
+    assert not any(
+        ref.endswith("K:reload_c") for ref in expressions.items_by_reference
+    )
+
+SHARED_MODULE_CONFIG = CONFIG.replace("""reload_test = 1
+""", """reload_test = 1
+reload_test2 = 1
+
+[reload_test2]
+csv = config/reload_test2.csv
+py = config/reload_test.py
+""")
+
+def test_reload_shared_module(tmp_path):
+    config_path = tmp_path.joinpath("config")
+    config_path.mkdir()
+    config_path.joinpath("default.conf").write_text(SHARED_MODULE_CONFIG)
+    py_file = config_path.joinpath("reload_test.py")
+    py_file.write_text(
+        "def setup(shared):\n    shared.setup_calls.append(1)\n"
+        "def expression(a, b):\n    pass\n"
+    )
+    csv_file = config_path.joinpath("reload_test.csv")
+    csv_file.write_text("InternalSource;InternalSource\nreload_a;reload_b\n")
+    config_path.joinpath("reload_test2.csv").write_text("InternalSource;InternalSource\nreload_x;reload_y\n")
+
+    shared = Shared.Shared("test", "", str(tmp_path), "")
+    shared.setup_calls = []
+    controllers = Controllers.Controllers(shared)
+    controllers.load("netdef")
+    sources = Sources.Sources(shared)
+    sources.load("netdef")
+    rules = Rules.Rules(shared)
+    rules.load("netdef")
+    sources.init()
+    rules.init()
+    rule = rules.instances["CSVRule"]
+    rule.setup()
+    setup_calls = len(shared.setup_calls)
+    assert len(rule.snapshot.modules) == 2
+
+    # an expression is added, but the module is unchanged. setup is not run again
+    csv_file.write_text("InternalSource;InternalSource\nreload_a;reload_b\nreload_a;reload_c\n")
+    rule.loop_reload()
+    assert len(rule._live_expressions["reload_test"]) == 2
+    assert len(shared.setup_calls) == setup_calls
+    # the module of the previous parse is removed
+    assert len(rule.snapshot.modules) == 2
+
+    # a rule file that fails to parse does not leave its module behind
+    csv_file.write_text("InternalSource;InternalSource\nreload_a;reload_b\n\nreload_a;reload_c\n")
+    assert rule.reload_entry("reload_test") is False
+    assert len(rule._live_expressions["reload_test"]) == 2
+    assert len(rule.snapshot.modules) == 2
+    csv_file.write_text("InternalSource;InternalSource\nreload_a;reload_b\nreload_a;reload_c\n")
+
+    # both rule files use the module and are reloaded
+    py_file.write_text(
+        "def setup(shared):\n    shared.setup_calls.append(2)\n"
+        "def expression(a, b):\n    return 1\n"
+    )
+    assert sorted(rule.snapshot.changed_entries()) == ["reload_test", "reload_test2"]
+    rule.reload_entry("reload_test")
+    rule.reload_entry("reload_test2")
+    assert 2 in shared.setup_calls
+    live = [expr for exprs in rule._live_expressions.values() for key, expr in exprs]
+    assert len(live) == 3
+    assert all(expr.expression(None, None) == 1 for expr in live)
+    assert len(rule.snapshot.modules) == 2
@@ -0,0 +1,73 @@
+from netdef.Shared.SharedConfig import Config
+from netdef.Rules.utils import import_file
+from netdef.Rules.BaseRule import ExpressionInfo, SourceInfo
+from netdef.Rules.snapshot import RuleSnapshot
+from netdef.Engines.expression.Expression import Expression
+
+PROJ = "./tests/shared/sharedconfig"
+
+def get_shared(snapshot_path):
+    class Shared():
+        config = Config("test", "..", PROJ, """
+        [general]
+        identifier = test
+        version = 1
+
+        [snapshot]
+        on = 1
+        path = {}
+        """.format(snapshot_path))
+    return Shared()
+
+def record(snapshot, tmp_path):
+    rule_file = tmp_path.joinpath("rule.csv")
+    rule_file.write_text("A\nkey1\n")
+
+    py_file = tmp_path.joinpath("rule.py")
+    py_file.write_text("def expression(a):\n    return a\n")
+    module = import_file(str(py_file), "TestRule", "rule")
+
+    snapshot.begin("rule", rule_file)
+    snapshot.add_parser("A", "C")
+    snapshot.add_expression(
+        ExpressionInfo(module, [SourceInfo("A", "key1")]),
+        [("key1", "A", "C", "TestRule", None)]
+    )
+    return rule_file
+
+def test_save_and_load(tmp_path):
+    shared = get_shared(tmp_path)
+    snapshot = RuleSnapshot("TestRule", shared)
+    assert snapshot.on == 1
+    assert snapshot.load() == False
+
+    record(snapshot, tmp_path)
+    assert snapshot.save() == True
+
+    loaded = RuleSnapshot("TestRule", shared)
+    assert loaded.load() == True
+    entry = loaded.entries["rule"]
+    assert entry.parsers == [("A", "C")]
+    module_index, func, setup, arguments = entry.expressions[0]
+    assert func == "expression"
+    assert setup is None
+    assert arguments == (("key1", "A", "C", "TestRule", None),)
+    assert loaded.get_module(module_index).expression(1) == 1
+
+def test_changed_rule_file(tmp_path):
+    shared = get_shared(tmp_path)
+    snapshot = RuleSnapshot("TestRule", shared)
+    rule_file = record(snapshot, tmp_path)
+    snapshot.save()
+
+    rule_file.write_text("A\nkey2\n")
+    assert RuleSnapshot("TestRule", shared).load() == False
+
+def test_incomplete_snapshot(tmp_path):
+    shared = get_shared(tmp_path)
+    snapshot = RuleSnapshot("TestRule", shared)
+    # expressions without a python module cannot be imported from snapshot
+    expr_info = ExpressionInfo(Expression(print, "print"), [SourceInfo("A", "key1")])
+    snapshot.add_expression(expr_info, [("key1", "A", "C", "TestRule", None)])
+    assert snapshot.complete == False
+    assert snapshot.save() == False
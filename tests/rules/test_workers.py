@@ -0,0 +1,74 @@
+import threading
+from netdef.Shared.SharedConfig import Config
+from netdef.Shared.SharedQueues import SharedQueues, MessageType
+from netdef.Sources.BaseSource import BaseSource
+from netdef.Rules.BaseRule import BaseRule
+
+PROJ = "./tests/shared/sharedconfig"
+
+class Shared():
+    def __init__(self):
+        self.config = Config("test", "..", PROJ, """
+        [general]
+        identifier = test
+        version = 1
+
+        [rule_workers]
+        WorkerRule = 3
+        """)
+        self.queues = SharedQueues()
+        self.queues.add_rule("WorkerRule")
+
+class WorkerRule(BaseRule):
+    def __init__(self, name, shared):
+        super().__init__(name, shared)
+        self.handled = []
+        self.done = threading.Event()
+
+    def handle_run_expression(self, incoming):
+        self.handled.append((incoming.key, incoming.value, threading.current_thread().name))
+        if len(self.handled) == 30:
+            self.done.set()
+
+def test_workers_preserve_order():
+    shared = Shared()
+    rule = WorkerRule("WorkerRule", shared)
+    interrupt = threading.Event()
+    rule.add_interrupt(interrupt)
+    assert rule.workers == 3
+
+    for value in range(10):
+        for key in ("a", "b", "c"):
+            source = BaseSource(key=key, value=value, controller="C", source="S")
+            shared.queues.send_message_to_rule(MessageType.RUN_EXPRESSION, "WorkerRule", source)
+
+    rule.loop_incoming()
+    assert rule.done.wait(5)
+    interrupt.set()
+
+    for key in ("a", "b", "c"):
+        values = [value for k, value, thread_name in rule.handled if k == key]
+        threads = set(thread_name for k, value, thread_name in rule.handled if k == key)
+        assert values == list(range(10))
+        assert len(threads) == 1
+
+def test_workers_batch():
+    shared = Shared()
+    rule = WorkerRule("WorkerRule", shared)
+    interrupt = threading.Event()
+    rule.add_interrupt(interrupt)
+
+    for value in range(10):
+        batch = [
+            BaseSource(key=key, value=value, controller="C", source="S")
+            for key in ("a", "b", "c")
+        ]
+        shared.queues.send_message_to_rule(MessageType.RUN_EXPRESSION_BATCH, "WorkerRule", batch)
+
+    rule.loop_incoming()
+    assert rule.done.wait(5)
+    interrupt.set()
+
+    for key in ("a", "b", "c"):
+        values = [value for k, value, thread_name in rule.handled if k == key]
+        assert values == list(range(10))
@@ -1,5 +1,6 @@
 import pytest
 import os
+from concurrent.futures import ThreadPoolExecutor
 from netdef.Shared.SharedConfig import Config
 from netdef.Shared import SharedConfig
 
@@ -99,3 +100,20 @@ def test_config_config_internal_cache():
     # with cache (the default)
     assert conf.config("section2", "key2", "first", True) == "first"
     assert conf.config("section2", "key2", "second", True) == "first"
+
+def test_config_from_many_threads():
+    conf = Config("test", "..", PROJ, """
+    [general]
+    identifier = test
+    version = 1
+    """)
+
+    def setup(n):
+        for i in range(50):
+            assert conf.config("section{}".format(i), "key{}".format(n), n) == n
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(setup, range(8)))
+
+    for i in range(50):
+        assert len(conf.get_dict("section{}".format(i))) == 8
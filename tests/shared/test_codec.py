@@ -0,0 +1,39 @@
+import decimal
+import datetime
+import pytest
+from netdef.Shared import codec
+from netdef.Sources.MQTTDataAccessBinarySource import MQTTDataAccessBinarySource
+
+VALUES = [None, True, False, 0, -1, 2**63 - 1, 2**64, 1.5, "", "æøå", b"\x00\x01", [1, "a"], {"a": None},
+          datetime.datetime(2019, 7, 1, 12, 0, 0, 123456),
+          datetime.datetime(1900, 1, 1, tzinfo=datetime.timezone(datetime.timedelta(hours=-5))),
+          decimal.Decimal("1.10")]
+
+def test_encode_decode():
+    for value in VALUES:
+        decoded = codec.decode(codec.encode(value))
+        assert decoded == value
+        assert type(decoded) is type(value)
+
+def test_bytes_are_not_copied():
+    data = bytearray(b"abc")
+    code, encoded = codec.encode_value(data)
+    assert code == codec.BYTES
+    assert encoded is data
+
+def test_unsupported_type():
+    with pytest.raises(TypeError):
+        codec.encode({1, 2})
+
+def test_unknown_code():
+    with pytest.raises(ValueError):
+        codec.decode(b"\xff")
+
+def test_mqtt_binary_payload():
+    src = MQTTDataAccessBinarySource(key="tank/level")
+    stime = datetime.datetime(2019, 7, 1, 12, 0, 0)
+    topic, payload = src.make_message(src.key, src.pack_value(12.5, stime))
+    assert isinstance(payload, bytes) and len(payload) == 18
+    key, data = src.parse_message(topic, payload)
+    assert src.can_unpack_value(data)
+    assert src.unpack_value(data) == ("tank/level", datetime.datetime.utcfromtimestamp(stime.timestamp()), 12.5)